@@ -1,5 +1,5 @@
 from django.contrib import admin
-from base.models import Device, VideoCall, CallQueue
+from base.models import Device, VideoCall, CallQueue, CallStatsBucket
 
 
 @admin.register(Device)
@@ -31,3 +31,15 @@ class CallQueueAdmin(admin.ModelAdmin):
     def has_add_permission(self, request):
         # Prevent manual creation of devices through admin
         return False
+
+
+@admin.register(CallStatsBucket)
+class CallStatsBucketAdmin(admin.ModelAdmin):
+    list_display = ['bucket_start', 'calls_started', 'calls_ended', 'total_duration_seconds', 'peak_queue_depth']
+    readonly_fields = ['bucket_start', 'calls_started', 'calls_ended', 'total_duration_seconds',
+                       'duration_histogram', 'peak_queue_depth']
+    ordering = ['-bucket_start']
+    
+    def has_add_permission(self, request):
+        # Rows are maintained by the rollups and the backfill_call_stats command
+        return False
@@ -0,0 +1,122 @@
+import asyncio
+import uuid
+from collections import deque
+
+from django.conf import settings
+from django.utils import timezone
+
+from base import codec, rollups
+from base.metrics import database_sync_to_async
+from base.models import VideoCall
+
+
+def recent_calls(limit=10):
+    """Latest completed calls, newest first, in the call-history shape"""
+    calls = VideoCall.objects.filter(status='ended').order_by('-ended_at').values_list(
+        'id', 'participant1_id', 'participant2_id', 'started_at', 'ended_at', 'duration_seconds'
+    )[:limit]
+    return [
+        {
+            'id': call_id,
+            'participant1': str(participant1)[:8],
+            'participant2': str(participant2)[:8],
+            'started_at': started_at,
+            'ended_at': ended_at,
+            'duration_seconds': duration,
+            'status': 'ended'
+        }
+        for call_id, participant1, participant2, started_at, ended_at, duration in calls
+    ]
+
+
+def call_totals(limit=10):
+    return recent_calls(limit), rollups.total_calls()
+
+
+class AdminMetricsTicker:
+    """
+    Pushes aggregated queue and call metrics to admin dashboards.
+
+    The metrics are collected and encoded once per tick and sent to the
+    per-process ``group_name`` as a ready-made frame, so the cost is the
+    same for one admin or fifty. The tick only runs while someone in this
+    process is subscribed.
+    """
+
+    def __init__(self, queue, calls, interval=None, group_name='admin_metrics', recent=10):
+        self.queue = queue
+        self.calls = calls
+        self.interval = interval or getattr(settings, 'ADMIN_METRICS_INTERVAL', 2)
+        # Unique per process; pids repeat across containers
+        self.group_name = f'{group_name}.{uuid.uuid4().hex[:12]}'
+        self.recent = recent
+        self.collect_recent = database_sync_to_async(call_totals)
+
+        self.subscribers = 0
+        self.ticks = 0
+        self.matches = 0
+        # Seconds the matched partner had waited, for the latest matches
+        self.latencies = deque(maxlen=200)
+        self.last_frame = None
+        self._task = None
+
+    def record_match(self, waited):
+        self.matches += 1
+        self.latencies.append(waited.total_seconds())
+
+    async def subscribe(self, channel_layer):
+        """Count a new admin in and return the latest frame for it"""
+        self.subscribers += 1
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._run(channel_layer))
+        return self.last_frame or await self.tick(channel_layer, send=False)
+
+    def unsubscribe(self):
+        self.subscribers = max(self.subscribers - 1, 0)
+        if not self.subscribers:
+            # Nobody is watching; the next admin must not get a stale frame
+            self.last_frame = None
+            if self._task is not None:
+                self._task.cancel()
+                self._task = None
+
+    async def _run(self, channel_layer):
+        while self.subscribers:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick(channel_layer)
+            except Exception:
+                # A failed tick is skipped; dashboards keep the last frame
+                pass
+
+    async def tick(self, channel_layer, send=True):
+        frame = codec.dumps(await self.collect())
+        self.last_frame = frame
+        self.ticks += 1
+        if send:
+            await channel_layer.group_send(self.group_name, {
+                'type': 'admin_metrics',
+                'frame': frame
+            })
+        return frame
+
+    async def collect(self):
+        calls, total_calls = await self.collect_recent(self.recent)
+        latencies = sorted(self.latencies)
+        return {
+            'type': 'admin_metrics',
+            'queue_depth': await self.queue.size(),
+            'active_calls': await self.calls.size(),
+            'total_calls': total_calls,
+            'recent_calls': calls,
+            'match_latency': {
+                'matches': self.matches,
+                'window': len(latencies),
+                'avg_seconds': round(sum(latencies) / len(latencies), 2) if latencies else None,
+                'p50_seconds': round(latencies[len(latencies) // 2], 2) if latencies else None,
+                'max_seconds': round(latencies[-1], 2) if latencies else None,
+            },
+            'subscribers': self.subscribers,
+            'timestamp': timezone.now()
+        }
@@ -1,6 +1,33 @@
+import atexit
+
 from django.apps import AppConfig
 
 
 class BaseConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "base"
+
+    def ready(self):
+        from django.db.models.signals import post_delete, post_save
+
+        from base.auth_cache import invalidate_device
+        from base.models import Device
+        from base.persistence import call_persistence
+        from base.poll_cache import devices_changed
+        from base.presence import device_deleted, device_saved, presence_store
+
+        # Write buffered heartbeats and queued call writes back before the
+        # worker exits
+        atexit.register(presence_store.close)
+        atexit.register(call_persistence.close)
+
+        # Cached token lookups and polled device lists must not outlive
+        # edits made elsewhere
+        post_save.connect(invalidate_device, sender=Device, dispatch_uid='base.auth_cache.save')
+        post_delete.connect(invalidate_device, sender=Device, dispatch_uid='base.auth_cache.delete')
+        post_save.connect(devices_changed, sender=Device, dispatch_uid='base.poll_cache.save')
+        post_delete.connect(devices_changed, sender=Device, dispatch_uid='base.poll_cache.delete')
+        # New and re-authenticated devices show up in active-user queries
+        # without waiting for the index to reload
+        post_save.connect(device_saved, sender=Device, dispatch_uid='base.presence.save')
+        post_delete.connect(device_deleted, sender=Device, dispatch_uid='base.presence.delete')
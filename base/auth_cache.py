@@ -0,0 +1,118 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.utils import timezone
+
+from base.models import Device
+from base.presence import presence_store
+
+
+class DeviceAuthCache:
+    """
+    In-process LRU of validated ``MC_`` tokens and the devices they map to.
+
+    Shared by the REST login and the video call socket, so a reconnect with a
+    known token costs no queries: the heartbeat goes through the presence
+    store and the row is only written when ``user_agent``/``ip_address``
+    actually changed. Entries expire after ``ttl`` seconds and are dropped
+    through ``invalidate`` whenever a device is saved or deleted elsewhere.
+    """
+
+    def __init__(self, max_size=None, ttl=None, clock=time.monotonic):
+        self.max_size = max_size or getattr(settings, 'AUTH_CACHE_SIZE', 10000)
+        self.ttl = ttl or getattr(settings, 'AUTH_CACHE_TTL', 300)
+        self.clock = clock
+
+        self._entries = OrderedDict()
+        self._tokens = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, token):
+        """Cached device for ``token``, or None if unknown or expired"""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            device, expires_at = entry
+            if expires_at <= self.clock():
+                self._discard(token)
+                return None
+            self._entries.move_to_end(token)
+            return device
+
+    def put(self, device):
+        with self._lock:
+            self._discard(device.token)
+            self._entries[device.token] = (device, self.clock() + self.ttl)
+            self._tokens[str(device.uuid)] = device.token
+            while len(self._entries) > self.max_size:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate(self, token=None, device_uuid=None):
+        with self._lock:
+            if device_uuid is not None:
+                token = self._tokens.get(str(device_uuid), token)
+            if token is not None:
+                self._discard(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens.clear()
+
+    def _discard(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            self._tokens.pop(str(entry[0].uuid), None)
+
+    def authenticate(self, token, user_agent='', ip_address=None):
+        """
+        Return ``(device, created)`` for ``token``, creating the device if needed.
+
+        The returned device is a copy; changing it does not touch the cache.
+        """
+        device = self.get(token)
+        created = False
+        if device is None:
+            self.misses += 1
+            device, created = Device.objects.get_or_create(
+                token=token,
+                defaults={
+                    'is_authenticated': True,
+                    'user_agent': user_agent,
+                    'ip_address': ip_address
+                }
+            )
+        else:
+            self.hits += 1
+            device = copy.copy(device)
+
+        if not created:
+            if (device.is_authenticated, device.user_agent, device.ip_address) != (True, user_agent, ip_address):
+                device.is_authenticated = True
+                device.user_agent = user_agent
+                device.ip_address = ip_address
+                device.save(update_fields=['is_authenticated', 'user_agent', 'ip_address', 'last_seen'])
+            else:
+                # Nothing to write; the login still counts as a heartbeat
+                device.last_seen = timezone.now()
+                presence_store.touch(device.uuid, device.last_seen)
+
+        self.put(device)
+        return copy.copy(device), created
+
+
+def invalidate_device(sender, instance, **kwargs):
+    """``post_save``/``post_delete`` receiver, connected from the app config"""
+    device_auth_cache.invalidate(token=instance.token, device_uuid=instance.uuid)
+
+
+device_auth_cache = DeviceAuthCache()
@@ -0,0 +1,127 @@
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+from base import metrics
+
+DROP_OLDEST = 'drop_oldest'
+LATEST = 'latest'
+DISCONNECT = 'disconnect'
+POLICIES = (DROP_OLDEST, LATEST, DISCONNECT)
+
+# Close code for clients that fell too far behind
+SLOW_CLIENT_CLOSE_CODE = 4429
+
+QUEUED = metrics.registry.gauge(
+    'zest_outbound_queued_frames', 'Frames waiting in per-connection outbound queues'
+)
+DROPPED = metrics.registry.counter(
+    'zest_outbound_dropped_total', 'Frames dropped from full outbound queues', ('policy',)
+)
+REPLACED = metrics.registry.counter(
+    'zest_outbound_replaced_total', 'Pending frames replaced by a newer one of the same kind'
+)
+DISCONNECTED = metrics.registry.counter(
+    'zest_outbound_disconnects_total', 'Connections closed for not keeping up'
+)
+
+
+class OutboundQueue:
+    """
+    Bounded buffer between fan-out and one client's socket.
+
+    ``put`` never waits: the frame is queued and a writer task sends queued
+    frames one at a time, so a client that stops reading only stalls its
+    own writer and holds at most ``max_size`` frames. Once full, the policy
+    decides what happens:
+
+    - ``drop_oldest``: the oldest pending frame is dropped.
+    - ``latest``: a frame put with a ``key`` (e.g. a full snapshot) replaces
+      the pending one with that key in place; others fall back to
+      ``drop_oldest``.
+    - ``disconnect``: ``on_overflow`` is scheduled to close the connection.
+    """
+
+    def __init__(self, send, on_overflow=None, max_size=None, policy=None):
+        self.send = send
+        self.on_overflow = on_overflow
+        self.max_size = max_size or getattr(settings, 'OUTBOUND_QUEUE_SIZE', 32)
+        self.policy = policy or getattr(settings, 'OUTBOUND_QUEUE_POLICY', LATEST)
+        if self.policy not in POLICIES:
+            raise ValueError(f'Unknown outbound queue policy {self.policy!r}')
+
+        # Entries are [key, frame] so a replacement keeps its place in line
+        self.entries = deque()
+        self.keyed = {}
+        self.dropped = 0
+        self.replaced = 0
+        self.overflowed = False
+        self._writer = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def put(self, frame, key=None):
+        """Queue an encoded frame; returns False if it was not queued"""
+        if self.overflowed:
+            return False
+
+        if key is not None and self.policy == LATEST:
+            entry = self.keyed.get(key)
+            if entry is not None:
+                entry[1] = frame
+                self.replaced += 1
+                REPLACED.inc()
+                return True
+
+        if len(self.entries) >= self.max_size:
+            if self.policy == DISCONNECT:
+                self.overflowed = True
+                DISCONNECTED.inc()
+                self.clear()
+                if self.on_overflow is not None:
+                    asyncio.get_running_loop().create_task(self.on_overflow())
+                return False
+            self._forget(self.entries.popleft())
+            self.dropped += 1
+            DROPPED.inc(self.policy)
+            QUEUED.dec()
+
+        entry = [key, frame]
+        self.entries.append(entry)
+        if key is not None:
+            self.keyed[key] = entry
+        QUEUED.inc()
+
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.get_running_loop().create_task(self._drain())
+        return True
+
+    def _forget(self, entry):
+        if entry[0] is not None and self.keyed.get(entry[0]) is entry:
+            del self.keyed[entry[0]]
+
+    async def _drain(self):
+        while self.entries:
+            entry = self.entries.popleft()
+            self._forget(entry)
+            QUEUED.dec()
+            try:
+                await self.send(text_data=entry[1])
+            except Exception:
+                # The socket is gone; disconnect will close the queue
+                self.clear()
+                return
+
+    def clear(self):
+        QUEUED.dec(amount=len(self.entries))
+        self.entries.clear()
+        self.keyed.clear()
+
+    def close(self):
+        """Drop whatever is pending and stop the writer"""
+        self.clear()
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
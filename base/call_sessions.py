@@ -0,0 +1,126 @@
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from base.timing_wheel import TimingWheel
+
+
+class CallSession:
+    """Compact record of an active call between two devices"""
+
+    __slots__ = ('call_id', 'participants', 'channels', 'started_at')
+
+    def __init__(self, call_id, participants, channels, started_at=None):
+        self.call_id = call_id
+        self.participants = tuple(participants)
+        self.channels = tuple(channels)
+        self.started_at = started_at or timezone.now()
+
+    def __repr__(self):
+        return f"<CallSession {self.call_id}>"
+
+    def channel_for(self, device_uuid):
+        """Channel name of ``device_uuid`` in this call, if it takes part"""
+        if device_uuid == self.participants[0]:
+            return self.channels[0]
+        if device_uuid == self.participants[1]:
+            return self.channels[1]
+        return None
+
+    def partner_of(self, device_uuid):
+        if device_uuid == self.participants[0]:
+            return self.participants[1]
+        if device_uuid == self.participants[1]:
+            return self.participants[0]
+        return None
+
+
+class CallSessionStore:
+    """
+    Where active call state lives.
+
+    Every session expires ``ttl`` seconds after it is created, so state from
+    crashed workers or racing disconnects cannot pile up. ``delete`` reports
+    whether this caller removed the session, so only one side of a call runs
+    the end-of-call work.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or getattr(settings, 'CALL_SESSION_TTL', 4 * 60 * 60)
+        self.created = 0
+        self.deleted = 0
+        self.expired = 0
+
+    async def create(self, session):
+        raise NotImplementedError
+
+    async def get(self, call_id):
+        raise NotImplementedError
+
+    async def delete(self, call_id):
+        raise NotImplementedError
+
+    async def size(self):
+        raise NotImplementedError
+
+    async def stats(self):
+        return {
+            'size': await self.size(),
+            'created': self.created,
+            'deleted': self.deleted,
+            'expired': self.expired,
+            'ttl': self.ttl,
+        }
+
+
+class InMemoryCallSessionStore(CallSessionStore):
+    """
+    Process-local sessions; only usable with a single worker.
+
+    Expiry runs on a timing wheel that is advanced on every access, so
+    reaping costs O(expired) instead of a scan over all sessions.
+    """
+
+    def __init__(self, ttl=None, tick=None, clock=time.monotonic):
+        super().__init__(ttl)
+        self.sessions = {}
+        # One revolution covers the TTL; expiry is accurate to one tick
+        self.wheel = TimingWheel(tick=tick or max(1.0, self.ttl / 256), slots=257, clock=clock)
+
+    def reap(self):
+        """Drop sessions whose TTL ran out; returns their call ids"""
+        expired = self.wheel.advance()
+        for call_id in expired:
+            del self.sessions[call_id]
+        self.expired += len(expired)
+        return expired
+
+    async def create(self, session):
+        self.reap()
+        self.sessions[session.call_id] = session
+        self.wheel.schedule_in(session.call_id, self.ttl)
+        self.created += 1
+
+    async def get(self, call_id):
+        self.reap()
+        return self.sessions.get(call_id)
+
+    async def delete(self, call_id):
+        self.reap()
+        if self.sessions.pop(call_id, None) is None:
+            return False
+        self.wheel.cancel(call_id)
+        self.deleted += 1
+        return True
+
+    async def size(self):
+        self.reap()
+        return len(self.sessions)
+
+
+def get_call_session_store():
+    """Build the store configured by ``CALL_SESSION_BACKEND``"""
+    backend = getattr(settings, 'CALL_SESSION_BACKEND', 'base.call_sessions.InMemoryCallSessionStore')
+    return import_string(backend)()
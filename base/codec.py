@@ -0,0 +1,86 @@
+import datetime
+import decimal
+import json
+import uuid
+
+from django.db.models.query import QuerySet
+from django.utils.encoding import force_str
+from django.utils.functional import Promise
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is an optional speedup
+    orjson = None
+
+# orjson.JSONDecodeError subclasses this, so callers catch one type either way
+JSONDecodeError = json.JSONDecodeError
+
+
+def default(obj):
+    """
+    Encode the types JSON has no literal for.
+
+    Datetimes use ``isoformat()`` and UUIDs ``str()``, exactly as orjson
+    writes them natively, so both backends produce the same text.
+    """
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, uuid.UUID):
+        return str(obj)
+    if isinstance(obj, datetime.timedelta):
+        return str(obj.total_seconds())
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    if isinstance(obj, Promise):
+        return force_str(obj)
+    if isinstance(obj, (QuerySet, set, frozenset)):
+        return list(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumpb(obj):
+        """Encode ``obj`` to UTF-8 JSON bytes"""
+        return orjson.dumps(obj, default=default, option=_OPTIONS)
+
+    def dumps(obj):
+        """Encode ``obj`` to a JSON string"""
+        return orjson.dumps(obj, default=default, option=_OPTIONS).decode()
+
+    loads = orjson.loads
+
+else:  # pragma: no cover - exercised only without orjson installed
+    _encoder = json.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumpb(obj):
+        """Encode ``obj`` to UTF-8 JSON bytes"""
+        return _encoder.encode(obj).encode()
+
+    def dumps(obj):
+        """Encode ``obj`` to a JSON string"""
+        return _encoder.encode(obj)
+
+    loads = json.loads
+
+
+class JSONCodecMixin:
+    """
+    Consumer mixin that sends and receives JSON through this codec.
+
+    Mirrors ``AsyncJsonWebsocketConsumer``'s ``encode_json``/``decode_json``
+    hooks but keeps ``receive`` raw, so frames the consumer only relays never
+    get parsed.
+    """
+
+    @classmethod
+    async def decode_json(cls, text_data):
+        return loads(text_data)
+
+    @classmethod
+    async def encode_json(cls, content):
+        return dumps(content)
+
+    async def send_json(self, content, close=False):
+        await self.send(text_data=await self.encode_json(content), close=close)
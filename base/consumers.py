@@ -1,22 +1,69 @@
-import json
+import asyncio
+import time
 import uuid
-from datetime import datetime, timedelta
+from urllib.parse import parse_qs
 
-from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
 from django.utils import timezone
 
-from base.models import Device, VideoCall, CallQueue
+from base import codec, metrics
+from base.admin_metrics import AdminMetricsTicker
+from base.auth_cache import device_auth_cache
+from base.backpressure import SLOW_CLIENT_CLOSE_CODE, OutboundQueue
+from base.call_sessions import CallSession, get_call_session_store
+from base.codec import JSONCodecMixin
+from base.matchmaking import RecentPartners, Waiter, get_matchmaker
+from base.metrics import MetricsConsumerMixin, database_sync_to_async
+from base.persistence import call_persistence
+from base.profiling import ProfilingConsumerMixin
+from base.reaper import IDLE_CLOSE_CODE, IdleReaper
+from base.presence import count_active_users, get_active_users, presence_broadcaster, presence_store
+from base.signaling import ice_batch_frame, match_relay
 
-# In-memory queue for real-time matching
-WAITING_QUEUE = {}
-ACTIVE_CALLS = {}
+# Queue for real-time matching and active call state; in-memory by default,
+# shared through Redis across workers when REDIS_URL is configured
+WAITING_QUEUE = get_matchmaker()
+ACTIVE_CALLS = get_call_session_store()
+ADMIN_METRICS = AdminMetricsTicker(WAITING_QUEUE, ACTIVE_CALLS)
+IDLE_REAPER = IdleReaper(queue=WAITING_QUEUE)
+if hasattr(WAITING_QUEUE, 'is_stale'):
+    # In-process queue only; Redis waiters expire by TTL instead
+    WAITING_QUEUE.is_stale = IDLE_REAPER.is_stale_waiter
+if hasattr(WAITING_QUEUE, 'recent'):
+    RECENT_PARTNERS = RecentPartners()
+    WAITING_QUEUE.recent = RECENT_PARTNERS
+else:
+    # The Redis scripts match on bucket heads alone, so don't track or seed
+    RECENT_PARTNERS = RecentPartners(cooldown=0)
 
 
-class LiveUsersConsumer(AsyncWebsocketConsumer):
+async def collect_call_state():
+    """Refresh the queue and call gauges before each /metrics scrape"""
+    metrics.QUEUE_DEPTH.set(await WAITING_QUEUE.size())
+    metrics.ACTIVE_CALLS.set(await ACTIVE_CALLS.size())
+
+
+metrics.registry.add_collector(collect_call_state)
+
+
+class LiveUsersConsumer(ProfilingConsumerMixin, MetricsConsumerMixin, JSONCodecMixin, AsyncWebsocketConsumer):
+    metrics_name = 'live_users'
+    message_types = ('user_online', 'ping', 'resync')
+    
     async def connect(self):
-        # Join the live users group
-        self.group_name = "live_users"
+        # Fan-out frames and replies go through a bounded per-connection queue
+        self.outbound = OutboundQueue(self.send, self.close_slow_client)
+        
+        # Protocol 2 (opt-in via ?protocol=2) gets one snapshot, then deltas
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.protocol = 2 if query.get('protocol') == ['2'] else 1
+        
+        # Join this process's delta group or one of its snapshot shards
+        if self.protocol == 2:
+            self.group_name = presence_broadcaster.delta_group
+        else:
+            self.group_name = presence_broadcaster.shard_group(self.channel_name)
         await self.channel_layer.group_add(
             self.group_name,
             self.channel_name
@@ -24,10 +71,21 @@ class LiveUsersConsumer(AsyncWebsocketConsumer):
         
         await self.accept()
         
+        # Make sure buffered heartbeats get written back periodically
+        presence_store.start()
+        # Idle and orphan sweeps
+        IDLE_REAPER.start()
+        # Pick up changes made on other workers while anyone here is listening
+        presence_broadcaster.subscribe(self.channel_layer, self.channel_name)
+        
         # Send current active users count
         await self.send_active_users_count()
     
     async def disconnect(self, close_code):
+        IDLE_REAPER.unregister(self.channel_name)
+        presence_broadcaster.unsubscribe(self.channel_name)
+        self.outbound.close()
+        
         # Leave the live users group
         await self.channel_layer.group_discard(
             self.group_name,
@@ -39,8 +97,11 @@ class LiveUsersConsumer(AsyncWebsocketConsumer):
             await self.update_device_offline(self.device_uuid)
     
     async def receive(self, text_data):
+        started = time.perf_counter()
+        message_type = None
+        IDLE_REAPER.touch(self.channel_name)
         try:
-            text_data_json = json.loads(text_data)
+            text_data_json = codec.loads(text_data)
             message_type = text_data_json.get('type')
             
             if message_type == 'user_online':
@@ -52,129 +113,174 @@ class LiveUsersConsumer(AsyncWebsocketConsumer):
             
             elif message_type == 'ping':
                 # Handle ping to keep connection alive and update activity
+                IDLE_REAPER.keepalive(self)
                 if hasattr(self, 'device_uuid') and self.device_uuid:
                     await self.update_device_activity(self.device_uuid)
                     
-                await self.send(text_data=json.dumps({
+                await self.send_json({
                     'type': 'pong',
-                    'timestamp': timezone.now().isoformat()
-                }))
+                    'timestamp': timezone.now()
+                })
+            
+            elif message_type == 'resync':
+                # Protocol 2 client noticed a gap in seq
+                await self.send_active_users_count()
         
-        except json.JSONDecodeError:
-            await self.send(text_data=json.dumps({
+        except codec.JSONDecodeError:
+            await self.send_json({
                 'type': 'error',
                 'message': 'Invalid JSON'
-            }))
+            })
+        finally:
+            metrics.observe_handler(
+                self.metrics_name,
+                message_type if message_type in self.message_types else 'other',
+                started
+            )
+    
+    async def reap(self):
+        """Called by the idle reaper once the client stopped pinging"""
+        # A half-open socket may never deliver websocket.disconnect
+        await self.disconnect(IDLE_CLOSE_CODE)
+        self.device_uuid = None
+        await self.close(code=IDLE_CLOSE_CODE)
+    
+    async def close_slow_client(self):
+        """Called by the outbound queue when the client can't keep up"""
+        await self.close(code=SLOW_CLIENT_CLOSE_CODE)
+    
+    async def send_json(self, content, close=False):
+        # Replies queue behind pending fan-out frames so the order holds
+        self.outbound.put(await self.encode_json(content))
+        if close:
+            await self.close()
     
     async def user_count_update(self, event):
         """
-        Handler for user_count_update messages from the group
+        Handler for user_count_update messages from the group; a newer
+        snapshot replaces one the client hasn't received yet
+        """
+        self.outbound.put(event['frame'], key='snapshot')
+    
+    async def presence_delta(self, event):
+        """
+        Handler for protocol 2 presence deltas from the group
         """
-        await self.send(text_data=json.dumps({
-            'type': 'user_count_update',
-            'active_users': event['active_users'],
-            'timestamp': event['timestamp']
-        }))
+        self.outbound.put(event['frame'])
     
     @database_sync_to_async
     def get_active_users_count(self):
         """Get count of users active in the last 30 seconds"""
-        cutoff_time = timezone.now() - timedelta(seconds=30)
-        return Device.objects.filter(last_seen__gte=cutoff_time).count()
+        return count_active_users()
     
     @database_sync_to_async
     def get_active_users_list(self):
         """Get list of active users with their details"""
-        cutoff_time = timezone.now() - timedelta(seconds=30)
-        devices = Device.objects.filter(last_seen__gte=cutoff_time).order_by('-last_seen')
-        
-        return [
-            {
-                'uuid': str(device.uuid),
-                'last_seen': device.last_seen.isoformat(),
-                'created_at': device.created_at.isoformat(),
-                'user_agent': device.user_agent[:100] if device.user_agent else None,  # Truncate for privacy
-                'ip_address': device.ip_address
-            }
-            for device in devices
-        ]
+        return get_active_users()
     
-    @database_sync_to_async
-    def update_device_activity(self, device_uuid):
-        """Update device last_seen timestamp"""
-        try:
-            device = Device.objects.get(uuid=device_uuid)
-            device.save()  # This updates last_seen due to auto_now=True
-            return True
-        except Device.DoesNotExist:
-            return False
+    async def update_device_activity(self, device_uuid):
+        """Record a heartbeat in the presence store; written back in bulk later"""
+        if not presence_store.is_known(device_uuid):
+            registered = await database_sync_to_async(presence_store.register)(device_uuid)
+            if not registered:
+                return False
+        presence_store.touch(device_uuid)
+        return True
     
-    @database_sync_to_async
-    def update_device_offline(self, device_uuid):
+    async def update_device_offline(self, device_uuid):
         """Mark device as offline by updating last_seen to a past time"""
-        try:
-            device = Device.objects.get(uuid=device_uuid)
-            # Update last_seen to indicate user went offline
-            device.last_seen = timezone.now() - timedelta(seconds=60)
-            device.save(update_fields=['last_seen'])
-            return True
-        except Device.DoesNotExist:
+        if not presence_store.is_known(device_uuid):
             return False
+        presence_store.mark_offline(device_uuid)
+        return True
     
     async def send_active_users_count(self):
         """Send the current active users count to this connection"""
-        active_count = await self.get_active_users_count()
+        if self.protocol == 2:
+            seq, active_users = await presence_broadcaster.resync(self.channel_layer)
+            await self.send_json({
+                'type': 'active_users',
+                'protocol': 2,
+                'seq': seq,
+                'count': len(active_users),
+                'users': active_users,
+                'timestamp': timezone.now()
+            })
+            return
+        
         active_users = await self.get_active_users_list()
         
-        await self.send(text_data=json.dumps({
+        await self.send_json({
             'type': 'active_users',
-            'count': active_count,
+            'count': len(active_users),
             'users': active_users,
-            'timestamp': timezone.now().isoformat()
-        }))
+            'timestamp': timezone.now()
+        })
     
     async def broadcast_user_update(self):
         """Broadcast user count update to all connections in the group"""
-        active_count = await self.get_active_users_count()
-        active_users = await self.get_active_users_list()
-        
-        await self.channel_layer.group_send(
-            self.group_name,
-            {
-                'type': 'user_count_update',
-                'active_users': {
-                    'count': active_count,
-                    'users': active_users
-                },
-                'timestamp': timezone.now().isoformat()
-            }
-        )
+        # Bursts of updates are merged into one snapshot and one group send
+        await presence_broadcaster.request(self.channel_layer)
 
 
-class VideoCallConsumer(AsyncWebsocketConsumer):
+class VideoCallConsumer(ProfilingConsumerMixin, MetricsConsumerMixin, JSONCodecMixin, AsyncWebsocketConsumer):
+    metrics_name = 'video_call'
+    message_types = (
+        'authenticate', 'join_queue', 'leave_queue', 'webrtc_offer', 'webrtc_answer', 'webrtc_ice', 'end_call', 'ping'
+    )
+    # Relay offer/answer/ICE frames verbatim instead of parsing and re-encoding
+    relay_passthrough = getattr(settings, 'SIGNALING_PASSTHROUGH', True)
+    # Seconds to collect ICE candidates into one webrtc_ice_batch; 0 disables
+    ice_batch_window = getattr(settings, 'SIGNALING_ICE_BATCH_WINDOW', 0)
+    
     async def connect(self):
         self.device_uuid = None
         self.call_id = None
         self.partner_uuid = None
+        self.ice_frames = []
+        self.ice_flush_task = None
+        self.relay_lock = asyncio.Lock()
         
         await self.accept()
+        
+        # Logins may only buffer a heartbeat; make sure it gets written back
+        presence_store.start()
+        # Load recent pairs once per process, in the background
+        RECENT_PARTNERS.start()
+        # Idle and orphan sweeps
+        IDLE_REAPER.start()
     
     async def disconnect(self, close_code):
+        IDLE_REAPER.unregister(self.channel_name)
+        
+        # Deliver candidates still waiting in the batch window
+        await self.flush_ice()
+        
         # Remove from queue
-        if self.device_uuid and self.device_uuid in WAITING_QUEUE:
-            del WAITING_QUEUE[self.device_uuid]
+        if self.device_uuid:
+            await WAITING_QUEUE.leave(self.device_uuid)
         
         # End call if in progress
-        if self.call_id and self.call_id in ACTIVE_CALLS:
+        if self.call_id:
             await self.end_call_cleanup()
         
         # Remove from database queue
         if self.device_uuid:
-            await self.remove_from_db_queue(self.device_uuid)
+            call_persistence.queue_leave(self.device_uuid)
     
     async def receive(self, text_data):
+        started = time.perf_counter()
+        message_type = None
+        IDLE_REAPER.touch(self.channel_name)
         try:
-            data = json.loads(text_data)
+            if self.relay_passthrough:
+                relay = match_relay(text_data)
+                if relay:
+                    message_type = relay[0]
+                    await self.relay_signal(*relay)
+                    return
+            
+            data = codec.loads(text_data)
             message_type = data.get('type')
             
             if message_type == 'authenticate':
@@ -191,9 +297,22 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
                 await self.handle_webrtc_ice(data)
             elif message_type == 'end_call':
                 await self.handle_end_call(data)
+            elif message_type == 'ping':
+                # Opts this socket into the idle reaper; see IdleReaper
+                IDLE_REAPER.keepalive(self)
+                await self.send_json({
+                    'type': 'pong',
+                    'timestamp': timezone.now()
+                })
                 
-        except json.JSONDecodeError:
+        except codec.JSONDecodeError:
             await self.send_error('Invalid JSON')
+        finally:
+            metrics.observe_handler(
+                self.metrics_name,
+                message_type if message_type in self.message_types else 'other',
+                started
+            )
     
     async def handle_authentication(self, data):
         """Authenticate user with Marian College token"""
@@ -224,46 +343,38 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             await self.send_error('Not authenticated')
             return
         
-        # Add to in-memory queue for instant matching
-        WAITING_QUEUE[self.device_uuid] = {
-            'channel_name': self.channel_name,
-            'joined_at': timezone.now(),
-            'consumer': self
-        }
-        
-        # Also add to database for persistence
-        await self.add_to_db_queue(self.device_uuid)
-        
-        # Try to find a match immediately
-        match_uuid = None
-        for uuid_key, info in WAITING_QUEUE.items():
-            if uuid_key != self.device_uuid:
-                match_uuid = uuid_key
-                break
+        # Pair with a waiting user or join the in-memory queue in one step
+        waiter = Waiter(
+            self.device_uuid,
+            self.channel_name,
+            year=data.get('year'),
+            department=data.get('department'),
+            preferred_year=data.get('preferred_year'),
+            preferred_department=data.get('preferred_department')
+        )
+        partner_info = await WAITING_QUEUE.join(waiter)
         
-        if match_uuid:
+        if partner_info:
+            match_uuid = partner_info.device_uuid
+            ADMIN_METRICS.record_match(timezone.now() - partner_info.joined_at)
+            
             # Create a call between matched users
             call_id = str(uuid.uuid4())
             
-            # Remove both from queue
-            partner_info = WAITING_QUEUE.pop(match_uuid)
-            del WAITING_QUEUE[self.device_uuid]
-            
             # Store active call
-            ACTIVE_CALLS[call_id] = {
-                'participants': [self.device_uuid, match_uuid],
-                'started_at': timezone.now(),
-                'channels': {
-                    self.device_uuid: self.channel_name,
-                    match_uuid: partner_info['channel_name']
-                }
-            }
+            await ACTIVE_CALLS.create(CallSession(
+                call_id,
+                (self.device_uuid, match_uuid),
+                (self.channel_name, partner_info.channel_name)
+            ))
             
             self.call_id = call_id
             self.partner_uuid = match_uuid
             
-            # Create call in database
-            await self.create_db_call(self.device_uuid, match_uuid, call_id)
+            # Partner is no longer waiting; create call in database.
+            # Both writes happen in the background
+            call_persistence.queue_leave(match_uuid)
+            call_persistence.call_started(call_id, self.device_uuid, match_uuid)
             
             # Notify both users
             await self.send_json({
@@ -273,13 +384,20 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
                 'message': 'Match found! Starting video call... 💕'
             })
             
-            await self.channel_layer.send(partner_info['channel_name'], {
+            await self.channel_layer.send(partner_info.channel_name, {
                 'type': 'match_found_notification',
                 'call_id': call_id,
                 'partner_id': self.device_uuid
             })
         else:
-            queue_count = len(WAITING_QUEUE)
+            queue_count = await WAITING_QUEUE.size()
+            
+            # Also add to database for persistence (in the background); the
+            # queue length feeds the hourly peak in the stats rollups
+            call_persistence.queue_join(
+                self.device_uuid, waiter.preferred_year, waiter.preferred_department, queue_count
+            )
+            
             await self.send_json({
                 'type': 'queued',
                 'position': queue_count,
@@ -288,10 +406,11 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
     
     async def handle_leave_queue(self, data):
         """Remove user from queue"""
-        if self.device_uuid and self.device_uuid in WAITING_QUEUE:
-            del WAITING_QUEUE[self.device_uuid]
+        if self.device_uuid:
+            await WAITING_QUEUE.leave(self.device_uuid)
         
-        await self.remove_from_db_queue(self.device_uuid)
+        if self.device_uuid:
+            call_persistence.queue_leave(self.device_uuid)
         await self.send_json({
             'type': 'left_queue',
             'message': 'Left queue. Come back anytime! 👋'
@@ -299,42 +418,44 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
     
     async def handle_webrtc_offer(self, data):
         """Forward WebRTC offer to partner"""
-        if self.call_id and self.call_id in ACTIVE_CALLS:
-            call_info = ACTIVE_CALLS[self.call_id]
-            partner_channel = call_info['channels'].get(self.partner_uuid)
-            
-            if partner_channel:
-                await self.channel_layer.send(partner_channel, {
-                    'type': 'webrtc_offer_notification',
-                    'offer': data.get('offer')
-                })
+        # Candidates batched so far must not arrive after the offer
+        await self.flush_ice()
+        partner_channel = await self.get_partner_channel()
+        if partner_channel:
+            await self.channel_layer.send(partner_channel, {
+                'type': 'webrtc_offer_notification',
+                'offer': data.get('offer')
+            })
     
     async def handle_webrtc_answer(self, data):
         """Forward WebRTC answer to partner"""
-        if self.call_id and self.call_id in ACTIVE_CALLS:
-            call_info = ACTIVE_CALLS[self.call_id]
-            partner_channel = call_info['channels'].get(self.partner_uuid)
-            
-            if partner_channel:
-                await self.channel_layer.send(partner_channel, {
-                    'type': 'webrtc_answer_notification',
-                    'answer': data.get('answer')
-                })
+        await self.flush_ice()
+        partner_channel = await self.get_partner_channel()
+        if partner_channel:
+            await self.channel_layer.send(partner_channel, {
+                'type': 'webrtc_answer_notification',
+                'answer': data.get('answer')
+            })
     
     async def handle_webrtc_ice(self, data):
         """Forward ICE candidate to partner"""
-        if self.call_id and self.call_id in ACTIVE_CALLS:
-            call_info = ACTIVE_CALLS[self.call_id]
-            partner_channel = call_info['channels'].get(self.partner_uuid)
-            
-            if partner_channel:
-                await self.channel_layer.send(partner_channel, {
-                    'type': 'webrtc_ice_notification',
-                    'candidate': data.get('candidate')
-                })
+        if self.ice_batch_window:
+            self.queue_ice(codec.dumps({
+                'type': 'webrtc_ice',
+                'candidate': data.get('candidate')
+            }))
+            return
+        
+        partner_channel = await self.get_partner_channel()
+        if partner_channel:
+            await self.channel_layer.send(partner_channel, {
+                'type': 'webrtc_ice_notification',
+                'candidate': data.get('candidate')
+            })
     
     async def handle_end_call(self, data):
         """End the current call"""
+        await self.flush_ice()
         if self.call_id:
             await self.end_call_cleanup()
             await self.send_json({
@@ -342,23 +463,93 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
                 'message': 'Call ended. Thanks for using onlyMC! 💖'
             })
     
+    async def reap(self):
+        """Called by the idle reaper once the client stopped sending"""
+        # Leave the queue and end the call now; a half-open socket may never
+        # deliver websocket.disconnect
+        await self.disconnect(IDLE_CLOSE_CODE)
+        self.device_uuid = None
+        await self.close(code=IDLE_CLOSE_CODE)
+    
+    async def relay_signal(self, message_type, frame):
+        """Forward an already-encoded signaling frame to the partner unchanged"""
+        if self.ice_batch_window:
+            if message_type == 'webrtc_ice':
+                self.queue_ice(frame)
+                return
+            # Offers and answers push out pending candidates first to keep order
+            await self.flush_ice()
+        
+        partner_channel = await self.get_partner_channel()
+        if partner_channel:
+            await self.channel_layer.send(partner_channel, {
+                'type': 'webrtc_relay',
+                'frame': frame
+            })
+    
+    def queue_ice(self, frame):
+        """Hold an encoded ICE frame until the batch window closes"""
+        self.ice_frames.append(frame)
+        if self.ice_flush_task is None:
+            self.ice_flush_task = asyncio.ensure_future(self.flush_ice_later())
+    
+    async def flush_ice_later(self):
+        await asyncio.sleep(self.ice_batch_window)
+        self.ice_flush_task = None
+        await self.flush_ice()
+    
+    async def flush_ice(self):
+        """Send batched ICE frames to the partner as one message"""
+        if not self.ice_batch_window:
+            return
+        
+        # The lock keeps a timer flush that is mid-send ahead of the next offer
+        async with self.relay_lock:
+            frames, self.ice_frames = self.ice_frames, []
+            if not frames:
+                return
+            
+            partner_channel = await self.get_partner_channel()
+            if not partner_channel:
+                return
+            
+            # A lone candidate goes out as a plain webrtc_ice frame
+            await self.channel_layer.send(partner_channel, {
+                'type': 'webrtc_relay',
+                'frame': frames[0] if len(frames) == 1 else ice_batch_frame(frames)
+            })
+    
+    async def get_partner_channel(self):
+        """Look up the partner's channel in the shared call state"""
+        if not self.call_id:
+            return None
+        call_info = await ACTIVE_CALLS.get(self.call_id)
+        if not call_info:
+            return None
+        return call_info.channel_for(self.partner_uuid)
+    
     async def end_call_cleanup(self):
         """Clean up call data"""
-        if self.call_id and self.call_id in ACTIVE_CALLS:
-            call_info = ACTIVE_CALLS[self.call_id]
-            partner_channel = call_info['channels'].get(self.partner_uuid)
-            
-            # Notify partner
-            if partner_channel:
-                await self.channel_layer.send(partner_channel, {
-                    'type': 'call_ended_notification'
-                })
+        if self.call_id:
+            if self.partner_uuid:
+                # The repeat cooldown counts from the hang-up
+                RECENT_PARTNERS.add(self.device_uuid, self.partner_uuid)
             
-            # End call in database
-            await self.end_db_call(self.call_id)
+            call_info = await ACTIVE_CALLS.get(self.call_id)
             
-            # Remove from active calls
-            del ACTIVE_CALLS[self.call_id]
+            # Remove from active calls; only the side that wins the delete
+            # notifies the partner and ends the call in the database
+            if call_info and await ACTIVE_CALLS.delete(self.call_id):
+                partner_channel = call_info.channel_for(self.partner_uuid)
+                
+                # Notify partner
+                if partner_channel:
+                    await self.channel_layer.send(partner_channel, {
+                        'type': 'call_ended_notification'
+                    })
+                
+                # End call in database
+                call_persistence.call_ended(self.call_id, call_info.started_at)
             
             self.call_id = None
             self.partner_uuid = None
@@ -393,6 +584,9 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
             'candidate': event['candidate']
         })
     
+    async def webrtc_relay(self, event):
+        await self.send(text_data=event['frame'])
+    
     async def call_ended_notification(self, event):
         self.call_id = None
         self.partner_uuid = None
@@ -406,17 +600,11 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
     @database_sync_to_async
     def get_or_create_device(self, token):
         try:
-            device, created = Device.objects.get_or_create(
-                token=token,
-                defaults={
-                    'is_authenticated': True,
-                    'user_agent': self.scope.get('headers', {}).get('user-agent', ''),
-                    'ip_address': self.scope.get('client', ['unknown', None])[0]
-                }
-            )
-            if not created:
-                device.is_authenticated = True
-                device.save()
+            # Headers are a list of (name, value) byte pairs
+            headers = dict(self.scope.get('headers', []))
+            user_agent = headers.get(b'user-agent', b'').decode('latin-1')
+            ip_address = (self.scope.get('client') or [None])[0]
+            device, created = device_auth_cache.authenticate(token, user_agent, ip_address)
             
             return {
                 'uuid': str(device.uuid),
@@ -425,60 +613,37 @@ class VideoCallConsumer(AsyncWebsocketConsumer):
         except Exception:
             return None
     
-    @database_sync_to_async
-    def add_to_db_queue(self, device_uuid):
-        try:
-            device = Device.objects.get(uuid=device_uuid)
-            CallQueue.objects.get_or_create(
-                device=device,
-                defaults={'is_active': True}
-            )
-            return True
-        except Device.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def remove_from_db_queue(self, device_uuid):
-        try:
-            device = Device.objects.get(uuid=device_uuid)
-            CallQueue.objects.filter(device=device).delete()
-            return True
-        except Device.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def create_db_call(self, device1_uuid, device2_uuid, call_id):
-        try:
-            device1 = Device.objects.get(uuid=device1_uuid)
-            device2 = Device.objects.get(uuid=device2_uuid)
-            
-            # Create with the specific UUID
-            call = VideoCall(
-                id=call_id,
-                participant1=device1,
-                participant2=device2,
-                status='connecting'
-            )
-            call.save()
-            
-            return True
-        except Device.DoesNotExist:
-            return False
-    
-    @database_sync_to_async
-    def end_db_call(self, call_id):
-        try:
-            call = VideoCall.objects.get(id=call_id)
-            call.end_call()
-            return True
-        except VideoCall.DoesNotExist:
-            return False
-    
-    async def send_json(self, data):
-        await self.send(text_data=json.dumps(data))
-    
     async def send_error(self, message):
         await self.send_json({
             'type': 'error',
             'message': message
         })
+
+
+class AdminMetricsConsumer(MetricsConsumerMixin, JSONCodecMixin, AsyncWebsocketConsumer):
+    metrics_name = 'admin_metrics'
+    
+    async def connect(self):
+        # Metrics are pushed per process; see AdminMetricsTicker
+        await self.channel_layer.group_add(
+            ADMIN_METRICS.group_name,
+            self.channel_name
+        )
+        
+        await self.accept()
+        
+        # Current numbers right away instead of waiting for the next tick
+        await self.send(text_data=await ADMIN_METRICS.subscribe(self.channel_layer))
+    
+    async def disconnect(self, close_code):
+        await self.channel_layer.group_discard(
+            ADMIN_METRICS.group_name,
+            self.channel_name
+        )
+        ADMIN_METRICS.unsubscribe()
+    
+    async def admin_metrics(self, event):
+        """
+        Handler for metrics ticks; the frame is encoded once for all admins
+        """
+        await self.send(text_data=event['frame'])
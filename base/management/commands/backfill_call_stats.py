@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from base import rollups
+from base.models import CallStatsBucket, VideoCall
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hourly call stats rollups from VideoCall history'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Calls read per round trip')
+
+    def handle(self, *args, **options):
+        rebuilt = rollups.rebuild(VideoCall.objects.all(), CallStatsBucket, chunk_size=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {rebuilt} hourly buckets'))
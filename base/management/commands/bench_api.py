@@ -0,0 +1,158 @@
+import json
+import platform
+import subprocess
+import time
+from datetime import datetime, timezone as dt_timezone
+
+import django
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+
+from base.auth_cache import device_auth_cache
+from base.management.commands.bench_calls import QueryCounter
+from base.models import CallQueue, CallStatsBucket, Device, VideoCall
+
+
+class Command(BaseCommand):
+    help = (
+        'Time every REST endpoint against the current database (see seed_data) and record '
+        'latency percentiles and query counts as JSON that can be compared across commits'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=20, help='Timed requests per endpoint and mode')
+        parser.add_argument('--endpoint', action='append', help='Only run the named endpoint(s)')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+        parser.add_argument('--compare', help='Previous report to print p50 changes against')
+
+    def handle(self, *args, **options):
+        # Host that passes ALLOWED_HOSTS validation while DEBUG is on
+        self.client = Client(HTTP_HOST='localhost')
+        endpoints = self.endpoints()
+        if options['endpoint']:
+            unknown = set(options['endpoint']) - {name for name, _ in endpoints}
+            if unknown:
+                raise CommandError(f'Unknown endpoint(s): {", ".join(sorted(unknown))}')
+            endpoints = [(name, request) for name, request in endpoints if name in options['endpoint']]
+
+        report = {
+            'commit': self.git_commit(),
+            'created_at': datetime.now(dt_timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': connection.vendor,
+            'rows': {
+                'devices': Device.objects.count(),
+                'calls': VideoCall.objects.count(),
+                'queue': CallQueue.objects.count(),
+                'call_stats_buckets': CallStatsBucket.objects.count(),
+            },
+            'runs': options['runs'],
+            'endpoints': {},
+        }
+
+        for name, request in endpoints:
+            report['endpoints'][name] = {
+                # Cold: every cache emptied first, as after a deploy
+                'cold': self.measure(request, options['runs'], cold=True),
+                'warm': self.measure(request, options['runs'], cold=False),
+            }
+            self.write_row(name, report['endpoints'][name])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(report, output, indent=2)
+            self.stdout.write(f'Report written to {options["output"]}')
+        if options['compare']:
+            self.compare(report, options['compare'])
+
+    def endpoints(self):
+        token = Device.objects.filter(token__startswith='MC_').values_list('token', flat=True).first() \
+            or 'MC_bench_000000'
+
+        def next_devices_page():
+            response = self.client.get('/api/devices/')
+            cursor = response.json().get('next_cursor') or ''
+            return lambda: self.client.get('/api/devices/', {'cursor': cursor})
+
+        second_page = next_devices_page()
+        return [
+            ('live_users', lambda: self.client.get('/api/live-users/')),
+            ('devices', lambda: self.client.get('/api/devices/')),
+            ('devices_cursor', second_page),
+            ('devices_estimated_count', lambda: self.client.get('/api/devices/', {'count': 'estimated'})),
+            ('devices_exact_count', lambda: self.client.get('/api/devices/', {'count': 'exact'})),
+            ('devices_stream', lambda: self.client.get('/api/devices/', {'stream': '1'})),
+            ('queue_status', lambda: self.client.get('/api/queue-status/')),
+            ('call_history', lambda: self.client.get('/api/call-history/')),
+            ('call_stats', lambda: self.client.get('/api/call-stats/', {'hours': 24 * 7})),
+            ('authenticate', lambda: self.client.post(
+                '/api/auth/token/', {'token': token}, content_type='application/json'
+            )),
+        ]
+
+    def measure(self, request, runs, cold):
+        timings = []
+        queries = QueryCounter()
+        status_codes = set()
+        size = 0
+        with connection.execute_wrapper(queries):
+            for _ in range(runs):
+                if cold:
+                    cache.clear()
+                    device_auth_cache.clear()
+                started = time.perf_counter()
+                response = request()
+                # Streaming responses do their work while being consumed
+                body = b''.join(response.streaming_content) if response.streaming else response.content
+                timings.append(time.perf_counter() - started)
+                status_codes.add(response.status_code)
+                size = len(body)
+        timings.sort()
+        return {
+            'p50_ms': round(self.percentile(timings, 0.5) * 1000, 2),
+            'p95_ms': round(self.percentile(timings, 0.95) * 1000, 2),
+            'max_ms': round(timings[-1] * 1000, 2),
+            'queries_per_request': round(queries.count / runs, 2),
+            'response_bytes': size,
+            'status_codes': sorted(status_codes),
+        }
+
+    def write_row(self, name, result):
+        cold, warm = result['cold'], result['warm']
+        self.stdout.write(
+            f'{name:26} cold p50 {cold["p50_ms"]:9.2f} ms  p95 {cold["p95_ms"]:9.2f} ms  '
+            f'{cold["queries_per_request"]:6} q  |  warm p50 {warm["p50_ms"]:9.2f} ms  '
+            f'p95 {warm["p95_ms"]:9.2f} ms  {warm["queries_per_request"]:6} q'
+        )
+
+    def compare(self, report, path):
+        with open(path) as previous_file:
+            previous = json.load(previous_file)
+        self.stdout.write(f'\nCompared with {previous.get("commit") or path}:')
+        for name, result in report['endpoints'].items():
+            before = previous.get('endpoints', {}).get(name)
+            if not before:
+                continue
+            for mode in ('cold', 'warm'):
+                old, new = before[mode]['p50_ms'], result[mode]['p50_ms']
+                change = (new - old) / old * 100 if old else 0
+                self.stdout.write(
+                    f'{name:26} {mode:4} p50 {old:9.2f} -> {new:9.2f} ms ({change:+.0f}%)  '
+                    f'queries {before[mode]["queries_per_request"]} -> {result[mode]["queries_per_request"]}'
+                )
+
+    def git_commit(self):
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def percentile(self, values, fraction):
+        if not values:
+            return 0
+        return values[min(int(len(values) * fraction), len(values) - 1)]
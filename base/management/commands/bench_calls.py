@@ -0,0 +1,262 @@
+import asyncio
+import json
+import time
+import tracemalloc
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from base import codec, metrics
+
+IN_MEMORY_LAYER = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+class QueryCounter:
+    """``execute_wrapper`` that counts round trips without keeping the SQL"""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class BenchClient:
+    """Minimal WebSocket client that talks ASGI to the application directly"""
+
+    def __init__(self, application, path, index, timeout):
+        self.timeout = timeout
+        self.communicator = ApplicationCommunicator(application, {
+            'type': 'websocket',
+            'path': path,
+            'raw_path': path.encode(),
+            'query_string': b'',
+            'headers': [(b'host', b'localhost'), (b'user-agent', f'bench-client-{index}'.encode())],
+            'client': ('127.0.0.1', 40000 + index % 20000),
+            'server': ('127.0.0.1', 8000),
+            'subprotocols': [],
+        })
+
+    async def connect(self):
+        await self.communicator.send_input({'type': 'websocket.connect'})
+        message = await self.communicator.receive_output(self.timeout)
+        if message['type'] != 'websocket.accept':
+            raise RuntimeError(f'connection refused: {message}')
+
+    async def send(self, data):
+        await self.communicator.send_input({'type': 'websocket.receive', 'text': codec.dumps(data)})
+
+    async def receive(self):
+        message = await self.communicator.receive_output(self.timeout)
+        return codec.loads(message['text'])
+
+    async def expect(self, *types):
+        while True:
+            data = await self.receive()
+            if data.get('type') in types:
+                return data
+
+    async def close(self):
+        await self.communicator.send_input({'type': 'websocket.disconnect', 'code': 1000})
+        await self.communicator.wait(self.timeout)
+
+
+class Progress:
+    """
+    Tracks clients through their rounds of calls.
+
+    A queued client is stuck once every other client has either made all
+    its calls or is queued as well: nobody is left to match it.
+    """
+
+    def __init__(self, clients):
+        self.clients = clients
+        self.done = 0
+        self.queued = 0
+        self.stuck = asyncio.Event()
+
+    def finish(self):
+        self.done += 1
+        self.check()
+
+    def check(self):
+        if self.queued and self.done + self.queued >= self.clients:
+            self.stuck.set()
+
+    async def wait_for_match(self, client):
+        """The ``match_found`` for a queued client, or None if it is stuck"""
+        self.queued += 1
+        self.check()
+        match = asyncio.ensure_future(client.expect('match_found'))
+        stuck = asyncio.ensure_future(self.stuck.wait())
+        await asyncio.wait((match, stuck), return_when=asyncio.FIRST_COMPLETED)
+        self.queued -= 1
+        stuck.cancel()
+        if match.done():
+            return match.result()
+        match.cancel()
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the ASGI application with simulated clients through authenticate, join_queue, '
+        'offer/answer/ICE and end_call, against a throwaway SQLite test database and the '
+        'in-memory channel layer'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=1000, help='Simulated clients (paired into calls)')
+        parser.add_argument('--ice-per-call', type=int, default=8, help='ICE candidates each caller sends')
+        parser.add_argument('--sdp-size', type=int, default=2048, help='Bytes of SDP in offers/answers')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for any one message')
+        parser.add_argument('--no-metrics', action='store_true', help='Turn latency metrics off, to measure their overhead')
+        parser.add_argument(
+            '--rounds', type=int, default=1,
+            help='Calls each client makes; from the second round on, recent partners are passed over'
+        )
+        parser.add_argument(
+            '--repeat-cooldown', type=float, default=None,
+            help='Seconds before two clients may be matched again, 0 for no exclusion (default MATCHMAKING_REPEAT_COOLDOWN)'
+        )
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        clients = options['clients'] - options['clients'] % 2
+        metrics.registry.enabled = not options['no_metrics']
+        old_config = self.setup_database()
+        try:
+            with override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYER):
+                from channels.layers import channel_layers
+                channel_layers.backends = {}
+                # Queries from the consumers' database thread land on this connection
+                queries = QueryCounter()
+                with connection.execute_wrapper(queries):
+                    report = async_to_sync(self.run)(clients, options, queries)
+        finally:
+            connection.creation.destroy_test_db(old_config, verbosity=0)
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for key, value in report.items():
+            self.stdout.write(f'{key:28} {value}')
+
+    def setup_database(self):
+        # Never touch the development database
+        old_name = settings.DATABASES['default']['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        return old_name
+
+    async def run(self, clients, options, queries):
+        from base.consumers import ACTIVE_CALLS, RECENT_PARTNERS, WAITING_QUEUE
+        from base.persistence import call_persistence
+        from base.presence import presence_store
+        from main.asgi import application
+
+        sdp = 'v=0\r\n' + 'a=candidate:1 1 udp 2122260223 192.168.1.2 54321 typ host\r\n' * (options['sdp_size'] // 60)
+        bench = [BenchClient(application, '/ws/video-call/', index, options['timeout']) for index in range(clients)]
+        match_latencies = []
+        relayed = 0
+        if options['repeat_cooldown'] is not None:
+            RECENT_PARTNERS.cooldown = options['repeat_cooldown']
+        partners = {client: set() for client in bench}
+        repeats = 0
+        unmatched = 0
+        progress = Progress(clients)
+
+        # Connection phase, measured for memory per connection
+        tracemalloc.start()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await asyncio.gather(*(client.connect() for client in bench))
+        await asyncio.gather(*(self.authenticate(client, index) for index, client in enumerate(bench)))
+        connected = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        setup_queries = queries.count
+
+        async def call_flow(client):
+            nonlocal relayed, repeats, unmatched
+            # Each client rejoins as soon as its call ends, like users
+            # hitting "next"; both sides of a call come back together
+            for _ in range(options['rounds']):
+                joined_at = time.perf_counter()
+                await client.send({'type': 'join_queue'})
+                match = await client.expect('match_found', 'queued')
+                if match['type'] == 'queued':
+                    match = await progress.wait_for_match(client)
+                    if match is None:
+                        # Everyone left was a recent partner; give up
+                        await client.send({'type': 'leave_queue'})
+                        unmatched += 1
+                        break
+                match_latencies.append(time.perf_counter() - joined_at)
+                if match['partner_id'] in partners[client]:
+                    repeats += 1
+                partners[client].add(match['partner_id'])
+
+                # The lower device UUID calls, the other answers
+                if client.device_uuid < match['partner_id']:
+                    await client.send({'type': 'webrtc_offer', 'offer': {'type': 'offer', 'sdp': sdp}})
+                    await client.expect('webrtc_answer')
+                    for index in range(options['ice_per_call']):
+                        await client.send({'type': 'webrtc_ice', 'candidate': {
+                            'candidate': f'candidate:{index} 1 udp 2122260223 10.0.0.1 {50000 + index} typ host',
+                            'sdpMid': '0',
+                            'sdpMLineIndex': 0
+                        }})
+                    await client.send({'type': 'end_call'})
+                    await client.expect('call_ended')
+                    relayed += 2 + options['ice_per_call']
+                else:
+                    await client.expect('webrtc_offer')
+                    await client.send({'type': 'webrtc_answer', 'answer': {'type': 'answer', 'sdp': sdp}})
+                    # Candidates (single or batched) arrive before the hang-up
+                    await client.expect('call_ended')
+            progress.finish()
+            await client.close()
+
+        started = time.perf_counter()
+        await asyncio.gather(*(call_flow(client) for client in bench))
+        elapsed = time.perf_counter() - started
+
+        # Count the deferred writes too
+        await call_persistence.flush()
+        await presence_store.aflush()
+        call_queries = queries.count - setup_queries
+
+        calls = len(match_latencies) // 2
+        match_latencies.sort()
+        return {
+            'clients': clients,
+            'calls': calls,
+            'matchmaking_backend': type(WAITING_QUEUE).__name__,
+            'call_session_backend': type(ACTIVE_CALLS).__name__,
+            'metrics_enabled': metrics.registry.enabled,
+            'rounds': options['rounds'],
+            'repeat_cooldown_seconds': RECENT_PARTNERS.cooldown,
+            'repeat_matches': repeats,
+            'recent_partners_skipped': RECENT_PARTNERS.skipped,
+            'unmatched_clients': unmatched,
+            'elapsed_seconds': round(elapsed, 3),
+            'match_latency_p50_ms': round(self.percentile(match_latencies, 0.5) * 1000, 2),
+            'match_latency_p99_ms': round(self.percentile(match_latencies, 0.99) * 1000, 2),
+            'relayed_messages': relayed,
+            'relayed_messages_per_sec': round(relayed / elapsed),
+            'memory_per_connection_kib': round((connected - baseline) / clients / 1024, 1),
+            'auth_queries_per_client': round(setup_queries / clients, 2),
+            'db_queries_per_call': round(call_queries / calls, 2),
+        }
+
+    async def authenticate(self, client, index):
+        await client.send({'type': 'authenticate', 'token': f'MC_bench_{index:08d}'})
+        client.device_uuid = (await client.expect('authenticated'))['device_uuid']
+
+    def percentile(self, values, fraction):
+        if not values:
+            return 0
+        return values[min(int(len(values) * fraction), len(values) - 1)]
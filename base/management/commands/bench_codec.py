@@ -0,0 +1,96 @@
+import json
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from base import codec
+
+
+class Command(BaseCommand):
+    help = 'Benchmark stdlib json vs base.codec on presence snapshots and call-history payloads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=500, help='Active users per presence snapshot')
+        parser.add_argument('--calls', type=int, default=50, help='Calls per call-history response')
+        parser.add_argument('--iterations', type=int, default=2000, help='Payloads encoded per case')
+
+    def handle(self, *args, **options):
+        backend = 'orjson' if codec.orjson is not None else 'stdlib json (orjson not installed)'
+        self.stdout.write(f'codec backend: {backend}')
+
+        snapshot = self.presence_snapshot(options['users'])
+        history = self.call_history(options['calls'])
+        cases = [
+            # The old code converted datetimes/UUIDs by hand before json.dumps
+            ('presence snapshot', lambda: json.dumps(self.stringify(snapshot)), lambda: codec.dumps(snapshot)),
+            ('call history', lambda: json.dumps(self.stringify(history)), lambda: codec.dumps(history)),
+        ]
+        encoded = codec.dumps(snapshot)
+        cases.append(('decode snapshot', lambda: json.loads(encoded), lambda: codec.loads(encoded)))
+
+        for label, baseline, candidate in cases:
+            slow = self.timed(baseline, options['iterations'])
+            fast = self.timed(candidate, options['iterations'])
+            self.stdout.write(
+                f'{label:18} json {slow / options["iterations"] * 1e6:9.1f} us  '
+                f'codec {fast / options["iterations"] * 1e6:9.1f} us  ({slow / fast:.1f}x)'
+            )
+
+    def presence_snapshot(self, count):
+        now = timezone.now()
+        return {
+            'type': 'user_count_update',
+            'active_users': {
+                'count': count,
+                'users': [
+                    {
+                        'uuid': uuid.uuid4(),
+                        'last_seen': now - timedelta(seconds=index % 30),
+                        'created_at': now - timedelta(days=1, seconds=index),
+                        'user_agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)',
+                        'ip_address': f'10.0.{index // 256 % 256}.{index % 256}'
+                    }
+                    for index in range(count)
+                ]
+            },
+            'timestamp': now
+        }
+
+    def call_history(self, count):
+        now = timezone.now()
+        return {
+            'calls': [
+                {
+                    'id': uuid.uuid4(),
+                    'participant1': str(uuid.uuid4())[:8],
+                    'participant2': str(uuid.uuid4())[:8],
+                    'started_at': now - timedelta(minutes=index),
+                    'ended_at': now - timedelta(minutes=index) + timedelta(seconds=90),
+                    'duration_seconds': 90,
+                    'status': 'ended'
+                }
+                for index in range(count)
+            ],
+            'total_calls': count,
+            'timestamp': now
+        }
+
+    def stringify(self, value):
+        if isinstance(value, dict):
+            return {key: self.stringify(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.stringify(item) for item in value]
+        if hasattr(value, 'isoformat'):
+            return value.isoformat()
+        if isinstance(value, uuid.UUID):
+            return str(value)
+        return value
+
+    def timed(self, run, iterations):
+        started = time.perf_counter()
+        for _ in range(iterations):
+            run()
+        return time.perf_counter() - started
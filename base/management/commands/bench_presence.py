@@ -0,0 +1,144 @@
+import asyncio
+import json
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from base.presence import PresenceBroadcaster, PresenceStore
+
+
+class FanoutLayer:
+    """
+    Group-only channel layer stand-in.
+
+    InMemoryChannelLayer scans every channel for expired messages on each
+    receive and group_send, which at 10k connections swamps what is being
+    measured; this keeps only the per-member loop and a copy per member.
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.channels = {}
+
+    async def new_channel(self):
+        name = f'specific.bench!{uuid.uuid4().hex[:12]}'
+        self.channels[name] = asyncio.Queue()
+        return name
+
+    async def group_add(self, group, channel):
+        self.groups.setdefault(group, set()).add(channel)
+
+    async def group_send(self, group, message):
+        for channel in self.groups.get(group, ()):
+            self.channels[channel].put_nowait(dict(message))
+
+    async def receive(self, channel):
+        return await self.channels[channel].get()
+
+
+class Command(BaseCommand):
+    help = (
+        'Fan presence snapshots out to simulated live-users connections, publishing per '
+        'event (one group) versus ticked (sharded groups)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', type=int, default=10000, help='Connected live-users clients')
+        parser.add_argument('--users', type=int, default=200, help='Active users in each snapshot')
+        parser.add_argument('--events-per-sec', type=int, default=50, help='Presence changes per second')
+        parser.add_argument('--seconds', type=float, default=5, help='How long events keep coming')
+        parser.add_argument('--tick', type=float, default=1.0, help='Ticker interval for the ticked mode')
+        parser.add_argument('--shards', type=int, default=16, help='Shard groups for the ticked mode')
+        parser.add_argument('--json', action='store_true', help='Print the report as JSON')
+
+    def handle(self, *args, **options):
+        report = {
+            'per_event': async_to_sync(self.run)(options, window=0, shards=1),
+            'ticked': async_to_sync(self.run)(options, window=options['tick'], shards=options['shards']),
+        }
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+        for mode, result in report.items():
+            self.stdout.write(mode)
+            for key, value in result.items():
+                self.stdout.write(f'  {key:28} {value}')
+
+    async def run(self, options, window, shards):
+        users = [
+            {
+                'uuid': str(uuid.uuid4()),
+                'last_seen': '2025-01-01T00:00:00+00:00',
+                'created_at': '2025-01-01T00:00:00+00:00',
+                'user_agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X)',
+                'ip_address': '10.0.0.1'
+            }
+            for _ in range(options['users'])
+        ]
+
+        async def snapshot():
+            return users
+
+        layer = FanoutLayer()
+        broadcaster = PresenceBroadcaster(window=window, snapshot=snapshot, store=PresenceStore(), shards=shards)
+        delivered = 0
+
+        async def reader(channel):
+            nonlocal delivered
+            while True:
+                await layer.receive(channel)
+                delivered += 1
+
+        channels = [await layer.new_channel() for _ in range(options['clients'])]
+        for channel in channels:
+            await layer.group_add(broadcaster.shard_group(channel), channel)
+        readers = [asyncio.ensure_future(reader(channel)) for channel in channels]
+
+        # How late a 10 ms sleep wakes up is how long the loop was held
+        lags = []
+        probing = True
+
+        async def probe():
+            while probing:
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lags.append(time.perf_counter() - started - 0.01)
+
+        prober = asyncio.ensure_future(probe())
+        events = int(options['events_per_sec'] * options['seconds'])
+        cpu_started = time.process_time()
+        started = time.perf_counter()
+        for _ in range(events):
+            await broadcaster.request(layer)
+            await asyncio.sleep(1 / options['events_per_sec'])
+        # Let the last tick and the readers finish
+        while broadcaster._task is not None and not broadcaster._task.done():
+            await asyncio.sleep(0.01)
+        while any(not queue.empty() for queue in layer.channels.values()):
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - started
+        cpu = time.process_time() - cpu_started
+
+        probing = False
+        await prober
+        for task in readers:
+            task.cancel()
+        await asyncio.gather(*readers, return_exceptions=True)
+
+        lags.sort()
+        return {
+            'clients': options['clients'],
+            'shards': shards,
+            'window_seconds': window,
+            'events': events,
+            'publishes': broadcaster.sent,
+            'frames_delivered': delivered,
+            'elapsed_seconds': round(elapsed, 2),
+            'cpu_seconds': round(cpu, 2),
+            'cpu_ms_per_event': round(cpu / events * 1000, 3),
+            'loop_lag_p50_ms': round(lags[len(lags) // 2] * 1000, 2) if lags else 0,
+            'loop_lag_p99_ms': round(lags[min(int(len(lags) * 0.99), len(lags) - 1)] * 1000, 2) if lags else 0,
+            'loop_lag_max_ms': round(lags[-1] * 1000, 2) if lags else 0,
+        }
@@ -0,0 +1,50 @@
+import time
+import uuid
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from base.models import Device
+from base.serializers import DeviceSerializer, FastDeviceSerializer
+
+
+class Command(BaseCommand):
+    help = 'Benchmark rows/sec of DeviceSerializer vs FastDeviceSerializer for device lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help='List sizes to serialize')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs per size; the best is reported')
+
+    def handle(self, *args, **options):
+        for count in options['rows']:
+            devices = self.build_devices(count)
+            # What each path gets back from the database: instances vs values_list tuples
+            rows = [tuple(getattr(device, column) for column in FastDeviceSerializer.columns) for device in devices]
+
+            slow = self.best(lambda: DeviceSerializer(devices, many=True).data, options['repeat'])
+            fast = self.best(lambda: FastDeviceSerializer().serialize(rows), options['repeat'])
+            for label, seconds in (('DeviceSerializer', slow), ('FastDeviceSerializer', fast)):
+                self.stdout.write(f'{label:22} {count:>7} rows  {count / seconds:>12,.0f} rows/sec')
+            self.stdout.write(self.style.SUCCESS(f'{count} rows: fast path is {slow / fast:.1f}x faster'))
+
+    def build_devices(self, count):
+        now = timezone.now()
+        return [
+            Device(
+                uuid=uuid.uuid4(),
+                created_at=now - timedelta(days=1, seconds=index),
+                last_seen=now - timedelta(seconds=index % 120),
+                user_agent='Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X)',
+                ip_address=f'10.0.{index // 256 % 256}.{index % 256}'
+            )
+            for index in range(count)
+        ]
+
+    def best(self, run, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return min(timings)
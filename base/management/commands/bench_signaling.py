@@ -0,0 +1,102 @@
+import asyncio
+import json
+import time
+import uuid
+
+from asgiref.sync import async_to_sync
+from django.core.management.base import BaseCommand
+
+from base.call_sessions import CallSession
+from base.consumers import ACTIVE_CALLS, VideoCallConsumer
+
+
+class LoopbackLayer:
+    """Channel layer stand-in that hands messages straight to the partner consumer"""
+
+    def __init__(self):
+        self.consumers = {}
+        self.sends = 0
+
+    async def send(self, channel, message):
+        self.sends += 1
+        consumer = self.consumers[channel]
+        await getattr(consumer, message['type'])(message)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark CPU time per relayed WebRTC signaling message, parsed vs passthrough'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=20000, help='Messages per mode')
+        parser.add_argument('--sdp-size', type=int, default=4096, help='Bytes of SDP in offers/answers')
+        parser.add_argument('--ice-per-offer', type=int, default=20, help='ICE candidates per offer/answer pair')
+        parser.add_argument('--ice-batch-window', type=float, default=0,
+                            help='Seconds to batch ICE candidates (see SIGNALING_ICE_BATCH_WINDOW)')
+
+    def handle(self, *args, **options):
+        frames = self.build_frames(options['sdp_size'], options['ice_per_offer'])
+        results = {}
+        for passthrough in (False, True):
+            results[passthrough] = async_to_sync(self.run)(
+                frames, options['messages'], passthrough, options['ice_batch_window']
+            )
+
+        for passthrough, (cpu, delivered, sends) in results.items():
+            label = 'passthrough' if passthrough else 'parsed'
+            self.stdout.write(
+                f"{label:12} {options['messages']} messages  "
+                f"{cpu / options['messages'] * 1e6:8.2f} us CPU/message  "
+                f"({sends} channel-layer sends, {delivered} frames delivered)"
+            )
+        speedup = results[False][0] / results[True][0]
+        self.stdout.write(self.style.SUCCESS(f'passthrough is {speedup:.1f}x cheaper per relayed message'))
+
+    def build_frames(self, sdp_size, ice_per_offer):
+        sdp = 'v=0\r\n' + ('a=candidate:1 1 udp 2122260223 192.168.1.2 54321 typ host\r\n' * (sdp_size // 60))
+        frames = [
+            json.dumps({'type': 'webrtc_offer', 'offer': {'type': 'offer', 'sdp': sdp}}),
+            json.dumps({'type': 'webrtc_answer', 'answer': {'type': 'answer', 'sdp': sdp}}),
+        ]
+        frames += [
+            json.dumps({'type': 'webrtc_ice', 'candidate': {
+                'candidate': f'candidate:{index} 1 udp 2122260223 10.0.0.{index % 255} {50000 + index} typ host',
+                'sdpMid': '0',
+                'sdpMLineIndex': 0
+            }})
+            for index in range(ice_per_offer)
+        ]
+        return frames
+
+    async def run(self, frames, count, passthrough, ice_batch_window):
+        layer = LoopbackLayer()
+        caller, callee = VideoCallConsumer(), VideoCallConsumer()
+        call_id = str(uuid.uuid4())
+        delivered = []
+
+        async def deliver(text_data=None, bytes_data=None, close=False):
+            delivered.append(text_data)
+
+        for name, consumer, partner in (('caller', caller, 'callee'), ('callee', callee, 'caller')):
+            consumer.channel_layer = layer
+            consumer.channel_name = f'bench.{name}'
+            consumer.device_uuid = name
+            consumer.partner_uuid = partner
+            consumer.call_id = call_id
+            consumer.relay_passthrough = passthrough
+            consumer.ice_batch_window = ice_batch_window
+            consumer.ice_frames = []
+            consumer.ice_flush_task = None
+            consumer.relay_lock = asyncio.Lock()
+            consumer.send = deliver
+            layer.consumers[consumer.channel_name] = consumer
+
+        await ACTIVE_CALLS.create(CallSession(call_id, ('caller', 'callee'), ('bench.caller', 'bench.callee')))
+        try:
+            started = time.process_time()
+            for index in range(count):
+                await caller.receive(text_data=frames[index % len(frames)])
+            await caller.flush_ice()
+            cpu = time.process_time() - started
+        finally:
+            await ACTIVE_CALLS.delete(call_id)
+        return cpu, len(delivered), layer.sends
@@ -0,0 +1,146 @@
+import random
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from base.models import CallQueue, Device, VideoCall
+
+USER_AGENTS = [
+    'Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 Mobile/15E148',
+    'Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 Chrome/124.0 Mobile Safari/537.36',
+    'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 Chrome/124.0 Safari/537.36',
+    'Mozilla/5.0 (Macintosh; Intel Mac OS X 14_4) AppleWebKit/605.1.15 Version/17.4 Safari/605.1.15',
+]
+
+# Relative traffic per hour of day (campus evenings are busiest)
+HOURLY_WEIGHTS = [1, 1, 1, 1, 1, 1, 2, 3, 5, 6, 6, 7, 8, 7, 6, 6, 7, 8, 10, 12, 12, 10, 6, 3]
+
+
+@contextmanager
+def raw_timestamps(*models):
+    """Let bulk_create keep the timestamps we generate instead of stamping now()"""
+    fields = [
+        field for model in models for field in model._meta.concrete_fields
+        if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)
+    ]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Seed Device, VideoCall and CallQueue rows in bulk with semester-like timestamps'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--devices', type=int, default=1000000)
+        parser.add_argument('--calls', type=int, default=500000)
+        parser.add_argument('--queue', type=int, default=200, help='Devices currently waiting in the queue')
+        parser.add_argument('--online', type=float, default=0.002, help='Share of devices seen in the last 30 s')
+        parser.add_argument('--days', type=int, default=120, help='Length of history to spread rows over')
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable datasets')
+        parser.add_argument('--skip-rollups', action='store_true', help='Do not rebuild the call stats rollups')
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        self.now = timezone.now()
+        self.days = options['days']
+        started = time.perf_counter()
+
+        with raw_timestamps(Device, VideoCall, CallQueue):
+            participants = self.seed_devices(options['devices'], options['online'], options['chunk_size'])
+            self.seed_calls(options['calls'], participants, options['chunk_size'])
+            self.seed_queue(options['queue'], participants)
+
+        if not options['skip_rollups']:
+            call_command('backfill_call_stats', stdout=self.stdout)
+
+        self.stdout.write(self.style.SUCCESS(f'Seeded in {time.perf_counter() - started:.1f}s'))
+
+    def moment(self):
+        """A timestamp within the history window, weighted towards busy hours"""
+        day = self.random.randrange(self.days)
+        hour = self.random.choices(range(24), HOURLY_WEIGHTS)[0]
+        moment = (self.now - timedelta(days=day)).replace(hour=hour, minute=0, second=0, microsecond=0)
+        moment += timedelta(seconds=self.random.randrange(3600))
+        # Later today hasn't happened yet
+        return moment - timedelta(days=1) if moment > self.now else moment
+
+    def seed_devices(self, count, online, chunk_size):
+        # Calls and queue entries pick from a bounded sample to keep memory flat
+        participants = []
+        for offset in range(0, count, chunk_size):
+            devices = []
+            for index in range(offset, min(offset + chunk_size, count)):
+                created_at = self.moment()
+                if self.random.random() < online:
+                    last_seen = self.now - timedelta(seconds=self.random.randrange(30))
+                else:
+                    last_seen = min(created_at + timedelta(minutes=self.random.expovariate(1 / 45)), self.now)
+                authenticated = self.random.random() < 0.8
+                devices.append(Device(
+                    uuid=uuid.UUID(int=self.random.getrandbits(128), version=4),
+                    token=f'MC_seed_{index:09d}' if authenticated else None,
+                    is_authenticated=authenticated,
+                    created_at=created_at,
+                    last_seen=last_seen,
+                    user_agent=self.random.choice(USER_AGENTS),
+                    ip_address=f'10.{index // 65536 % 256}.{index // 256 % 256}.{index % 256}'
+                ))
+            with transaction.atomic():
+                Device.objects.bulk_create(devices, batch_size=chunk_size)
+            if len(participants) < 100000:
+                participants.extend(device.uuid for device in devices[:100000 - len(participants)])
+            self.stdout.write(f'devices: {offset + len(devices)}/{count}', ending='\r')
+        self.stdout.write('')
+        return participants
+
+    def seed_calls(self, count, participants, chunk_size):
+        if len(participants) < 2:
+            return
+        for offset in range(0, count, chunk_size):
+            calls = []
+            for _ in range(min(chunk_size, count - offset)):
+                participant1, participant2 = self.random.sample(participants, 2)
+                started_at = self.moment()
+                duration = int(self.random.lognormvariate(4.5, 1.1))
+                ended_at = started_at + timedelta(seconds=duration)
+                ended = ended_at < self.now
+                calls.append(VideoCall(
+                    participant1_id=participant1,
+                    participant2_id=participant2,
+                    started_at=started_at,
+                    ended_at=ended_at if ended else None,
+                    duration_seconds=duration if ended else 0,
+                    status='ended' if ended else 'active'
+                ))
+            with transaction.atomic():
+                VideoCall.objects.bulk_create(calls, batch_size=chunk_size)
+            self.stdout.write(f'calls: {offset + len(calls)}/{count}', ending='\r')
+        self.stdout.write('')
+
+    def seed_queue(self, count, participants):
+        waiting = self.random.sample(participants, min(count, len(participants)))
+        CallQueue.objects.bulk_create(
+            [
+                CallQueue(
+                    device_id=device_uuid,
+                    joined_at=self.now - timedelta(seconds=self.random.randrange(120)),
+                    is_active=True
+                )
+                for device_uuid in waiting
+            ],
+            ignore_conflicts=True
+        )
+        self.stdout.write(f'queue: {len(waiting)}')
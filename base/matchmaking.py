@@ -0,0 +1,370 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from base.metrics import database_sync_to_async
+from base.models import VideoCall
+
+
+class Waiter:
+    """A device waiting in the matchmaking queue"""
+
+    __slots__ = (
+        'device_uuid', 'channel_name', 'joined_at',
+        'year', 'department', 'preferred_year', 'preferred_department',
+    )
+
+    def __init__(self, device_uuid, channel_name, joined_at=None, year=None, department=None,
+                 preferred_year=None, preferred_department=None):
+        self.device_uuid = device_uuid
+        self.channel_name = channel_name
+        self.joined_at = joined_at or timezone.now()
+        self.year = year
+        self.department = department
+        self.preferred_year = preferred_year
+        self.preferred_department = preferred_department
+
+    def __repr__(self):
+        return f"<Waiter {self.device_uuid}>"
+
+    def as_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data['joined_at'] = self.joined_at.isoformat()
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        data['joined_at'] = datetime.fromisoformat(data['joined_at'])
+        return cls(**data)
+
+
+class WaitQueue:
+    """FIFO of waiters keyed by device UUID with O(1) enqueue, dequeue and cancel"""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, device_uuid):
+        return device_uuid in self._entries
+
+    def __iter__(self):
+        return iter(self._entries.values())
+
+    def push(self, waiter):
+        self._entries[waiter.device_uuid] = waiter
+
+    def remove(self, device_uuid):
+        return self._entries.pop(device_uuid, None)
+
+    def popleft(self):
+        if not self._entries:
+            return None
+        return self._entries.popitem(last=False)[1]
+
+    def peek(self, exclude=None, skip=None):
+        """Oldest waiter other than ``exclude`` for which ``skip(waiter)`` is false"""
+        for device_uuid, waiter in self._entries.items():
+            if device_uuid != exclude and (skip is None or not skip(waiter)):
+                return waiter
+        return None
+
+    def get(self, device_uuid):
+        return self._entries.get(device_uuid)
+
+
+class FifoPolicy:
+    """Pair each newcomer with whoever has been waiting longest"""
+
+    def __init__(self):
+        self.queue = WaitQueue()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, device_uuid):
+        return device_uuid in self.queue
+
+    def get(self, device_uuid):
+        return self.queue.get(device_uuid)
+
+    def add(self, waiter):
+        self.queue.push(waiter)
+
+    def remove(self, device_uuid):
+        return self.queue.remove(device_uuid)
+
+    def find(self, waiter, skip=None):
+        return self.queue.peek(exclude=waiter.device_uuid, skip=skip)
+
+    def bucket_keys(self, waiter):
+        """Buckets ``waiter`` is filed under while it waits"""
+        return [()]
+
+    def lookup_keys(self, waiter):
+        """Buckets whose oldest entry is an acceptable partner for ``waiter``"""
+        return [()]
+
+
+class PreferencePolicy(FifoPolicy):
+    """
+    Match only when both sides' ``preferred_year`` / ``preferred_department``
+    are satisfied; users without preferences match anyone who accepts them.
+
+    Every waiter is filed under its own demand (what it asks for) combined
+    with its year, its department, both, or neither. A newcomer can only be
+    accepted by one of four demands, and its own preference picks which of
+    the four index flavours to look in, so finding a partner is at most four
+    dict hits plus the head of each bucket, whatever the queue length.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.buckets = {}
+
+    def bucket_keys(self, waiter):
+        demand = (waiter.preferred_year or None, waiter.preferred_department or None)
+        keys = [(demand,)]
+        if waiter.year:
+            keys.append((demand, 'year', waiter.year))
+        if waiter.department:
+            keys.append((demand, 'department', waiter.department))
+        if waiter.year and waiter.department:
+            keys.append((demand, 'both', waiter.year, waiter.department))
+        return keys
+
+    def lookup_keys(self, waiter):
+        year, department = waiter.year or None, waiter.department or None
+        # Demands this newcomer satisfies
+        demands = {(None, None), (year, None), (None, department), (year, department)}
+
+        preferred_year = waiter.preferred_year or None
+        preferred_department = waiter.preferred_department or None
+        if preferred_year and preferred_department:
+            suffix = ('both', preferred_year, preferred_department)
+        elif preferred_year:
+            suffix = ('year', preferred_year)
+        elif preferred_department:
+            suffix = ('department', preferred_department)
+        else:
+            suffix = ()
+        return [(demand,) + suffix for demand in demands]
+
+    def add(self, waiter):
+        super().add(waiter)
+        for key in self.bucket_keys(waiter):
+            self.buckets.setdefault(key, WaitQueue()).push(waiter)
+
+    def remove(self, device_uuid):
+        waiter = super().remove(device_uuid)
+        if waiter is not None:
+            for key in self.bucket_keys(waiter):
+                bucket = self.buckets[key]
+                bucket.remove(device_uuid)
+                if not bucket:
+                    del self.buckets[key]
+        return waiter
+
+    def find(self, waiter, skip=None):
+        partner = None
+        for key in self.lookup_keys(waiter):
+            bucket = self.buckets.get(key)
+            if not bucket:
+                continue
+            candidate = bucket.peek(exclude=waiter.device_uuid, skip=skip)
+            # Oldest acceptable waiter wins
+            if candidate is not None and (partner is None or candidate.joined_at < partner.joined_at):
+                partner = candidate
+        return partner
+
+
+class RecentPartners:
+    """
+    Pairs of devices matched within the last ``cooldown`` seconds.
+
+    Pair keys sit in an ``OrderedDict`` in the order they were recorded, so
+    a lookup is one dict hit and expired pairs are trimmed from the old end
+    as new ones arrive; at most ``max_pairs`` are kept. ``seed`` reads pairs
+    from recent calls once, in the background via ``start``, so a restart
+    doesn't forget them. A cooldown of 0 turns the exclusion off.
+    """
+
+    def __init__(self, cooldown=None, max_pairs=None, clock=time.monotonic):
+        if cooldown is None:
+            cooldown = getattr(settings, 'MATCHMAKING_REPEAT_COOLDOWN', 300)
+        self.cooldown = cooldown
+        self.max_pairs = max_pairs or getattr(settings, 'MATCHMAKING_RECENT_PAIRS', 100000)
+        self.clock = clock
+        self.pairs = OrderedDict()
+        self.seeded = False
+        self.skipped = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self.pairs)
+
+    @property
+    def enabled(self):
+        return self.cooldown > 0
+
+    @staticmethod
+    def key(device1_uuid, device2_uuid):
+        device1_uuid, device2_uuid = str(device1_uuid), str(device2_uuid)
+        return (device1_uuid, device2_uuid) if device1_uuid < device2_uuid else (device2_uuid, device1_uuid)
+
+    def add(self, device1_uuid, device2_uuid, age=0):
+        """Record that two devices were matched (or hung up) ``age`` seconds ago"""
+        if not self.enabled:
+            return
+        key = self.key(device1_uuid, device2_uuid)
+        recorded = self.clock() - age
+        previous = self.pairs.pop(key, None)
+        if previous is not None and previous > recorded:
+            recorded = previous
+        self.pairs[key] = recorded
+        self._trim()
+
+    def is_recent(self, device1_uuid, device2_uuid):
+        recorded = self.pairs.get(self.key(device1_uuid, device2_uuid))
+        return recorded is not None and self.clock() - recorded < self.cooldown
+
+    def skip_for(self, waiter):
+        """``find`` filter passing over ``waiter``'s recent partners"""
+        def skip(candidate):
+            if self.is_recent(waiter.device_uuid, candidate.device_uuid):
+                self.skipped += 1
+                return True
+            return False
+        return skip
+
+    def _trim(self):
+        expired = self.clock() - self.cooldown
+        while self.pairs:
+            recorded = next(iter(self.pairs.values()))
+            if recorded > expired and len(self.pairs) <= self.max_pairs:
+                break
+            self.pairs.popitem(last=False)
+
+    def start(self):
+        """Seed on the running event loop unless done or already under way"""
+        if self.seeded or not self.enabled:
+            return
+        loop = asyncio.get_running_loop()
+        # Set before the first await, so concurrent connects seed only once
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._seed())
+
+    async def _seed(self):
+        try:
+            await database_sync_to_async(self.seed)()
+        except Exception:
+            # Matching works without the seed; the next connect tries again
+            pass
+
+    def seed(self):
+        """Load pairs from calls started or ended within the cooldown"""
+        if self.enabled:
+            now = timezone.now()
+            cutoff = now - timedelta(seconds=self.cooldown)
+            calls = VideoCall.objects.filter(
+                Q(started_at__gte=cutoff) | Q(ended_at__gte=cutoff)
+            ).order_by('started_at').values_list('participant1_id', 'participant2_id', 'started_at', 'ended_at')
+            for device1_uuid, device2_uuid, started_at, ended_at in calls:
+                last = max(started_at, ended_at or started_at)
+                self.add(device1_uuid, device2_uuid, age=(now - last).total_seconds())
+        self.seeded = True
+
+
+class Matchmaker:
+    """
+    In-process matchmaking queue.
+
+    ``join`` atomically either pairs the newcomer with a waiter (removing
+    both from the queue) or enqueues it, so two concurrent joins can never
+    take the same partner. Partners for which ``is_stale(waiter)`` is true
+    are evicted instead of matched, and with ``recent`` set, waiters the
+    newcomer was matched with recently are passed over.
+    """
+
+    def __init__(self, policy=None, is_stale=None, recent=None):
+        self.policy = policy or get_matchmaking_policy()
+        self.is_stale = is_stale
+        self.recent = recent
+        self.evicted = 0
+        self._lock = None
+        self._lock_loop = None
+
+    def __len__(self):
+        return len(self.policy)
+
+    def __contains__(self, device_uuid):
+        return device_uuid in self.policy
+
+    def get(self, device_uuid):
+        return self.policy.get(device_uuid)
+
+    async def size(self):
+        return len(self.policy)
+
+    def waiting_uuids(self):
+        return [waiter.device_uuid for waiter in self.policy.queue]
+
+    def join_nowait(self, waiter):
+        """Pair ``waiter`` or enqueue it; returns the partner or None"""
+        # Rejoining replaces any stale entry for the same device
+        self.policy.remove(waiter.device_uuid)
+        recent = self.recent if self.recent is not None and self.recent.enabled else None
+        skip = recent.skip_for(waiter) if recent is not None else None
+
+        while True:
+            partner = self.policy.find(waiter, skip)
+            if partner is None:
+                self.policy.add(waiter)
+                return None
+
+            self.policy.remove(partner.device_uuid)
+            if self.is_stale is None or not self.is_stale(partner):
+                if recent is not None:
+                    recent.add(waiter.device_uuid, partner.device_uuid)
+                return partner
+            # Gone quiet; the idle reaper closes its socket on the next sweep
+            self.evicted += 1
+
+    def leave_nowait(self, device_uuid):
+        return self.policy.remove(device_uuid) is not None
+
+    async def join(self, waiter):
+        async with self._get_lock():
+            return self.join_nowait(waiter)
+
+    async def leave(self, device_uuid):
+        async with self._get_lock():
+            return self.leave_nowait(device_uuid)
+
+    def _get_lock(self):
+        # asyncio locks belong to one event loop; tests run several in turn
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+
+def get_matchmaking_policy():
+    """Build the pairing policy configured by ``MATCHMAKING_POLICY``"""
+    return import_string(getattr(settings, 'MATCHMAKING_POLICY', 'base.matchmaking.PreferencePolicy'))()
+
+
+def get_matchmaker():
+    """Build the matchmaker configured by ``MATCHMAKING_BACKEND``"""
+    backend = getattr(settings, 'MATCHMAKING_BACKEND', 'base.matchmaking.Matchmaker')
+    return import_string(backend)()
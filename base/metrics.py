@@ -0,0 +1,260 @@
+import threading
+import time
+from bisect import bisect_left
+
+from channels.db import DatabaseSyncToAsync
+from django.conf import settings
+
+from base import profiling
+
+# Upper bounds in seconds; handlers, channel layer sends and most queries
+# finish in well under a millisecond, so the low end is fine-grained
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10
+)
+
+
+def format_labels(names, values, extra=''):
+    pairs = [
+        '{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n'))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named family of samples, one child per combination of label values"""
+
+    kind = None
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._children = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            children = sorted(self._children.items())
+        for values, sample in children:
+            lines.extend(self.expose_child(values, sample))
+        return lines
+
+    def expose_child(self, values, sample):
+        return [f'{self.name}{format_labels(self.labels, values)} {format_value(sample)}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *values, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._children[values] = self._children.get(values, 0) + amount
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def set(self, value, *values):
+        with self._lock:
+            self._children[values] = value
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            self._children[values] = self._children.get(values, 0) + amount
+
+    def dec(self, *values, amount=1):
+        self.inc(*values, amount=-amount)
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(registry, name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, amount, *values):
+        if not self.registry.enabled:
+            return
+        # Per-bucket counts; made cumulative only when scraped
+        index = bisect_left(self.buckets, amount)
+        with self._lock:
+            child = self._children.get(values)
+            if child is None:
+                child = self._children[values] = [[0] * (len(self.buckets) + 1), 0.0]
+            child[0][index] += 1
+            child[1] += amount
+
+    def expose_child(self, values, sample):
+        counts, total = sample
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = 'le="{}"'.format(format_value(float(bound)))
+            lines.append(f'{self.name}_bucket{format_labels(self.labels, values, le)} {cumulative}')
+        lines.append(f'{self.name}_sum{format_labels(self.labels, values)} {format_value(total)}')
+        lines.append(f'{self.name}_count{format_labels(self.labels, values)} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    In-process metrics rendered in the Prometheus text exposition format.
+
+    Collectors are coroutines run before each scrape to refresh gauges whose
+    source of truth lives elsewhere (queue depth, active calls). With
+    ``enabled`` off, counters and histograms stop recording; gauges that track
+    state, such as open sockets, keep counting so they stay correct.
+    """
+
+    content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self, enabled=None):
+        if enabled is None:
+            enabled = getattr(settings, 'METRICS_ENABLED', True)
+        self.enabled = enabled
+        self.metrics = {}
+        self.collectors = []
+
+    def register(self, metric):
+        if metric.name in self.metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self.metrics[metric.name] = metric
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def counter(self, name, documentation, labels=()):
+        return Counter(self, name, documentation, labels)
+
+    def gauge(self, name, documentation, labels=()):
+        return Gauge(self, name, documentation, labels)
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return Histogram(self, name, documentation, labels, buckets)
+
+    async def collect(self):
+        for collector in self.collectors:
+            try:
+                await collector()
+            except Exception:
+                # A broken source leaves its gauges at the last value
+                pass
+
+    async def render(self):
+        await self.collect()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+HANDLER_SECONDS = registry.histogram(
+    'zest_ws_handler_seconds', 'Time spent handling one WebSocket message', ('consumer', 'type')
+)
+CHANNEL_LAYER_SECONDS = registry.histogram(
+    'zest_channel_layer_seconds', 'Channel layer send and group_send latency', ('method',)
+)
+DB_SECONDS = registry.histogram(
+    'zest_db_seconds', 'Time spent in each database_sync_to_async call', ('function',)
+)
+OPEN_SOCKETS = registry.gauge(
+    'zest_open_websockets', 'WebSocket connections currently open in this process', ('consumer',)
+)
+QUEUE_DEPTH = registry.gauge('zest_waiting_queue_depth', 'Devices waiting to be matched')
+ACTIVE_CALLS = registry.gauge('zest_active_calls', 'Calls currently in progress')
+
+
+def observe_handler(consumer, message_type, started):
+    """Record one handled WebSocket message of ``message_type``"""
+    HANDLER_SECONDS.observe(time.perf_counter() - started, consumer, message_type)
+    profiling.label(message_type)
+
+
+class TimedDatabaseSyncToAsync(DatabaseSyncToAsync):
+    """
+    ``database_sync_to_async`` that records its time in ``DB_SECONDS``, and
+    the time the caller was blocked on it in the profiler's current sample
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        super().__init__(func, *args, **kwargs)
+        self.metric_label = getattr(func, '__qualname__', None) or repr(func)
+
+    async def __call__(self, *args, **kwargs):
+        if profiling.current_sample.get() is None:
+            return await super().__call__(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await super().__call__(*args, **kwargs)
+        finally:
+            profiling.record_db(time.perf_counter() - started)
+
+    def thread_handler(self, loop, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().thread_handler(loop, *args, **kwargs)
+        finally:
+            DB_SECONDS.observe(time.perf_counter() - started, self.metric_label)
+
+
+# Drop-in for channels.db.database_sync_to_async
+database_sync_to_async = TimedDatabaseSyncToAsync
+
+
+def instrument_channel_layer(channel_layer):
+    """Time ``send`` and ``group_send`` on ``channel_layer``, once per layer instance"""
+    if channel_layer is None or getattr(channel_layer, 'metrics_instrumented', False):
+        return channel_layer
+
+    def timed(method, label):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                CHANNEL_LAYER_SECONDS.observe(elapsed, label)
+                profiling.record_layer(elapsed)
+        return wrapper
+
+    channel_layer.send = timed(channel_layer.send, 'send')
+    channel_layer.group_send = timed(channel_layer.group_send, 'group_send')
+    channel_layer.metrics_instrumented = True
+    return channel_layer
+
+
+class MetricsConsumerMixin:
+    """Counts open sockets per consumer and times the consumer's channel layer"""
+
+    metrics_name = None
+
+    async def websocket_connect(self, message):
+        instrument_channel_layer(self.channel_layer)
+        OPEN_SOCKETS.inc(self.metrics_name)
+        self.metrics_open = True
+        await super().websocket_connect(message)
+
+    async def websocket_disconnect(self, message):
+        if getattr(self, 'metrics_open', False):
+            self.metrics_open = False
+            OPEN_SOCKETS.dec(self.metrics_name)
+        await super().websocket_disconnect(message)
@@ -0,0 +1,100 @@
+# Generated by Django 5.2.2 on 2026-10-17 19:37
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('base', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='device',
+            options={'ordering': ['-last_seen'], 'verbose_name': 'Device', 'verbose_name_plural': 'Devices'},
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='department',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='is_authenticated',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='is_online',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='student_id',
+            field=models.CharField(blank=True, help_text='Student ID from token', max_length=20, null=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='token',
+            field=models.CharField(blank=True, help_text='Marian College authentication token', max_length=255, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='device',
+            name='year',
+            field=models.CharField(blank=True, help_text='Academic year', max_length=10, null=True),
+        ),
+        migrations.CreateModel(
+            name='CallQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('joined_at', models.DateTimeField(auto_now_add=True)),
+                ('is_active', models.BooleanField(default=True)),
+                ('preferred_year', models.CharField(blank=True, help_text='Preferred academic year to match with', max_length=10, null=True)),
+                ('preferred_department', models.CharField(blank=True, max_length=100, null=True)),
+                ('device', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='queue_entry', to='base.device')),
+            ],
+            options={
+                'verbose_name': 'Call Queue Entry',
+                'verbose_name_plural': 'Call Queue Entries',
+                'ordering': ['joined_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='VideoCall',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('started_at', models.DateTimeField(auto_now_add=True, help_text='When the call was initiated')),
+                ('connected_at', models.DateTimeField(blank=True, help_text='When students actually connected', null=True)),
+                ('ended_at', models.DateTimeField(blank=True, null=True)),
+                ('duration_seconds', models.IntegerField(default=0)),
+                ('status', models.CharField(choices=[('waiting', 'Waiting for Connection'), ('connecting', 'Connecting'), ('active', 'Active Call'), ('ended', 'Call Ended'), ('failed', 'Connection Failed')], default='waiting', max_length=20)),
+                ('connection_quality', models.CharField(blank=True, choices=[('poor', 'Poor'), ('good', 'Good'), ('excellent', 'Excellent')], max_length=20, null=True)),
+                ('ended_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='calls_ended', to='base.device')),
+                ('participant1', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calls_as_participant1', to='base.device')),
+                ('participant2', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='calls_as_participant2', to='base.device')),
+            ],
+            options={
+                'verbose_name': 'OnlyMC Video Call',
+                'verbose_name_plural': 'OnlyMC Video Calls',
+                'ordering': ['-started_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CallFeedback',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.IntegerField(choices=[(1, '1 ❤️'), (2, '2 ❤️'), (3, '3 ❤️'), (4, '4 ❤️'), (5, '5 ❤️')], help_text='Rate your OnlyMC experience')),
+                ('comment', models.TextField(blank=True, help_text='Share your thoughts (optional)', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('device', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='base.device')),
+                ('call', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feedback', to='base.videocall')),
+            ],
+            options={
+                'verbose_name': 'Call Feedback',
+                'verbose_name_plural': 'Call Feedback',
+            },
+        ),
+    ]
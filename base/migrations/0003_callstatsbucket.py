@@ -0,0 +1,41 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("base", "0002_devices_calls_and_queue"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="CallStatsBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "bucket_start",
+                    models.DateTimeField(
+                        help_text="Start of the hour this row covers", unique=True
+                    ),
+                ),
+                ("calls_started", models.PositiveIntegerField(default=0)),
+                ("calls_ended", models.PositiveIntegerField(default=0)),
+                ("total_duration_seconds", models.BigIntegerField(default=0)),
+                ("duration_histogram", models.JSONField(default=list)),
+                ("peak_queue_depth", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "verbose_name": "Call Stats Bucket",
+                "verbose_name_plural": "Call Stats Buckets",
+                "ordering": ["-bucket_start"],
+            },
+        ),
+    ]
@@ -0,0 +1,66 @@
+from collections import defaultdict
+
+from django.db import migrations
+
+# Frozen copy of base.rollups as of this migration, so later changes to the
+# histogram bins can't change what it writes
+DURATION_BINS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+def bucket_start(when):
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def duration_bin(seconds):
+    for index, bound in enumerate(DURATION_BINS):
+        if seconds <= bound:
+            return index
+    return len(DURATION_BINS)
+
+
+def empty_histogram():
+    return [0] * (len(DURATION_BINS) + 1)
+
+
+def backfill(apps, schema_editor):
+    # Call history and analytics read the rollups, so fill them from the
+    # calls made before they existed
+    VideoCall = apps.get_model('base', 'VideoCall')
+    CallStatsBucket = apps.get_model('base', 'CallStatsBucket')
+    rebuilt = defaultdict(lambda: {
+        'calls_started': 0,
+        'calls_ended': 0,
+        'total_duration_seconds': 0,
+        'duration_histogram': empty_histogram(),
+    })
+
+    calls = VideoCall.objects.values_list('started_at', 'ended_at', 'duration_seconds')
+    for started_at, ended_at, duration in calls.iterator(chunk_size=2000):
+        rebuilt[bucket_start(started_at)]['calls_started'] += 1
+        if ended_at:
+            bucket = rebuilt[bucket_start(ended_at)]
+            bucket['calls_ended'] += 1
+            bucket['total_duration_seconds'] += duration
+            bucket['duration_histogram'][duration_bin(duration)] += 1
+
+    # Queue depth is never stored per call, so keep any recorded peaks
+    peaks = dict(CallStatsBucket.objects.values_list('bucket_start', 'peak_queue_depth'))
+    CallStatsBucket.objects.all().delete()
+    CallStatsBucket.objects.bulk_create([
+        CallStatsBucket(bucket_start=start, peak_queue_depth=peaks.pop(start, 0), **values)
+        for start, values in rebuilt.items()
+    ] + [
+        CallStatsBucket(bucket_start=start, peak_queue_depth=peak, duration_histogram=empty_histogram())
+        for start, peak in peaks.items()
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("base", "0003_callstatsbucket"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
@@ -3,10 +3,10 @@ from django.db import models
 from django.utils import timezone
 
 
-class MarianStudent(models.Model):
-    """Model to track authenticated Marian College students"""
+class Device(models.Model):
+    """A device (and, once it authenticates, a Marian College student) tracked by UUID"""
     uuid = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    token = models.CharField(max_length=255, unique=True, help_text="Marian College authentication token")
+    token = models.CharField(max_length=255, unique=True, null=True, blank=True, help_text="Marian College authentication token")
     student_id = models.CharField(max_length=20, blank=True, null=True, help_text="Student ID from token")
     year = models.CharField(max_length=10, blank=True, null=True, help_text="Academic year")
     department = models.CharField(max_length=100, blank=True, null=True)
@@ -15,6 +15,7 @@ class MarianStudent(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     last_seen = models.DateTimeField(auto_now=True)
     is_online = models.BooleanField(default=False)
+    is_authenticated = models.BooleanField(default=False)
     
     # Technical details (optional for debugging)
     user_agent = models.TextField(blank=True, null=True)
@@ -22,15 +23,15 @@ class MarianStudent(models.Model):
     
     class Meta:
         ordering = ['-last_seen']
-        verbose_name = "Marian Student"
-        verbose_name_plural = "Marian Students"
+        verbose_name = "Device"
+        verbose_name_plural = "Devices"
     
     def __str__(self):
-        return f"Student {str(self.uuid)[:8]} ({self.student_id or 'Unknown ID'})"
+        return f"Device {str(self.uuid)[:8]} ({self.student_id or 'Unknown ID'})"
     
     @property
     def is_active(self):
-        """Check if student was active in the last 5 minutes"""
+        """Check if the device was active in the last 5 minutes"""
         return (timezone.now() - self.last_seen).total_seconds() < 300
 
 
@@ -45,11 +46,11 @@ class VideoCall(models.Model):
     ]
     
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
-    student1 = models.ForeignKey(MarianStudent, on_delete=models.CASCADE, related_name='calls_as_student1')
-    student2 = models.ForeignKey(MarianStudent, on_delete=models.CASCADE, related_name='calls_as_student2')
+    participant1 = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='calls_as_participant1')
+    participant2 = models.ForeignKey(Device, on_delete=models.CASCADE, related_name='calls_as_participant2')
     
     # Call timing
-    created_at = models.DateTimeField(auto_now_add=True, help_text="When the call was initiated")
+    started_at = models.DateTimeField(auto_now_add=True, help_text="When the call was initiated")
     connected_at = models.DateTimeField(null=True, blank=True, help_text="When students actually connected")
     ended_at = models.DateTimeField(null=True, blank=True)
     duration_seconds = models.IntegerField(default=0)
@@ -60,16 +61,16 @@ class VideoCall(models.Model):
     # Call quality metrics (optional)
     connection_quality = models.CharField(max_length=20, blank=True, null=True, 
                                          choices=[('poor', 'Poor'), ('good', 'Good'), ('excellent', 'Excellent')])
-    ended_by = models.ForeignKey(MarianStudent, on_delete=models.SET_NULL, null=True, blank=True, 
+    ended_by = models.ForeignKey(Device, on_delete=models.SET_NULL, null=True, blank=True, 
                                 related_name='calls_ended')
     
     class Meta:
-        ordering = ['-created_at']
+        ordering = ['-started_at']
         verbose_name = "OnlyMC Video Call"
         verbose_name_plural = "OnlyMC Video Calls"
     
     def __str__(self):
-        return f"OnlyMC Call {str(self.id)[:8]} - {self.student1} ❤️ {self.student2}"
+        return f"OnlyMC Call {str(self.id)[:8]} - {self.participant1} ❤️ {self.participant2}"
     
     def end_call(self, ended_by_student=None):
         """End the call and calculate duration"""
@@ -81,6 +82,9 @@ class VideoCall(models.Model):
             if ended_by_student:
                 self.ended_by = ended_by_student
             self.save()
+            
+            from base.rollups import record_calls_ended
+            record_calls_ended([(self.ended_at, self.duration_seconds)])
     
     def mark_connected(self):
         """Mark the call as successfully connected"""
@@ -101,7 +105,7 @@ class VideoCall(models.Model):
 
 class CallQueue(models.Model):
     """Model to track students waiting for a video call - minimal DB storage"""
-    student = models.OneToOneField(MarianStudent, on_delete=models.CASCADE, related_name='queue_entry')
+    device = models.OneToOneField(Device, on_delete=models.CASCADE, related_name='queue_entry')
     joined_at = models.DateTimeField(auto_now_add=True)
     is_active = models.BooleanField(default=True)
     
@@ -115,7 +119,7 @@ class CallQueue(models.Model):
         verbose_name_plural = "Call Queue Entries"
     
     def __str__(self):
-        return f"💫 {self.student} waiting for love since {self.joined_at.strftime('%H:%M')}"
+        return f"💫 {self.device} waiting for love since {self.joined_at.strftime('%H:%M')}"
 
 
 class CallFeedback(models.Model):
@@ -123,7 +127,7 @@ class CallFeedback(models.Model):
     RATING_CHOICES = [(i, f"{i} ❤️") for i in range(1, 6)]
     
     call = models.OneToOneField(VideoCall, on_delete=models.CASCADE, related_name='feedback')
-    student = models.ForeignKey(MarianStudent, on_delete=models.CASCADE)
+    device = models.ForeignKey(Device, on_delete=models.CASCADE)
     rating = models.IntegerField(choices=RATING_CHOICES, help_text="Rate your OnlyMC experience")
     comment = models.TextField(blank=True, null=True, help_text="Share your thoughts (optional)")
     created_at = models.DateTimeField(auto_now_add=True)
@@ -133,4 +137,23 @@ class CallFeedback(models.Model):
         verbose_name_plural = "Call Feedback"
     
     def __str__(self):
-        return f"Feedback: {self.rating}❤️ from {self.student}"
+        return f"Feedback: {self.rating}❤️ from {self.device}"
+
+
+class CallStatsBucket(models.Model):
+    """Hourly rollup of call volume, durations and queue depth, updated as events happen"""
+    bucket_start = models.DateTimeField(unique=True, help_text="Start of the hour this row covers")
+    calls_started = models.PositiveIntegerField(default=0)
+    calls_ended = models.PositiveIntegerField(default=0)
+    total_duration_seconds = models.BigIntegerField(default=0)
+    # Ended-call counts per duration bin, see base.rollups.DURATION_BINS
+    duration_histogram = models.JSONField(default=list)
+    peak_queue_depth = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-bucket_start']
+        verbose_name = "Call Stats Bucket"
+        verbose_name_plural = "Call Stats Buckets"
+    
+    def __str__(self):
+        return f"📊 {self.bucket_start:%Y-%m-%d %H:00} - {self.calls_started} calls"
@@ -0,0 +1,79 @@
+import base64
+import uuid
+from datetime import datetime
+
+from django.db import connection
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(last_seen, device_uuid):
+    """Opaque cursor pointing just past ``(last_seen, device_uuid)``"""
+    raw = f'{last_seen.isoformat()}|{device_uuid}'
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        last_seen, device_uuid = raw.split('|')
+        return datetime.fromisoformat(last_seen), uuid.UUID(device_uuid)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise InvalidCursor('Invalid cursor') from e
+
+
+def keyset(queryset, cursor=None):
+    """
+    Order ``queryset`` newest first on ``(last_seen, uuid)`` and start after ``cursor``.
+
+    Unlike OFFSET, each page costs the same however deep the client pages,
+    and rows that move between requests are neither skipped nor repeated
+    within one ``last_seen`` value.
+    """
+    queryset = queryset.order_by('-last_seen', '-uuid')
+    if cursor:
+        last_seen, device_uuid = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(last_seen__lt=last_seen) | Q(last_seen=last_seen, uuid__lt=device_uuid)
+        )
+    return queryset
+
+
+def keyset_page(queryset, cursor=None, page_size=100, key=None):
+    """
+    Return ``(rows, next_cursor)``; ``next_cursor`` is None on the last page.
+
+    ``key`` maps a row to its ``(last_seen, uuid)``; the default reads them
+    off model instances.
+    """
+    rows = list(keyset(queryset, cursor)[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    key = key or (lambda row: (row.last_seen, row.uuid))
+    return rows, encode_cursor(*key(rows[-1]))
+
+
+def estimated_count(model):
+    """
+    Cheap row count for ``model``'s table.
+
+    Uses the planner statistics on PostgreSQL and the highest rowid on SQLite
+    (which ignores deleted rows); other backends fall back to COUNT(*).
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                [model._meta.db_table]
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(f'SELECT MAX(rowid) FROM {table}')
+        else:
+            return model.objects.count()
+        row = cursor.fetchone()
+    return max(row[0] or 0, 0) if row else 0
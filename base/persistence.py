@@ -0,0 +1,164 @@
+import asyncio
+from collections import deque
+from itertools import groupby
+
+from django.conf import settings
+from django.db import DatabaseError
+from django.utils import timezone
+
+from base import poll_cache, rollups
+from base.metrics import database_sync_to_async
+from base.models import CallQueue, VideoCall
+
+
+class CallPersistence:
+    """
+    Write-behind persistence for the video call consumer.
+
+    The consumer only appends operations to an in-memory queue; a background
+    task drains it in batches on the database thread, in order, collapsing
+    runs of the same operation into one statement. Rows are addressed by the
+    UUIDs the consumer already holds (``device_id``, ``participant1_id``), so
+    no Device lookups are needed.
+
+    Batches use the sync ORM in one ``database_sync_to_async`` call rather than
+    ``acreate``/``aupdate``: those still hop to the database thread once per
+    statement, and could not collapse a batch into ``bulk_create``.
+    """
+
+    # Polled endpoints affected by each kind of write
+    topics = {
+        'join': poll_cache.QUEUE,
+        'leave': poll_cache.QUEUE,
+        'start': poll_cache.CALLS,
+        'end': poll_cache.CALLS,
+    }
+
+    def __init__(self, batch_size=None):
+        self.batch_size = batch_size or getattr(settings, 'CALL_PERSISTENCE_BATCH_SIZE', 200)
+        self.pending = deque()
+        self.written = 0
+        self.failed = 0
+        self.rollups_failed = 0
+        self._task = None
+
+    # Hot path: never awaits the database
+
+    def queue_join(self, device_uuid, preferred_year=None, preferred_department=None, queue_depth=0):
+        self._enqueue('join', (device_uuid, preferred_year, preferred_department, queue_depth))
+
+    def queue_leave(self, device_uuid):
+        self._enqueue('leave', device_uuid)
+
+    def call_started(self, call_id, device1_uuid, device2_uuid):
+        self._enqueue('start', (call_id, device1_uuid, device2_uuid))
+
+    def call_ended(self, call_id, started_at=None, ended_at=None):
+        ended_at = ended_at or timezone.now()
+        duration = int((ended_at - started_at).total_seconds()) if started_at else 0
+        self._enqueue('end', (call_id, ended_at, duration))
+
+    def _enqueue(self, kind, payload):
+        self.pending.append((kind, payload))
+        if not self._is_draining():
+            self._task = asyncio.get_running_loop().create_task(self.drain())
+
+    def _is_draining(self):
+        if self._task is None or self._task.done():
+            return False
+        # A task left behind by a loop that has since closed will never finish
+        return self._task.get_loop() is asyncio.get_running_loop()
+
+    # Background side
+
+    async def drain(self):
+        """Apply queued operations until the queue is empty"""
+        while self.pending:
+            await database_sync_to_async(self._apply)(self._take_batch())
+
+    def _take_batch(self):
+        return [self.pending.popleft() for _ in range(min(self.batch_size, len(self.pending)))]
+
+    def _apply(self, batch):
+        for kind, group in groupby(batch, key=lambda operation: operation[0]):
+            self._write(kind, [payload for _, payload in group])
+        # Only now do polled endpoints see the change, so only now drop their cache
+        poll_cache.bump(*{self.topics[kind] for kind, _ in batch})
+
+    def _write(self, kind, payloads):
+        write = getattr(self, f'_write_{kind}')
+        try:
+            write(payloads)
+            self.written += len(payloads)
+        except DatabaseError:
+            if len(payloads) == 1:
+                # A bad row (e.g. an unknown device) must not stall the queue
+                self.failed += 1
+                return
+            # Retry one by one so a single bad row doesn't sink the batch
+            for payload in payloads:
+                self._write(kind, [payload])
+
+    async def flush(self):
+        """Wait until everything queued so far is written"""
+        while self._is_draining():
+            await self._task
+        await self.drain()
+
+    def close(self):
+        """Flush-on-shutdown hook, registered with atexit from the app config"""
+        # No event loop or executor is left at exit, so write synchronously
+        self._task = None
+        while self.pending:
+            self._apply(self._take_batch())
+
+    def _roll_up(self, record, *args):
+        # Stats are best effort; a failed rollup must not make a good write retry
+        try:
+            record(*args)
+        except DatabaseError:
+            self.rollups_failed += 1
+
+    def _write_join(self, payloads):
+        CallQueue.objects.bulk_create(
+            [
+                CallQueue(
+                    device_id=device_uuid,
+                    is_active=True,
+                    preferred_year=preferred_year,
+                    preferred_department=preferred_department
+                )
+                for device_uuid, preferred_year, preferred_department, _ in payloads
+            ],
+            ignore_conflicts=True
+        )
+        self._roll_up(rollups.record_queue_depth, max(payload[3] for payload in payloads))
+
+    def _write_leave(self, payloads):
+        CallQueue.objects.filter(device_id__in=payloads).delete()
+
+    def _write_start(self, payloads):
+        VideoCall.objects.bulk_create([
+            VideoCall(
+                id=call_id,
+                participant1_id=device1_uuid,
+                participant2_id=device2_uuid,
+                status='connecting'
+            )
+            for call_id, device1_uuid, device2_uuid in payloads
+        ])
+        self._roll_up(rollups.record_calls_started, [timezone.now()] * len(payloads))
+
+    def _write_end(self, payloads):
+        ended = []
+        for call_id, ended_at, duration in payloads:
+            # Single UPDATE; the ended_at guard mirrors VideoCall.end_call
+            if VideoCall.objects.filter(id=call_id, ended_at__isnull=True).update(
+                ended_at=ended_at,
+                duration_seconds=duration,
+                status='ended'
+            ):
+                ended.append((ended_at, duration))
+        self._roll_up(rollups.record_calls_ended, ended)
+
+call_persistence = CallPersistence()
@@ -0,0 +1,78 @@
+import hashlib
+import uuid
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+
+# What each polled endpoint depends on
+QUEUE = 'queue'
+CALLS = 'calls'
+DEVICES = 'devices'
+
+KEY_PREFIX = 'zest:poll'
+
+
+def _version_key(topic):
+    return f'{KEY_PREFIX}:version:{topic}'
+
+
+def bump(*topics):
+    """Mark ``topics`` as changed so cached responses built from them are dropped"""
+    # A fresh token rather than incr(): no add/incr race, and no error if evicted
+    cache.set_many({_version_key(topic): uuid.uuid4().hex for topic in topics}, timeout=None)
+
+
+def versions(topics):
+    found = cache.get_many([_version_key(topic) for topic in topics])
+    return [found.get(_version_key(topic), '0') for topic in topics]
+
+
+def cached_poll(*topics):
+    """
+    Cache a GET endpoint's rendered response until one of ``topics`` changes.
+
+    Wraps an ``@api_view`` function. The cache key includes the current
+    version of every topic, so a bump makes the next poll miss; entries
+    also expire after ``POLL_CACHE_TIMEOUT`` seconds as a backstop for
+    time-derived fields. Responses carry an ``ETag`` of their body and
+    ``Cache-Control: no-cache``, so browsers revalidate with
+    ``If-None-Match`` and get an empty 304 when nothing changed. A hit,
+    304 or not, runs no queries.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method != 'GET':
+                return view(request, *args, **kwargs)
+
+            key = ':'.join([KEY_PREFIX, view.__name__, *versions(topics), request.get_full_path()])
+            entry = cache.get(key)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                response.render()
+                entry = (
+                    response.content,
+                    response['Content-Type'],
+                    '"%s"' % hashlib.md5(response.content, usedforsecurity=False).hexdigest()
+                )
+                cache.set(key, entry, timeout=getattr(settings, 'POLL_CACHE_TIMEOUT', 10))
+
+            content, content_type, etag = entry
+            if etag in request.headers.get('If-None-Match', ''):
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(content, content_type=content_type)
+            response['ETag'] = etag
+            response['Cache-Control'] = 'no-cache'
+            return response
+        return wrapped
+    return decorator
+
+
+def devices_changed(sender, **kwargs):
+    """``post_save``/``post_delete`` receiver for Device, connected from the app config"""
+    bump(DEVICES)
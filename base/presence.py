@@ -0,0 +1,603 @@
+import asyncio
+import threading
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.utils import timezone
+
+from base import codec, poll_cache
+from base.metrics import database_sync_to_async
+from base.models import Device
+
+
+# Device columns kept next to each entry of the activity index
+PROFILE_FIELDS = ('created_at', 'user_agent', 'ip_address', 'is_authenticated')
+
+
+class ActivityIndex:
+    """
+    In-process index of which devices were active recently.
+
+    A ring of one-second buckets holds the UUIDs last seen in each second and
+    ``last_seen`` maps each of them to the exact time, so "active in the last
+    N seconds" walks N buckets and only touches the devices in them. A bucket
+    is recycled when its slot comes round again, dropping the devices that
+    were not seen since. Device details for listings are kept alongside;
+    ones the index never saw are read in one query when first listed.
+
+    The index starts cold: the first query loads devices active within
+    ``horizon`` seconds from the database, and from then on heartbeats from
+    the presence store and device saves keep it current. It only sees this
+    process's heartbeats, so leave it off when several workers share Redis.
+    """
+
+    def __init__(self, horizon=None, enabled=None):
+        self.horizon = horizon or getattr(settings, 'PRESENCE_INDEX_HORIZON', 60)
+        if enabled is None:
+            enabled = getattr(settings, 'PRESENCE_INDEX', True)
+        self.enabled = enabled
+
+        self.buckets = [set() for _ in range(self.horizon)]
+        self.seconds = [None] * self.horizon
+        self.last_seen = {}
+        self.profiles = {}
+        self.warm = False
+        self.loads = 0
+        self._lock = threading.RLock()
+
+    def covers(self, window):
+        return self.enabled and window < self.horizon
+
+    def reset(self):
+        """Forget everything; the next query loads from the database again"""
+        with self._lock:
+            self.buckets = [set() for _ in range(self.horizon)]
+            self.seconds = [None] * self.horizon
+            self.last_seen.clear()
+            self.profiles.clear()
+            self.warm = False
+
+    def touch(self, device_uuid, when, profile=None):
+        """Record that a device was seen at ``when`` (which may be in the past)"""
+        device_uuid = str(device_uuid)
+        with self._lock:
+            self._unslot(device_uuid)
+            if profile is not None:
+                self.profiles[device_uuid] = tuple(profile)
+            self._place(device_uuid, when)
+
+    def seen(self, device_uuid, when, profile=None):
+        """Like ``touch``, but never moves a device's last_seen backwards"""
+        with self._lock:
+            previous = self.last_seen.get(str(device_uuid))
+            if previous is not None and previous > when:
+                when = previous
+            self.touch(device_uuid, when, profile)
+
+    def remember(self, device_uuid, profile):
+        with self._lock:
+            self.profiles[str(device_uuid)] = tuple(profile)
+
+    def forget(self, device_uuid):
+        device_uuid = str(device_uuid)
+        with self._lock:
+            self._unslot(device_uuid)
+            self.profiles.pop(device_uuid, None)
+
+    def _unslot(self, device_uuid):
+        previous = self.last_seen.pop(device_uuid, None)
+        if previous is not None:
+            second = int(previous.timestamp())
+            if self.seconds[second % self.horizon] == second:
+                self.buckets[second % self.horizon].discard(device_uuid)
+
+    def _place(self, device_uuid, when):
+        second = int(when.timestamp())
+        slot = second % self.horizon
+        current = self.seconds[slot]
+        if current is not None and current > second:
+            # Older than anything the ring holds, so not active
+            self.profiles.pop(device_uuid, None)
+            return
+        if current != second:
+            # The slot comes round again; whoever is still in it went quiet
+            for stale in self.buckets[slot]:
+                del self.last_seen[stale]
+                self.profiles.pop(stale, None)
+            self.buckets[slot] = set()
+            self.seconds[slot] = second
+        self.buckets[slot].add(device_uuid)
+        self.last_seen[device_uuid] = when
+
+    def load(self):
+        """Fill the index from the database; the cold-start fallback"""
+        cutoff = timezone.now() - timedelta(seconds=self.horizon)
+        rows = Device.objects.filter(last_seen__gte=cutoff).values_list('uuid', 'last_seen', *PROFILE_FIELDS)
+        with self._lock:
+            # Heartbeats recorded meanwhile may be newer than the rows
+            for device_uuid, last_seen, *profile in rows:
+                self.seen(device_uuid, last_seen, profile)
+            self.warm = True
+            self.loads += 1
+
+    def _active(self, window, now):
+        cutoff = now - timedelta(seconds=window)
+        newest, oldest = int(now.timestamp()), int(cutoff.timestamp())
+        for second in range(newest, oldest - 1, -1):
+            slot = second % self.horizon
+            if self.seconds[slot] != second:
+                continue
+            bucket = self.buckets[slot]
+            if second == oldest:
+                bucket = [device_uuid for device_uuid in bucket if self.last_seen[device_uuid] >= cutoff]
+            yield bucket
+
+    def count(self, window=30, now=None):
+        """How many devices were active in the last ``window`` seconds"""
+        if not self.warm:
+            self.load()
+        with self._lock:
+            return sum(len(bucket) for bucket in self._active(window, now or timezone.now()))
+
+    def rows(self, window=30, authenticated=False, now=None):
+        """
+        ``(uuid, created_at, last_seen, user_agent, ip_address)`` of devices
+        active in the last ``window`` seconds, newest first
+        """
+        if not self.warm:
+            self.load()
+        with self._lock:
+            active = []
+            for bucket in self._active(window, now or timezone.now()):
+                active.extend(sorted(
+                    ((self.last_seen[device_uuid], device_uuid) for device_uuid in bucket),
+                    reverse=True
+                ))
+            missing = [device_uuid for _, device_uuid in active if device_uuid not in self.profiles]
+
+        if missing:
+            fetched = Device.objects.filter(uuid__in=missing).order_by().values_list('uuid', *PROFILE_FIELDS)
+            with self._lock:
+                for device_uuid, *profile in fetched:
+                    self.profiles[str(device_uuid)] = tuple(profile)
+                for device_uuid in missing:
+                    if device_uuid not in self.profiles:
+                        # Deleted since it was last seen
+                        self._unslot(device_uuid)
+
+        rows = []
+        for last_seen, device_uuid in active:
+            profile = self.profiles.get(device_uuid)
+            if profile is None:
+                continue
+            created_at, user_agent, ip_address, is_authenticated = profile
+            if authenticated and not is_authenticated:
+                continue
+            rows.append((device_uuid, created_at, last_seen, user_agent, ip_address))
+        return rows
+
+
+class PresenceStore:
+    """
+    Write-behind buffer for device heartbeats.
+
+    Heartbeats only touch an in-memory map (and ``index``, if given); the
+    pending ``last_seen`` values are written back with a single bulk UPDATE
+    per batch, either from the background flush task or when the process
+    shuts down.
+    """
+
+    def __init__(self, flush_interval=None, batch_size=500, index=None):
+        if flush_interval is None:
+            flush_interval = getattr(settings, 'PRESENCE_FLUSH_INTERVAL', 5)
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.index = index
+
+        self._pending = {}
+        self._known = set()
+        self._lock = threading.Lock()
+        self._task = None
+        self._last_flush = time.monotonic()
+
+    def is_known(self, device_uuid):
+        return str(device_uuid) in self._known
+
+    def register(self, device_uuid):
+        """Check once that the device exists so later heartbeats stay in memory"""
+        device_uuid = str(device_uuid)
+        if device_uuid in self._known:
+            return True
+        try:
+            # The details come along for the activity index
+            profile = Device.objects.filter(uuid=device_uuid).values_list(*PROFILE_FIELDS).first()
+        except (ValueError, ValidationError):
+            return False
+        if profile is None:
+            return False
+        self._known.add(device_uuid)
+        if self.index is not None:
+            self.index.remember(device_uuid, profile)
+        return True
+
+    def forget(self, device_uuid):
+        """Drop a device, e.g. after it has been deleted"""
+        device_uuid = str(device_uuid)
+        with self._lock:
+            self._known.discard(device_uuid)
+            self._pending.pop(device_uuid, None)
+        if self.index is not None:
+            self.index.forget(device_uuid)
+
+    def touch(self, device_uuid, when=None):
+        """Record a heartbeat for a device"""
+        when = when or timezone.now()
+        with self._lock:
+            self._pending[str(device_uuid)] = when
+        if self.index is not None:
+            self.index.touch(device_uuid, when)
+
+    def mark_offline(self, device_uuid):
+        """Push last_seen into the past so the device drops out of active queries"""
+        self.touch(device_uuid, timezone.now() - timedelta(seconds=60))
+
+    @property
+    def pending_count(self):
+        return len(self._pending)
+
+    def flush(self):
+        """Write all pending heartbeats to the database"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._last_flush = time.monotonic()
+
+        if not pending:
+            return 0
+
+        # bulk_update skips auto_now, so the buffered timestamps are kept as-is
+        devices = [
+            Device(uuid=device_uuid, last_seen=last_seen)
+            for device_uuid, last_seen in pending.items()
+        ]
+        try:
+            Device.objects.bulk_update(devices, ['last_seen'], batch_size=self.batch_size)
+        except Exception:
+            # Put the heartbeats back without clobbering newer ones
+            with self._lock:
+                for device_uuid, last_seen in pending.items():
+                    self._pending.setdefault(device_uuid, last_seen)
+            raise
+        poll_cache.bump(poll_cache.DEVICES)
+        return len(devices)
+
+    async def aflush(self):
+        if not self._pending:
+            return 0
+        return await database_sync_to_async(self.flush)()
+
+    def flush_if_due(self):
+        """Flush inline when no background task is running (e.g. under WSGI)"""
+        if self.is_running:
+            return 0
+        if time.monotonic() - self._last_flush < self.flush_interval:
+            return 0
+        return self.flush()
+
+    @property
+    def is_running(self):
+        if self._task is None or self._task.done():
+            return False
+        try:
+            return self._task.get_loop() is asyncio.get_running_loop()
+        except RuntimeError:
+            return not self._task.get_loop().is_closed()
+
+    def start(self):
+        """Start the periodic flush task on the running event loop"""
+        if not self.is_running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.aflush()
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.aflush()
+            except Exception:
+                # Keep the loop alive; the batch is retried on the next tick
+                pass
+
+    def close(self):
+        """Flush-on-shutdown hook, registered with atexit from the app config"""
+        self._task = None
+        self.flush()
+
+
+def count_active_users(window=30):
+    """Count devices active in the last ``window`` seconds"""
+    if presence_index.covers(window):
+        return presence_index.count(window)
+    cutoff_time = timezone.now() - timedelta(seconds=window)
+    return Device.objects.filter(last_seen__gte=cutoff_time).count()
+
+
+def active_device_rows(window=30, authenticated=False):
+    """``FastDeviceSerializer`` rows of devices active in the last ``window`` seconds, newest first"""
+    if presence_index.covers(window):
+        return presence_index.rows(window, authenticated=authenticated)
+    cutoff_time = timezone.now() - timedelta(seconds=window)
+    devices = Device.objects.filter(last_seen__gte=cutoff_time)
+    if authenticated:
+        devices = devices.filter(is_authenticated=True)
+    return devices.order_by('-last_seen').values_list('uuid', 'created_at', 'last_seen', 'user_agent', 'ip_address')
+
+
+def get_active_users(window=30):
+    """List devices active in the last ``window`` seconds, newest first"""
+    return [
+        {
+            'uuid': str(device_uuid),
+            'last_seen': last_seen.isoformat(),
+            'created_at': created_at.isoformat(),
+            'user_agent': user_agent[:100] if user_agent else None,  # Truncate for privacy
+            'ip_address': ip_address
+        }
+        for device_uuid, created_at, last_seen, user_agent, ip_address in active_device_rows(window)
+    ]
+
+
+def device_saved(sender, instance, **kwargs):
+    """``post_save`` receiver, connected from the app config"""
+    presence_index.seen(instance.uuid, instance.last_seen, [getattr(instance, field) for field in PROFILE_FIELDS])
+
+
+def device_deleted(sender, instance, **kwargs):
+    """``post_delete`` receiver, connected from the app config"""
+    presence_index.forget(instance.uuid)
+
+
+def diff_users(previous, current):
+    """
+    Compare two ``{uuid: user}`` maps.
+
+    ``last_seen`` is left out of the comparison; it moves on every heartbeat and
+    would turn every delta back into a full list.
+    """
+    joined = [user for uuid, user in current.items() if uuid not in previous]
+    left = [uuid for uuid in previous if uuid not in current]
+    updated = [
+        user for uuid, user in current.items()
+        if uuid in previous and _without_last_seen(previous[uuid]) != _without_last_seen(user)
+    ]
+    return joined, left, updated
+
+
+def _without_last_seen(user):
+    return {key: value for key, value in user.items() if key != 'last_seen'}
+
+
+class PresenceBroadcaster:
+    """
+    Publishes presence snapshots on a ticker.
+
+    Requests only mark the snapshot dirty; a ticker publishes at most once per
+    ``window`` while requests keep coming and stops when they do, so the
+    publish rate no longer follows the event rate. ``stats`` reports how many
+    requests were merged.
+
+    Changes made on other workers never reach ``request``, so while this
+    process has live-users connections a sync ticker also re-reads the
+    shared snapshot every ``sync_interval`` seconds and publishes if anyone
+    joined, left or changed.
+
+    Protocol 1 clients are spread over ``shards`` groups owned by this
+    process (see ``shard_group``). A tick encodes the snapshot once and sends
+    it shard by shard, yielding to the event loop in between, so one publish
+    never holds the loop for a full O(N) fan-out, and each worker only
+    publishes to its own connections.
+
+    Clients on protocol 2 sit in ``delta_group`` instead and only receive
+    ``joined``/``left``/``updated`` changes tagged with a monotonic ``seq``.
+    The sequence is per process, so the delta group is per process as well;
+    each process diffs the shared snapshot, so it still sees every worker's
+    changes.
+    """
+
+    def __init__(self, group_name='live_users', window=None, snapshot=None, store=None, shards=None,
+                 sync_interval=None):
+        if window is None:
+            window = getattr(settings, 'PRESENCE_BROADCAST_WINDOW', 0.25)
+        if sync_interval is None:
+            sync_interval = getattr(settings, 'PRESENCE_SYNC_INTERVAL', 2)
+        # Unique per process; pids repeat across containers
+        instance = uuid.uuid4().hex[:12]
+        self.group_name = group_name
+        self.delta_group = f'{group_name}.delta.{instance}'
+        self.shards = shards or getattr(settings, 'PRESENCE_SHARDS', 8)
+        self.shard_groups = [f'{group_name}.{instance}.{index}' for index in range(self.shards)]
+        self.window = window
+        self.sync_interval = sync_interval
+        self.snapshot = snapshot or database_sync_to_async(get_active_users)
+        self.store = store
+
+        self.requested = 0
+        self.merged = 0
+        self.sent = 0
+        self.synced = 0
+        self.seq = 0
+        self.subscribers = set()
+        self._users = None
+        self._dirty = False
+        self._channel_layer = None
+        self._task = None
+        self._sync_task = None
+        self._lock = None
+        self._lock_loop = None
+
+    def shard_group(self, channel_name):
+        """Group a protocol 1 connection joins; stable for its channel name"""
+        return self.shard_groups[zlib.crc32(channel_name.encode()) % self.shards]
+
+    @property
+    def stats(self):
+        return {
+            'requested': self.requested,
+            'merged': self.merged,
+            'sent': self.sent,
+            'synced': self.synced,
+            'seq': self.seq,
+            'window': self.window,
+            'shards': self.shards,
+            'subscribers': len(self.subscribers),
+        }
+
+    def subscribe(self, channel_layer, channel_name):
+        """Count a local connection in; the sync ticker runs while there are any"""
+        self.subscribers.add(channel_name)
+        self._channel_layer = channel_layer
+        if self.sync_interval <= 0:
+            return
+        loop = asyncio.get_running_loop()
+        if self._sync_task is None or self._sync_task.done() or self._sync_task.get_loop() is not loop:
+            self._sync_task = loop.create_task(self._sync())
+
+    def unsubscribe(self, channel_name):
+        self.subscribers.discard(channel_name)
+        if not self.subscribers and self._sync_task is not None:
+            self._sync_task.cancel()
+            self._sync_task = None
+
+    async def request(self, channel_layer):
+        """Ask for a broadcast; merged into the next tick if one is pending"""
+        self.requested += 1
+        self._channel_layer = channel_layer
+        if self._dirty:
+            self.merged += 1
+        self._dirty = True
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._tick())
+
+    async def resync(self, channel_layer):
+        """
+        Return ``(seq, users)`` for a protocol 2 snapshot.
+
+        The snapshot is refreshed first, and any difference from what the delta
+        group last saw goes out as a delta, so the returned seq lines up with
+        what other clients hold.
+        """
+        async with self._get_lock():
+            await self._refresh(channel_layer, send_full=False)
+            return self.seq, list(self._users.values())
+
+    async def _tick(self):
+        while self._dirty:
+            await asyncio.sleep(self.window)
+            # Requests from here on need a fresh snapshot on the next tick
+            self._dirty = False
+            async with self._get_lock():
+                await self._refresh(self._channel_layer, send_full=True)
+            self.sent += 1
+
+    async def _sync(self):
+        while self.subscribers:
+            await asyncio.sleep(self.sync_interval)
+            if self._dirty:
+                # A local tick is due anyway
+                continue
+            try:
+                async with self._get_lock():
+                    if await self._refresh(self._channel_layer, send_full=True, only_changes=True):
+                        self.sent += 1
+                self.synced += 1
+            except Exception:
+                # Try again on the next interval
+                pass
+
+    async def _refresh(self, channel_layer, send_full, only_changes=False):
+        """
+        Snapshot, publish and diff; returns whether a full snapshot was sent.
+
+        With ``only_changes`` the full snapshot only goes out if someone joined,
+        left or changed, and buffered heartbeats are left to the flush task.
+        """
+        if not only_changes:
+            store = self.store or presence_store
+            # Write pending heartbeats first so the snapshot includes them
+            await store.aflush()
+        active_users = await self.snapshot()
+        timestamp = timezone.now().isoformat()
+
+        current = {user['uuid']: user for user in active_users}
+        changes = diff_users(self._users, current) if self._users is not None else None
+        changed = changes is None or any(changes)
+
+        sent = send_full and (changed or not only_changes)
+        if sent:
+            # Encoded once here; members only queue the finished frame
+            message = {
+                'type': 'user_count_update',
+                'frame': codec.dumps({
+                    'type': 'user_count_update',
+                    'active_users': {
+                        'count': len(active_users),
+                        'users': active_users
+                    },
+                    'timestamp': timestamp
+                })
+            }
+            for index, group in enumerate(self.shard_groups):
+                if index:
+                    # Let other work run between shards
+                    await asyncio.sleep(0)
+                await channel_layer.group_send(group, message)
+
+        if changes is None:
+            # First snapshot in this process is the baseline for seq 0
+            self._users = current
+            return sent
+
+        joined, left, updated = changes
+        self._users = current
+        if not changed:
+            return sent
+
+        self.seq += 1
+        await channel_layer.group_send(
+            self.delta_group,
+            {
+                'type': 'presence_delta',
+                'frame': codec.dumps({
+                    'type': 'presence_delta',
+                    'seq': self.seq,
+                    'count': len(current),
+                    'joined': joined,
+                    'left': left,
+                    'updated': updated,
+                    'timestamp': timestamp
+                })
+            }
+        )
+        return sent
+
+    def _get_lock(self):
+        # asyncio locks belong to one event loop; tests run several in turn
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock_loop is not loop:
+            self._lock = asyncio.Lock()
+            self._lock_loop = loop
+        return self._lock
+
+
+presence_index = ActivityIndex()
+presence_store = PresenceStore(index=presence_index)
+presence_broadcaster = PresenceBroadcaster()
@@ -0,0 +1,219 @@
+import cProfile
+import heapq
+import itertools
+import os
+import tempfile
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.utils import timezone
+
+# The sample being recorded by the current WebSocket message, if any
+current_sample = ContextVar('profile_sample', default=None)
+
+
+class Sample:
+    """Where the time went while handling one sampled message"""
+
+    __slots__ = (
+        'consumer', 'message_type', 'received_at', 'wall_seconds', 'db_seconds', 'db_calls',
+        'layer_seconds', 'layer_calls', 'profile_path', 'finished'
+    )
+
+    def __init__(self, consumer):
+        self.consumer = consumer
+        self.message_type = None
+        self.received_at = timezone.now()
+        self.wall_seconds = 0.0
+        self.db_seconds = 0.0
+        self.db_calls = 0
+        self.layer_seconds = 0.0
+        self.layer_calls = 0
+        self.profile_path = None
+        self.finished = False
+
+    def as_dict(self):
+        return {
+            'consumer': self.consumer,
+            'type': self.message_type,
+            'received_at': self.received_at,
+            'wall_ms': round(self.wall_seconds * 1000, 3),
+            'db_ms': round(self.db_seconds * 1000, 3),
+            'db_calls': self.db_calls,
+            'channel_layer_ms': round(self.layer_seconds * 1000, 3),
+            'channel_layer_calls': self.layer_calls,
+            'profile': self.profile_path,
+        }
+
+
+def label(message_type):
+    """Name the message the current sample belongs to"""
+    sample = current_sample.get()
+    if sample is not None:
+        sample.message_type = message_type
+
+
+def record_db(seconds):
+    sample = current_sample.get()
+    # Tasks spawned by a sampled handler inherit the sample; ignore them once it's done
+    if sample is not None and not sample.finished:
+        sample.db_seconds += seconds
+        sample.db_calls += 1
+
+
+def record_layer(seconds):
+    sample = current_sample.get()
+    if sample is not None and not sample.finished:
+        sample.layer_seconds += seconds
+        sample.layer_calls += 1
+
+
+class HandlerProfiler:
+    """
+    Samples one in ``sample_rate`` WebSocket messages per process.
+
+    Each sample records wall time and the time spent awaiting
+    ``database_sync_to_async`` and the channel layer. The ``slowest`` samples
+    are kept for ``report()``; with ``cprofile`` on, they also get a cProfile
+    dump in ``directory`` (other coroutines running on the loop meanwhile
+    show up in it too). A ``sample_rate`` of 0 turns sampling off.
+    """
+
+    def __init__(self, sample_rate=None, slowest=None, cprofile=None, directory=None):
+        self.sample_rate = 0
+        self.slowest = 10
+        self.cprofile = False
+        self.directory = os.path.join(tempfile.gettempdir(), 'zest-profiles')
+        self.configure(
+            sample_rate=getattr(settings, 'PROFILING_SAMPLE_RATE', 0) if sample_rate is None else sample_rate,
+            slowest=getattr(settings, 'PROFILING_SLOWEST', 10) if slowest is None else slowest,
+            cprofile=getattr(settings, 'PROFILING_CPROFILE', False) if cprofile is None else cprofile,
+            directory=directory or getattr(settings, 'PROFILING_DIR', None),
+        )
+        self._counter = itertools.count(1)
+        self._lock = threading.Lock()
+        self._profiling = False
+        self.reset()
+
+    def configure(self, sample_rate=None, slowest=None, cprofile=None, directory=None):
+        if sample_rate is not None:
+            if int(sample_rate) < 0:
+                raise ValueError('sample_rate must be 0 (off) or positive')
+            self.sample_rate = int(sample_rate)
+        if slowest is not None:
+            if int(slowest) < 1:
+                raise ValueError('slowest must be positive')
+            self.slowest = int(slowest)
+        if cprofile is not None:
+            self.cprofile = bool(cprofile)
+        if directory:
+            self.directory = directory
+
+    def reset(self):
+        """Forget collected samples (and delete their profile dumps)"""
+        for _, _, sample in getattr(self, '_slowest', []):
+            self._remove_profile(sample)
+        self.sampled = 0
+        self.totals = {}
+        self._slowest = []
+        self._sequence = itertools.count()
+
+    def should_sample(self):
+        return self.sample_rate > 0 and next(self._counter) % self.sample_rate == 0
+
+    async def run(self, consumer, handler, *args):
+        """Await ``handler(*args)`` as a sample attributed to ``consumer``"""
+        sample = Sample(consumer)
+        token = current_sample.set(sample)
+        # cProfile hooks the whole thread, so only one sample is profiled at a time
+        profile = None
+        if self.cprofile and not self._profiling:
+            self._profiling = True
+            profile = cProfile.Profile()
+            profile.enable()
+        started = time.perf_counter()
+        try:
+            return await handler(*args)
+        finally:
+            sample.wall_seconds = time.perf_counter() - started
+            sample.finished = True
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+            current_sample.reset(token)
+            self.finish(sample, profile)
+
+    def finish(self, sample, profile=None):
+        with self._lock:
+            self.sampled += 1
+            key = (sample.consumer, sample.message_type or 'other')
+            totals = self.totals.setdefault(key, [0, 0.0, 0.0, 0.0])
+            totals[0] += 1
+            totals[1] += sample.wall_seconds
+            totals[2] += sample.db_seconds
+            totals[3] += sample.layer_seconds
+
+            entry = (sample.wall_seconds, next(self._sequence), sample)
+            if len(self._slowest) < self.slowest:
+                heapq.heappush(self._slowest, entry)
+            elif entry[0] > self._slowest[0][0]:
+                self._remove_profile(heapq.heapreplace(self._slowest, entry)[2])
+            else:
+                return
+        if profile is not None:
+            sample.profile_path = self._dump(sample, profile)
+
+    def _dump(self, sample, profile):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, '{}-{}-{}-{}.prof'.format(
+            sample.received_at.strftime('%Y%m%dT%H%M%S%f'), os.getpid(), sample.consumer, sample.message_type or 'other'
+        ))
+        profile.dump_stats(path)
+        return path
+
+    def _remove_profile(self, sample):
+        if sample.profile_path:
+            try:
+                os.remove(sample.profile_path)
+            except OSError:
+                pass
+
+    def report(self):
+        with self._lock:
+            slowest = sorted(self._slowest, reverse=True)
+            totals = sorted(self.totals.items())
+        return {
+            'pid': os.getpid(),
+            'sample_rate': self.sample_rate,
+            'slowest_kept': self.slowest,
+            'cprofile': self.cprofile,
+            'directory': self.directory,
+            'sampled': self.sampled,
+            'handlers': [
+                {
+                    'consumer': consumer,
+                    'type': message_type,
+                    'samples': count,
+                    'avg_wall_ms': round(wall / count * 1000, 3),
+                    'avg_db_ms': round(db / count * 1000, 3),
+                    'avg_channel_layer_ms': round(layer / count * 1000, 3),
+                }
+                for (consumer, message_type), (count, wall, db, layer) in totals
+            ],
+            'slowest': [sample.as_dict() for _, _, sample in slowest],
+        }
+
+
+handler_profiler = HandlerProfiler()
+
+
+class ProfilingConsumerMixin:
+    """Runs sampled ``websocket.receive`` messages under ``handler_profiler``"""
+
+    async def websocket_receive(self, message):
+        if handler_profiler.should_sample():
+            await handler_profiler.run(self.metrics_name, super().websocket_receive, message)
+        else:
+            await super().websocket_receive(message)
@@ -0,0 +1,188 @@
+import asyncio
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from base import metrics, poll_cache
+from base.metrics import database_sync_to_async
+from base.models import CallQueue, VideoCall
+from base.timing_wheel import TimingWheel
+
+# Close code sent to connections that went quiet
+IDLE_CLOSE_CODE = 4408
+
+REAPED = metrics.registry.counter(
+    'zest_idle_connections_reaped_total', 'WebSockets closed by the idle reaper', ('consumer',)
+)
+ORPHANS_CLEANED = metrics.registry.counter(
+    'zest_orphans_cleaned_total', 'Rows cleaned up by the orphan sweep', ('kind',)
+)
+
+
+def cleanup_orphans(call_ttl, waiter_ttl, waiting=()):
+    """
+    End calls and drop queue entries that outlived any live state
+
+    Calls older than the session TTL can no longer be in the call store, and
+    queue rows older than the waiter TTL belong to nobody unless the device is
+    still in ``waiting``. One UPDATE and one DELETE, however many rows match.
+    """
+    now = timezone.now()
+    calls = VideoCall.objects.filter(
+        ended_at__isnull=True,
+        status__in=('waiting', 'connecting', 'active'),
+        started_at__lt=now - timedelta(seconds=call_ttl)
+    ).update(status='failed', ended_at=now)
+    queue, _ = CallQueue.objects.filter(
+        joined_at__lt=now - timedelta(seconds=waiter_ttl)
+    ).exclude(device_id__in=list(waiting)).delete()
+    if calls:
+        poll_cache.bump(poll_cache.CALLS)
+    if queue:
+        poll_cache.bump(poll_cache.QUEUE)
+    return calls, queue
+
+
+class IdleReaper:
+    """
+    Closes WebSockets that stopped sending, one sweep task per worker.
+
+    Only connections that sent a ``ping`` are tracked (see ``keepalive``):
+    clients that never ping are left to the server's transport-level
+    ping/pong, which also catches half-open sockets. Closing idle sockets is
+    off by default (``WEBSOCKET_IDLE_TIMEOUT = 0``).
+
+    ``touch`` only stores the time of the last message; each connection sits
+    in a timing wheel under its idle deadline, and when that comes due the
+    sweep either reschedules it from the latest activity or hands the
+    consumer to ``reap()``, which cleans up as if it had disconnected and
+    closes the socket. Half-open connections never deliver a disconnect, so
+    without this their queue entries and calls would linger.
+
+    Every ``orphan_interval`` the sweep also runs ``cleanup_orphans`` for rows
+    left behind by crashed workers. Consumers ``start`` the task on connect,
+    so this runs whatever the idle timeout is.
+    """
+
+    def __init__(self, timeout=None, interval=None, orphan_interval=None, queue=None, clock=time.monotonic):
+        if timeout is None:
+            timeout = getattr(settings, 'WEBSOCKET_IDLE_TIMEOUT', 0)
+        self.timeout = timeout
+        self.interval = interval or getattr(settings, 'IDLE_SWEEP_INTERVAL', 5)
+        self.orphan_interval = orphan_interval or getattr(settings, 'ORPHAN_SWEEP_INTERVAL', 60)
+        self.call_ttl = getattr(settings, 'CALL_SESSION_TTL', 4 * 60 * 60)
+        self.waiter_ttl = getattr(settings, 'MATCHMAKING_WAITER_TTL', 600)
+        self.queue = queue
+        self.clock = clock
+
+        self.connections = {}
+        self.last_activity = {}
+        self.wheel = TimingWheel(tick=1.0, slots=128, clock=clock)
+        self.reaped = 0
+        self.orphan_calls = 0
+        self.orphan_queue_entries = 0
+        self._last_orphan_sweep = clock()
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self.timeout > 0
+
+    def register(self, consumer):
+        if not self.enabled:
+            return
+        channel_name = consumer.channel_name
+        self.connections[channel_name] = consumer
+        self.last_activity[channel_name] = self.clock()
+        self.wheel.schedule_in(channel_name, self.timeout)
+        self.start()
+
+    def unregister(self, channel_name):
+        if self.connections.pop(channel_name, None) is not None:
+            del self.last_activity[channel_name]
+            self.wheel.cancel(channel_name)
+
+    def keepalive(self, consumer):
+        """Opt a connection in on its first ``ping``; later ones only touch"""
+        if consumer.channel_name in self.last_activity:
+            self.touch(consumer.channel_name)
+        else:
+            self.register(consumer)
+
+    def touch(self, channel_name):
+        # Hot path: the wheel entry is only moved when it comes due
+        if channel_name in self.last_activity:
+            self.last_activity[channel_name] = self.clock()
+
+    def is_idle(self, channel_name):
+        """Whether a local connection has been quiet for longer than the timeout"""
+        last = self.last_activity.get(channel_name)
+        return last is not None and self.clock() - last > self.timeout
+
+    def is_stale_waiter(self, waiter):
+        """``Matchmaker.is_stale`` hook: skip partners whose socket went quiet"""
+        return self.is_idle(waiter.channel_name)
+
+    def due(self, now=None):
+        """Pop the consumers whose idle deadline passed without activity"""
+        if now is None:
+            now = self.clock()
+        idle = []
+        for channel_name in self.wheel.advance(now):
+            deadline = self.last_activity[channel_name] + self.timeout
+            if deadline > now:
+                self.wheel.schedule(channel_name, deadline)
+            else:
+                idle.append(self.connections[channel_name])
+                self.unregister(channel_name)
+        return idle
+
+    async def sweep(self):
+        idle = self.due()
+        for consumer in idle:
+            try:
+                await consumer.reap()
+            except Exception:
+                # The socket may already be gone; its state was cleaned up first
+                pass
+            REAPED.inc(consumer.metrics_name)
+        self.reaped += len(idle)
+
+        if self.clock() - self._last_orphan_sweep >= self.orphan_interval:
+            self._last_orphan_sweep = self.clock()
+            await self.sweep_orphans()
+        return idle
+
+    async def sweep_orphans(self):
+        # Keep the rows of devices that are still waiting; the Redis queue
+        # has to be asked over the network
+        waiting = self.queue.waiting_uuids() if hasattr(self.queue, 'waiting_uuids') else ()
+        if asyncio.iscoroutine(waiting):
+            waiting = await waiting
+        calls, queue = await database_sync_to_async(cleanup_orphans)(self.call_ttl, self.waiter_ttl, waiting)
+        self.orphan_calls += calls
+        self.orphan_queue_entries += queue
+        ORPHANS_CLEANED.inc('call', amount=calls)
+        ORPHANS_CLEANED.inc('queue_entry', amount=queue)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception:
+                # Try again on the next sweep
+                pass
+
+    @property
+    def is_running(self):
+        if self._task is None or self._task.done():
+            return False
+        return self._task.get_loop() is asyncio.get_running_loop()
+
+    def start(self):
+        """Start the sweep task on the running event loop"""
+        if not self.is_running:
+            self._task = asyncio.get_running_loop().create_task(self._run())
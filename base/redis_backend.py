@@ -0,0 +1,281 @@
+import asyncio
+import json
+import time
+from datetime import datetime
+
+from django.conf import settings
+from redis import asyncio as aioredis
+
+from base.call_sessions import CallSession, CallSessionStore
+from base.matchmaking import Waiter, get_matchmaking_policy
+
+
+# Pair the newcomer with the oldest live head of its lookup buckets, or file
+# it under its own buckets. Runs atomically on the server, so workers sharing
+# the queue can never hand out the same partner twice.
+#
+# The set of all waiters is scored by expiry time instead, so ``size`` can
+# drop waiters whose entry expired without ever reaching a bucket head.
+#
+# KEYS: sequence counter, all waiters, lookup buckets..., own buckets...
+# ARGV: device uuid, number of lookup buckets, waiter key prefix, payload, ttl, expiry time
+JOIN_SCRIPT = """
+local uuid = ARGV[1]
+local n_lookup = tonumber(ARGV[2])
+local prefix = ARGV[3]
+
+local function unlink(member)
+    local buckets = redis.call('HGET', prefix .. member, 'buckets')
+    if buckets then
+        for bucket in string.gmatch(buckets, '[^\\n]+') do
+            redis.call('ZREM', bucket, member)
+        end
+    end
+    redis.call('DEL', prefix .. member)
+end
+
+-- Rejoining replaces any stale entry for the same device
+unlink(uuid)
+
+local best, best_score
+for i = 3, n_lookup + 2 do
+    while true do
+        local head = redis.call('ZRANGE', KEYS[i], 0, 0, 'WITHSCORES')
+        if #head == 0 then
+            break
+        end
+        if redis.call('EXISTS', prefix .. head[1]) == 1 then
+            local score = tonumber(head[2])
+            if best == nil or score < best_score then
+                best, best_score = head[1], score
+            end
+            break
+        end
+        -- The waiter's entry expired; drop the dangling member
+        redis.call('ZREM', KEYS[i], head[1])
+    end
+end
+
+if best then
+    local data = redis.call('HGET', prefix .. best, 'data')
+    unlink(best)
+    return data
+end
+
+local score = redis.call('INCR', KEYS[1])
+local own = {KEYS[2]}
+redis.call('ZADD', KEYS[2], ARGV[6], uuid)
+for i = n_lookup + 3, #KEYS do
+    redis.call('ZADD', KEYS[i], score, uuid)
+    table.insert(own, KEYS[i])
+end
+redis.call('HSET', prefix .. uuid, 'data', ARGV[4], 'buckets', table.concat(own, '\\n'))
+redis.call('EXPIRE', prefix .. uuid, tonumber(ARGV[5]))
+return false
+"""
+
+# Push back the expiry of waiters that are still queued; returns the ones
+# that are gone (matched elsewhere, left or expired).
+#
+# KEYS: all waiters; ARGV: waiter key prefix, ttl, expiry time, device uuids...
+KEEPALIVE_SCRIPT = """
+local gone = {}
+for i = 4, #ARGV do
+    if redis.call('EXPIRE', ARGV[1] .. ARGV[i], tonumber(ARGV[2])) == 1 then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[3], ARGV[i])
+    else
+        table.insert(gone, ARGV[i])
+    end
+end
+return gone
+"""
+
+# KEYS: none; ARGV: device uuid, waiter key prefix
+LEAVE_SCRIPT = """
+local key = ARGV[2] .. ARGV[1]
+local buckets = redis.call('HGET', key, 'buckets')
+if not buckets then
+    return 0
+end
+for bucket in string.gmatch(buckets, '[^\\n]+') do
+    redis.call('ZREM', bucket, ARGV[1])
+end
+redis.call('DEL', key)
+return 1
+"""
+
+
+class RedisClientMixin:
+    """Uses the given client, or lazily builds one per event loop from ``REDIS_URL``"""
+
+    def __init__(self, client=None):
+        self._client = client
+        self._owns_client = client is None
+        self._client_loop = None
+
+    def get_client(self):
+        if not self._owns_client:
+            return self._client
+        # redis.asyncio connections are tied to the loop that opened them
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = aioredis.from_url(settings.REDIS_URL)
+            self._client_loop = loop
+        return self._client
+
+
+class RedisMatchmaker(RedisClientMixin):
+    """
+    Matchmaking queue shared by every worker through Redis.
+
+    Each waiter is a hash with a TTL holding its serialized details; the
+    policy's buckets are sorted sets scored by a global join counter, so the
+    oldest entry of a bucket is its lowest score. Entries whose hash expired
+    are dropped lazily when they reach the head of a bucket.
+
+    The TTL only runs out for waiters whose worker went away: each worker
+    refreshes the entries it queued every third of the TTL for as long as
+    they wait (see ``keepalive``).
+    """
+
+    def __init__(self, client=None, policy=None, prefix='zest:mm', ttl=None):
+        super().__init__(client)
+        self.policy = policy or get_matchmaking_policy()
+        self.prefix = prefix
+        self.ttl = ttl or getattr(settings, 'MATCHMAKING_WAITER_TTL', 600)
+        self._scripts = {}
+        # Waiters queued from this process, kept alive by _keepalive
+        self.local = set()
+        self._task = None
+
+    def _bucket(self, key):
+        return f'{self.prefix}:bucket:{json.dumps(key)}'
+
+    @property
+    def _all(self):
+        return f'{self.prefix}:all'
+
+    def _script(self, name, source):
+        client = self.get_client()
+        cached = self._scripts.get(name)
+        if cached is None or cached[0] is not client:
+            cached = (client, client.register_script(source))
+            self._scripts[name] = cached
+        return cached[1]
+
+    async def join(self, waiter):
+        lookup = [self._bucket(key) for key in self.policy.lookup_keys(waiter)]
+        own = [self._bucket(key) for key in self.policy.bucket_keys(waiter)]
+        data = await self._script('join', JOIN_SCRIPT)(
+            keys=[f'{self.prefix}:seq', self._all] + lookup + own,
+            args=[waiter.device_uuid, len(lookup), f'{self.prefix}:waiter:',
+                  json.dumps(waiter.as_dict()), self.ttl, time.time() + self.ttl]
+        )
+        if not data:
+            self.local.add(waiter.device_uuid)
+            self.start()
+            return None
+        partner = Waiter.from_dict(json.loads(data))
+        self.local.discard(partner.device_uuid)
+        return partner
+
+    async def leave(self, device_uuid):
+        self.local.discard(device_uuid)
+        removed = await self._script('leave', LEAVE_SCRIPT)(
+            keys=[], args=[device_uuid, f'{self.prefix}:waiter:']
+        )
+        return bool(removed)
+
+    async def keepalive(self):
+        """Refresh the TTL of this process's waiters; returns how many are still queued"""
+        if not self.local:
+            return 0
+        gone = await self._script('keepalive', KEEPALIVE_SCRIPT)(
+            keys=[self._all],
+            args=[f'{self.prefix}:waiter:', self.ttl, time.time() + self.ttl] + sorted(self.local)
+        )
+        self.local.difference_update(member.decode() if isinstance(member, bytes) else member for member in gone)
+        return len(self.local)
+
+    async def waiting_uuids(self):
+        """Every live waiter, on any worker"""
+        members = await self.get_client().zrangebyscore(self._all, time.time(), '+inf')
+        return [member.decode() if isinstance(member, bytes) else member for member in members]
+
+    async def _keepalive(self):
+        while self.local:
+            await asyncio.sleep(self.ttl / 3)
+            try:
+                await self.keepalive()
+            except Exception:
+                # Try again on the next round; the TTL leaves two more
+                pass
+
+    def start(self):
+        """Start the keepalive task on the running event loop"""
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._keepalive())
+
+    async def size(self):
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            # Waiters whose socket died expire without leaving
+            pipe.zremrangebyscore(self._all, '-inf', time.time())
+            pipe.zcard(self._all)
+            _, count = await pipe.execute()
+        return count
+
+
+class RedisCallSessionStore(RedisClientMixin, CallSessionStore):
+    """
+    Call sessions shared by every worker and kept across worker restarts.
+
+    Sessions are compact JSON arrays under keys with a TTL, so Redis reaps
+    orphans by itself; a sorted set of expiry times keeps ``size`` O(log n).
+    """
+
+    def __init__(self, client=None, prefix='zest:call', ttl=None):
+        RedisClientMixin.__init__(self, client)
+        CallSessionStore.__init__(self, ttl)
+        self.prefix = prefix
+
+    def _key(self, call_id):
+        return f'{self.prefix}:{call_id}'
+
+    @property
+    def _index(self):
+        return f'{self.prefix}:index'
+
+    async def create(self, session):
+        data = [list(session.participants), list(session.channels), session.started_at.isoformat()]
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            pipe.set(self._key(session.call_id), json.dumps(data), ex=self.ttl)
+            # Sorted by expiry so size() can ignore sessions that timed out
+            pipe.zadd(self._index, {session.call_id: time.time() + self.ttl})
+            await pipe.execute()
+        self.created += 1
+
+    async def get(self, call_id):
+        data = await self.get_client().get(self._key(call_id))
+        if data is None:
+            return None
+        participants, channels, started_at = json.loads(data)
+        return CallSession(call_id, participants, channels, datetime.fromisoformat(started_at))
+
+    async def delete(self, call_id):
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            pipe.delete(self._key(call_id))
+            pipe.zrem(self._index, call_id)
+            deleted, _ = await pipe.execute()
+        # DEL is atomic, so exactly one side of a call sees True
+        if deleted:
+            self.deleted += 1
+        return bool(deleted)
+
+    async def size(self):
+        async with self.get_client().pipeline(transaction=True) as pipe:
+            pipe.zremrangebyscore(self._index, '-inf', time.time())
+            pipe.zcard(self._index)
+            expired, count = await pipe.execute()
+        self.expired += expired
+        return count
@@ -0,0 +1,35 @@
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from base import codec
+
+
+class CodecJSONRenderer(JSONRenderer):
+    """``JSONRenderer`` that encodes through ``base.codec`` (orjson when available)"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Indented output (e.g. ?indent=4 style media params) keeps DRF's encoder
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return codec.dumpb(data)
+
+
+class CodecJSONParser(JSONParser):
+    """``JSONParser`` that decodes through ``base.codec``"""
+
+    renderer_class = CodecJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            data = stream.read()
+            if encoding.lower().replace('-', '') != 'utf8':
+                data = data.decode(encoding)
+            return codec.loads(data)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
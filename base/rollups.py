@@ -0,0 +1,177 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from base.models import CallStatsBucket
+
+# Upper bounds in seconds of the duration histogram; one extra bin holds the rest
+DURATION_BINS = (5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+
+def bucket_start(when=None):
+    """Start of the hour ``when`` falls in"""
+    when = when or timezone.now()
+    return when.replace(minute=0, second=0, microsecond=0)
+
+
+def duration_bin(seconds):
+    for index, bound in enumerate(DURATION_BINS):
+        if seconds <= bound:
+            return index
+    return len(DURATION_BINS)
+
+
+def empty_histogram():
+    return [0] * (len(DURATION_BINS) + 1)
+
+
+def percentile(histogram, fraction):
+    """
+    Estimate a duration percentile from a histogram.
+
+    Returns the upper bound of the bin the percentile falls in, or None when
+    there is no data; durations past the last bound report that bound.
+    """
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = fraction * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return DURATION_BINS[min(index, len(DURATION_BINS) - 1)]
+    return DURATION_BINS[-1]
+
+
+def _bucket(start):
+    return CallStatsBucket.objects.get_or_create(
+        bucket_start=start,
+        defaults={'duration_histogram': empty_histogram()}
+    )[0]
+
+
+def record_calls_started(started_at_list):
+    """Count calls started at the given times"""
+    for start, count in Counter(bucket_start(when) for when in started_at_list).items():
+        _bucket(start)
+        CallStatsBucket.objects.filter(bucket_start=start).update(calls_started=F('calls_started') + count)
+
+
+def record_calls_ended(ended_calls):
+    """Fold ``(ended_at, duration_seconds)`` pairs into their hourly rows"""
+    by_bucket = defaultdict(list)
+    for ended_at, duration in ended_calls:
+        by_bucket[bucket_start(ended_at)].append(duration)
+
+    for start, durations in by_bucket.items():
+        _bucket(start)
+        # The histogram is read-modify-write, so lock the row
+        with transaction.atomic():
+            bucket = CallStatsBucket.objects.select_for_update().get(bucket_start=start)
+            histogram = bucket.duration_histogram or empty_histogram()
+            for duration in durations:
+                histogram[duration_bin(duration)] += 1
+            CallStatsBucket.objects.filter(pk=bucket.pk).update(
+                calls_ended=F('calls_ended') + len(durations),
+                total_duration_seconds=F('total_duration_seconds') + sum(durations),
+                duration_histogram=histogram
+            )
+
+
+def record_queue_depth(depth, when=None):
+    """Raise the hour's peak queue depth to ``depth`` if it is higher"""
+    start = bucket_start(when)
+    _bucket(start)
+    CallStatsBucket.objects.filter(bucket_start=start).update(
+        peak_queue_depth=Greatest(F('peak_queue_depth'), depth)
+    )
+
+
+def summarize(buckets):
+    """Per-bucket rows plus totals for a sequence of CallStatsBucket"""
+    rows = []
+    totals = {
+        'calls_started': 0,
+        'calls_ended': 0,
+        'total_duration_seconds': 0,
+        'peak_queue_depth': 0,
+    }
+    histogram = empty_histogram()
+    for bucket in buckets:
+        bucket_histogram = bucket.duration_histogram or empty_histogram()
+        rows.append({
+            'bucket_start': bucket.bucket_start,
+            'calls_started': bucket.calls_started,
+            'calls_ended': bucket.calls_ended,
+            'avg_duration_seconds': _average(bucket.total_duration_seconds, bucket.calls_ended),
+            'p50_duration_seconds': percentile(bucket_histogram, 0.5),
+            'p90_duration_seconds': percentile(bucket_histogram, 0.9),
+            'p99_duration_seconds': percentile(bucket_histogram, 0.99),
+            'peak_queue_depth': bucket.peak_queue_depth,
+        })
+        totals['calls_started'] += bucket.calls_started
+        totals['calls_ended'] += bucket.calls_ended
+        totals['total_duration_seconds'] += bucket.total_duration_seconds
+        totals['peak_queue_depth'] = max(totals['peak_queue_depth'], bucket.peak_queue_depth)
+        histogram = [a + b for a, b in zip(histogram, bucket_histogram)]
+
+    totals['avg_duration_seconds'] = _average(totals['total_duration_seconds'], totals['calls_ended'])
+    totals['p50_duration_seconds'] = percentile(histogram, 0.5)
+    totals['p90_duration_seconds'] = percentile(histogram, 0.9)
+    totals['p99_duration_seconds'] = percentile(histogram, 0.99)
+    return rows, totals
+
+
+def rebuild(video_calls, buckets, chunk_size=2000):
+    """
+    Rebuild every hourly row from ``video_calls`` (a VideoCall queryset)
+    into the ``buckets`` model; returns the number of hours with calls.
+    Migration 0004 keeps its own copy of this.
+    """
+    rebuilt = defaultdict(lambda: {
+        'calls_started': 0,
+        'calls_ended': 0,
+        'total_duration_seconds': 0,
+        'duration_histogram': empty_histogram(),
+    })
+
+    calls = video_calls.values_list('started_at', 'ended_at', 'duration_seconds')
+    for started_at, ended_at, duration in calls.iterator(chunk_size=chunk_size):
+        rebuilt[bucket_start(started_at)]['calls_started'] += 1
+        if ended_at:
+            bucket = rebuilt[bucket_start(ended_at)]
+            bucket['calls_ended'] += 1
+            bucket['total_duration_seconds'] += duration
+            bucket['duration_histogram'][duration_bin(duration)] += 1
+
+    with transaction.atomic():
+        # Queue depth is never stored per call, so keep the recorded peaks
+        peaks = dict(buckets.objects.values_list('bucket_start', 'peak_queue_depth'))
+        buckets.objects.all().delete()
+        buckets.objects.bulk_create([
+            buckets(bucket_start=start, peak_queue_depth=peaks.pop(start, 0), **values)
+            for start, values in rebuilt.items()
+        ] + [
+            buckets(bucket_start=start, peak_queue_depth=peak, duration_histogram=empty_histogram())
+            for start, peak in peaks.items()
+        ])
+    return len(rebuilt)
+
+
+def total_calls():
+    """All calls ever started, read from the rollups instead of counting VideoCall"""
+    return CallStatsBucket.objects.aggregate(total=Sum('calls_started'))['total'] or 0
+
+
+def recent_buckets(hours=24):
+    since = bucket_start() - timedelta(hours=hours - 1)
+    return CallStatsBucket.objects.filter(bucket_start__gte=since).order_by('bucket_start')
+
+
+def _average(total, count):
+    return round(total / count, 1) if count else 0
@@ -1,5 +1,6 @@
 from datetime import timedelta
 
+from django.conf import settings
 from django.utils import timezone
 from rest_framework import serializers
 
@@ -24,3 +25,51 @@ class DeviceSerializer(serializers.ModelSerializer):
         """Get seconds since last seen"""
         time_diff = timezone.now() - obj.last_seen
         return int(time_diff.total_seconds())
+
+
+class FastDeviceSerializer:
+    """
+    Produces the same dicts as ``DeviceSerializer`` from ``values_list`` rows.
+
+    Skips model instances and field objects, and reads the clock once per
+    response instead of twice per row. Use ``rows()`` to fetch the columns in
+    the order ``to_representation`` expects.
+    """
+
+    columns = ('uuid', 'created_at', 'last_seen', 'user_agent', 'ip_address')
+
+    def __init__(self, now=None):
+        self.now = now or timezone.now()
+        self.cutoff = self.now - timedelta(seconds=30)
+        # Same conversion as DRF's DateTimeField.enforce_timezone
+        self.tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def rows(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def format_datetime(self, value):
+        if value is None:
+            return None
+        if self.tz is not None and timezone.is_aware(value):
+            value = value.astimezone(self.tz)
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+
+    def to_representation(self, row):
+        device_uuid, created_at, last_seen, user_agent, ip_address = row
+        format_datetime = self.format_datetime
+        return {
+            'uuid': str(device_uuid),
+            'created_at': format_datetime(created_at),
+            'last_seen': format_datetime(last_seen),
+            'user_agent': user_agent,
+            'ip_address': ip_address,
+            'is_online': last_seen >= self.cutoff,
+            'time_since_last_seen': int((self.now - last_seen).total_seconds()),
+        }
+
+    def serialize(self, rows):
+        to_representation = self.to_representation
+        return [to_representation(row) for row in rows]
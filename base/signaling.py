@@ -0,0 +1,34 @@
+import re
+
+# Signaling messages the server only relays to the partner
+RELAY_TYPES = ('webrtc_offer', 'webrtc_answer', 'webrtc_ice')
+
+# Matches the leading "type" key of a frame without parsing the rest of it
+RELAY_PREFIX = re.compile(r'\s*\{\s*"type"\s*:\s*"(webrtc_offer|webrtc_answer|webrtc_ice)"\s*[,}]')
+
+
+def match_relay(text_data):
+    """
+    Detect a relayable signaling frame from its prefix.
+
+    Returns ``(message_type, frame)`` where ``frame`` is the original text
+    with the server's ``type`` appended as the last key. JSON parsers keep
+    the last duplicate key, so a client cannot smuggle a different message
+    type to its partner through the untouched body. Returns None for
+    anything else, which then takes the regular parse-and-dispatch path.
+    """
+    match = RELAY_PREFIX.match(text_data)
+    if match is None:
+        return None
+
+    end = text_data.rstrip()
+    if not end.endswith('}'):
+        return None
+
+    message_type = match.group(1)
+    return message_type, f'{end[:-1]},"type":"{message_type}"}}'
+
+
+def ice_batch_frame(frames):
+    """Join already-encoded ICE frames into one ``webrtc_ice_batch`` frame"""
+    return '{"type":"webrtc_ice_batch","messages":[' + ','.join(frames) + ']}'
@@ -1,3 +1,1422 @@
-from django.test import TestCase
+import asyncio
+import decimal
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+from datetime import timedelta
 
-# Create your tests here.
+from unittest import mock, skipUnless
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from base import codec, metrics, poll_cache
+from base.admin_metrics import AdminMetricsTicker
+from base.auth_cache import DeviceAuthCache, device_auth_cache
+from base.backpressure import DISCONNECT, DROP_OLDEST, LATEST, OutboundQueue
+from base.call_sessions import CallSession, InMemoryCallSessionStore
+from base.consumers import ACTIVE_CALLS, WAITING_QUEUE, VideoCallConsumer
+from base.matchmaking import FifoPolicy, Matchmaker, PreferencePolicy, RecentPartners, Waiter, WaitQueue
+from base.models import CallQueue, CallStatsBucket, Device, VideoCall
+from base.persistence import CallPersistence
+from base.redis_backend import RedisCallSessionStore, RedisMatchmaker
+from base.rollups import percentile
+from base.signaling import match_relay
+from base.timing_wheel import TimingWheel
+from base.presence import (
+    ActivityIndex, PresenceBroadcaster, PresenceStore, get_active_users, presence_index, presence_store
+)
+from base.profiling import HandlerProfiler, handler_profiler
+from base.reaper import IdleReaper, cleanup_orphans
+from base.serializers import DeviceSerializer, FastDeviceSerializer
+
+
+class PresenceStoreTests(TestCase):
+    def setUp(self):
+        self.store = PresenceStore(flush_interval=60)
+        self.devices = [Device.objects.create() for _ in range(5)]
+
+    def test_heartbeats_are_buffered_until_flush(self):
+        stale = timezone.now() - timedelta(minutes=10)
+        Device.objects.update(last_seen=stale)
+
+        with self.assertNumQueries(0):
+            for device in self.devices:
+                self.store.touch(device.uuid)
+                self.store.touch(device.uuid)
+
+        self.assertEqual(self.store.pending_count, 5)
+        self.assertFalse(Device.objects.filter(last_seen__gt=stale).exists())
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.store.flush(), 5)
+        self.assertEqual(Device.objects.filter(last_seen__gt=stale).count(), 5)
+        self.assertEqual(self.store.pending_count, 0)
+
+    def test_mark_offline_writes_past_timestamp(self):
+        device = self.devices[0]
+        self.store.touch(device.uuid)
+        self.store.mark_offline(device.uuid)
+        self.store.flush()
+
+        device.refresh_from_db()
+        self.assertLess(device.last_seen, timezone.now() - timedelta(seconds=30))
+
+    def test_register_checks_existence_once(self):
+        device = self.devices[0]
+        with self.assertNumQueries(1):
+            self.assertTrue(self.store.register(device.uuid))
+            self.assertTrue(self.store.register(device.uuid))
+
+        self.assertFalse(self.store.register('not-a-uuid'))
+        self.assertFalse(self.store.register('00000000-0000-0000-0000-000000000000'))
+
+    def test_update_activity_view_uses_store(self):
+        device = self.devices[0]
+        response = self.client.post(
+            '/api/auth/update-activity/',
+            {'uuid': str(device.uuid)},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(presence_store.flush(), 1)
+
+        response = self.client.post(
+            '/api/auth/update-activity/',
+            {'uuid': '00000000-0000-0000-0000-000000000000'},
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class ActivityIndexTests(TestCase):
+    def setUp(self):
+        self.index = ActivityIndex(horizon=60)
+        self.now = timezone.now()
+        self.devices = [Device.objects.create(user_agent=f'agent {n}') for n in range(4)]
+        Device.objects.update(last_seen=self.now - timedelta(hours=1))
+
+    def test_cold_index_loads_from_database_once(self):
+        Device.objects.filter(uuid=self.devices[0].uuid).update(last_seen=self.now - timedelta(seconds=5))
+        with self.assertNumQueries(1):
+            self.assertEqual(self.index.count(30, now=self.now), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index.count(30, now=self.now), 1)
+            rows = self.index.rows(30, now=self.now)
+        self.assertEqual([row[0] for row in rows], [str(self.devices[0].uuid)])
+        self.assertEqual(rows[0][3], 'agent 0')
+
+    def test_heartbeats_answer_newest_first_without_queries(self):
+        self.index.load()
+        for device, age in zip(self.devices, (20, 1, 45, 10)):
+            self.index.touch(device.uuid, self.now - timedelta(seconds=age), [device.created_at, device.user_agent, None, True])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.index.count(30, now=self.now), 3)
+            rows = self.index.rows(30, now=self.now)
+        self.assertEqual([row[0] for row in rows], [str(self.devices[n].uuid) for n in (1, 3, 0)])
+
+        # Moving a device between buckets leaves it counted once
+        self.index.touch(self.devices[0].uuid, self.now)
+        self.assertEqual(self.index.count(30, now=self.now), 3)
+        self.assertEqual(self.index.rows(30, now=self.now)[0][0], str(self.devices[0].uuid))
+
+    def test_quiet_devices_drop_out_when_their_bucket_is_reused(self):
+        self.index.load()
+        quiet, busy = self.devices[:2]
+        self.index.touch(quiet.uuid, self.now - timedelta(seconds=60))
+        self.index.touch(busy.uuid, self.now)
+        self.assertNotIn(str(quiet.uuid), self.index.last_seen)
+        self.assertEqual(self.index.count(30, now=self.now), 1)
+
+        # Offline marks and anything older than the ring are not active either
+        self.index.touch(busy.uuid, self.now - timedelta(seconds=120))
+        self.assertEqual(self.index.count(30, now=self.now), 0)
+
+    def test_missing_details_are_fetched_in_one_query(self):
+        self.index.load()
+        for device in self.devices:
+            self.index.touch(device.uuid, self.now)
+        self.devices[3].delete()
+        with self.assertNumQueries(1):
+            rows = self.index.rows(30, now=self.now)
+        self.assertEqual(len(rows), 3)
+        with self.assertNumQueries(0):
+            self.index.rows(30, now=self.now)
+
+    def test_heartbeats_and_saves_reach_live_users(self):
+        presence_index.reset()
+        self.addCleanup(presence_index.reset)
+        self.addCleanup(presence_store.flush)
+        self.client.get('/api/live-users/')
+
+        anonymous, authenticated = self.devices[:2]
+        authenticated.is_authenticated = True
+        authenticated.save()
+        self.assertTrue(presence_store.register(anonymous.uuid))
+        presence_store.touch(anonymous.uuid)
+
+        with self.assertNumQueries(0):
+            data = self.client.get('/api/live-users/').json()
+        self.assertEqual([user['uuid'] for user in data['users']], [str(authenticated.uuid)])
+        self.assertEqual(
+            {user['uuid'] for user in get_active_users()},
+            {str(anonymous.uuid), str(authenticated.uuid)}
+        )
+
+
+try:
+    import fakeredis
+except ImportError:  # pragma: no cover - fakeredis[lua] is a test-only dependency
+    fakeredis = None
+
+
+class FakeChannelLayer:
+    def __init__(self):
+        self.messages = []
+        self.group_messages = []
+
+    async def send(self, channel, message):
+        self.messages.append((channel, message))
+
+    async def group_send(self, group, message):
+        self.group_messages.append((group, message))
+
+
+class PresenceBroadcasterTests(SimpleTestCase):
+    def test_burst_is_merged_into_one_send(self):
+        snapshots = []
+
+        async def snapshot():
+            snapshots.append(1)
+            return [{'uuid': 'a'}, {'uuid': 'b'}]
+
+        layer = FakeChannelLayer()
+        broadcaster = PresenceBroadcaster(window=0.01, snapshot=snapshot, store=PresenceStore(), shards=1)
+
+        async def burst():
+            await asyncio.gather(*[broadcaster.request(layer) for _ in range(100)])
+            await asyncio.sleep(0.05)
+            await broadcaster.request(layer)
+            await asyncio.sleep(0.05)
+
+        async_to_sync(burst)()
+
+        self.assertEqual(len(snapshots), 2)
+        self.assertEqual(len(layer.group_messages), 2)
+        group, message = layer.group_messages[0]
+        self.assertEqual(group, broadcaster.shard_groups[0])
+        self.assertEqual(codec.loads(message['frame'])['active_users']['count'], 2)
+        self.assertEqual(broadcaster.stats['requested'], 101)
+        self.assertEqual(broadcaster.stats['merged'], 99)
+        self.assertEqual(broadcaster.stats['sent'], 2)
+
+    def test_ticks_publish_one_frame_to_every_shard(self):
+        async def snapshot():
+            return [{'uuid': 'a'}]
+
+        layer = FakeChannelLayer()
+        broadcaster = PresenceBroadcaster(window=0.02, snapshot=snapshot, store=PresenceStore(), shards=4)
+
+        async def run():
+            # A steady stream of events still yields one publish per tick
+            for _ in range(10):
+                await broadcaster.request(layer)
+                await asyncio.sleep(0.005)
+            await asyncio.sleep(0.05)
+
+        async_to_sync(run)()
+
+        groups = {broadcaster.shard_group(f'specific.inmemory!{n}') for n in range(200)}
+        self.assertEqual(groups, set(broadcaster.shard_groups))
+        self.assertLessEqual(broadcaster.sent, 4)
+        self.assertEqual(len(layer.group_messages), 4 * broadcaster.sent)
+        # Every shard of a tick gets the same, already encoded, message
+        first_tick = layer.group_messages[:4]
+        self.assertEqual([group for group, _ in first_tick], broadcaster.shard_groups)
+        self.assertEqual(len({id(message) for _, message in first_tick}), 1)
+
+    def test_delta_group_gets_changes_with_seq(self):
+        snapshots = [
+            [{'uuid': 'a', 'last_seen': '1'}, {'uuid': 'b', 'last_seen': '1'}],
+            [{'uuid': 'a', 'last_seen': '2'}, {'uuid': 'c', 'last_seen': '2'}],
+            [{'uuid': 'a', 'last_seen': '3'}, {'uuid': 'c', 'last_seen': '3'}],
+        ]
+
+        async def snapshot():
+            return snapshots.pop(0)
+
+        layer = FakeChannelLayer()
+        broadcaster = PresenceBroadcaster(window=0, snapshot=snapshot, store=PresenceStore())
+
+        async def run():
+            seq, users = await broadcaster.resync(layer)
+            self.assertEqual(seq, 0)
+            self.assertEqual([user['uuid'] for user in users], ['a', 'b'])
+
+            for _ in range(2):
+                await broadcaster.request(layer)
+                await asyncio.sleep(0.01)
+
+        async_to_sync(run)()
+
+        deltas = [
+            codec.loads(message['frame']) for group, message in layer.group_messages
+            if group == broadcaster.delta_group
+        ]
+        # The last snapshot only moved last_seen, so it produces no delta
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0]['seq'], 1)
+        self.assertEqual([user['uuid'] for user in deltas[0]['joined']], ['c'])
+        self.assertEqual(deltas[0]['left'], ['b'])
+        self.assertEqual(deltas[0]['updated'], [])
+        self.assertEqual(broadcaster.seq, 1)
+
+    def test_sync_publishes_changes_made_on_other_workers(self):
+        # Another worker changes the shared snapshot; request() never runs here
+        snapshots = [
+            [{'uuid': 'a', 'last_seen': '1'}],
+            [{'uuid': 'a', 'last_seen': '2'}],
+            [{'uuid': 'a', 'last_seen': '3'}, {'uuid': 'b', 'last_seen': '3'}],
+        ]
+
+        async def snapshot():
+            return snapshots[0] if len(snapshots) == 1 else snapshots.pop(0)
+
+        layer = FakeChannelLayer()
+        broadcaster = PresenceBroadcaster(
+            window=0, snapshot=snapshot, store=PresenceStore(), shards=2, sync_interval=0.01
+        )
+
+        async def run():
+            broadcaster.subscribe(layer, 'specific.inmemory!1')
+            broadcaster.subscribe(layer, 'specific.inmemory!2')
+            await asyncio.sleep(0.1)
+            broadcaster.unsubscribe('specific.inmemory!1')
+            broadcaster.unsubscribe('specific.inmemory!1')
+            self.assertIsNotNone(broadcaster._sync_task)
+            broadcaster.unsubscribe('specific.inmemory!2')
+            self.assertIsNone(broadcaster._sync_task)
+
+        async_to_sync(run)()
+
+        frames = [
+            (group, codec.loads(message['frame'])) for group, message in layer.group_messages
+            if group in broadcaster.shard_groups
+        ]
+        # The baseline and the join; the last_seen-only change and the
+        # unchanged ticks after it publish nothing
+        self.assertEqual(len(frames), 4)
+        self.assertEqual([group for group, _ in frames[2:]], broadcaster.shard_groups)
+        self.assertEqual(frames[-1][1]['active_users']['count'], 2)
+        self.assertEqual(broadcaster.sent, 2)
+        self.assertGreater(broadcaster.synced, 2)
+        # Group names are unique per instance, not per pid
+        self.assertNotEqual(PresenceBroadcaster().shard_groups[0], broadcaster.shard_groups[0])
+
+    def test_sync_sends_deltas_for_changes_on_other_workers(self):
+        snapshots = [
+            [{'uuid': 'a', 'last_seen': '1'}],
+            [{'uuid': 'b', 'last_seen': '2'}],
+        ]
+
+        async def snapshot():
+            return snapshots[0] if len(snapshots) == 1 else snapshots.pop(0)
+
+        layer = FakeChannelLayer()
+        broadcaster = PresenceBroadcaster(window=0, snapshot=snapshot, store=PresenceStore(), sync_interval=0.01)
+
+        async def run():
+            seq, users = await broadcaster.resync(layer)
+            self.assertEqual((seq, [user['uuid'] for user in users]), (0, ['a']))
+            broadcaster.subscribe(layer, 'specific.inmemory!1')
+            await asyncio.sleep(0.05)
+            broadcaster.unsubscribe('specific.inmemory!1')
+
+        async_to_sync(run)()
+
+        deltas = [
+            codec.loads(message['frame']) for group, message in layer.group_messages
+            if group == broadcaster.delta_group
+        ]
+        self.assertEqual(len(deltas), 1)
+        self.assertEqual(deltas[0]['seq'], 1)
+        self.assertEqual([user['uuid'] for user in deltas[0]['joined']], ['b'])
+        self.assertEqual(deltas[0]['left'], ['a'])
+        self.assertNotEqual(PresenceBroadcaster().delta_group, broadcaster.delta_group)
+
+
+class MatchmakingTests(SimpleTestCase):
+    def test_wait_queue_is_fifo_with_cancel(self):
+        queue = WaitQueue()
+        for name in 'abcd':
+            queue.push(Waiter(name, f'channel.{name}'))
+
+        self.assertIsNotNone(queue.remove('b'))
+        self.assertIsNone(queue.remove('b'))
+        self.assertEqual([queue.popleft().device_uuid for _ in range(3)], ['a', 'c', 'd'])
+        self.assertIsNone(queue.popleft())
+
+    def test_fifo_pairs_oldest_waiter(self):
+        matchmaker = Matchmaker(FifoPolicy())
+        self.assertIsNone(matchmaker.join_nowait(Waiter('a', 'channel.a')))
+        self.assertIsNone(matchmaker.join_nowait(Waiter('a', 'channel.a')))
+        self.assertEqual(len(matchmaker), 1)
+
+        self.assertEqual(matchmaker.join_nowait(Waiter('b', 'channel.b')).device_uuid, 'a')
+        self.assertEqual(len(matchmaker), 0)
+
+    def test_preference_policy_respects_both_sides(self):
+        matchmaker = Matchmaker(PreferencePolicy())
+        matchmaker.join_nowait(Waiter('first', 'c1', year='1', department='CS', preferred_year='1'))
+        matchmaker.join_nowait(Waiter('second', 'c2', year='2', department='BCom', preferred_year='1'))
+        matchmaker.join_nowait(Waiter('third', 'c3', year='3', department='CS', preferred_department='BCom'))
+        self.assertEqual(len(matchmaker), 3)
+
+        # Wants a CS third-year, but third only accepts BCom
+        self.assertIsNone(matchmaker.join_nowait(Waiter('x', 'cx', year='1', department='CS',
+                                                        preferred_year='3', preferred_department='CS')))
+
+        partner = matchmaker.join_nowait(Waiter('y', 'cy', year='1', department='BCom'))
+        self.assertEqual(partner.device_uuid, 'first')
+
+        partner = matchmaker.join_nowait(Waiter('z', 'cz', year='1', department='BCom', preferred_year='3'))
+        self.assertEqual(partner.device_uuid, 'third')
+
+        self.assertEqual(len(matchmaker), 2)
+        matchmaker.leave_nowait('second')
+        matchmaker.leave_nowait('x')
+        self.assertEqual(matchmaker.policy.buckets, {})
+
+    def test_concurrent_joins_and_leaves_never_pair_twice(self):
+        matchmaker = Matchmaker(PreferencePolicy())
+        years = ['1', '2', '3', None]
+        departments = ['CS', 'BCom', None]
+        pairs = []
+        left = set()
+        rng = random.Random(4)
+
+        async def client(index):
+            device_uuid = f'device-{index}'
+            waiter = Waiter(
+                device_uuid,
+                f'channel.{index}',
+                year=rng.choice(years),
+                department=rng.choice(departments),
+                preferred_year=rng.choice(years),
+                preferred_department=rng.choice(departments)
+            )
+            await asyncio.sleep(rng.random() / 100)
+            partner = await matchmaker.join(waiter)
+            if partner is not None:
+                pairs.append((device_uuid, partner.device_uuid))
+                return
+            await asyncio.sleep(rng.random() / 100)
+            if rng.random() < 0.3 and await matchmaker.leave(device_uuid):
+                left.add(device_uuid)
+
+        async def run():
+            await asyncio.gather(*[client(index) for index in range(5000)])
+
+        async_to_sync(run)()
+
+        paired = [device_uuid for pair in pairs for device_uuid in pair]
+        self.assertEqual(len(paired), len(set(paired)))
+        self.assertTrue(all(a != b for a, b in pairs))
+        self.assertFalse(left & set(paired))
+        self.assertEqual(len(paired) + len(left) + len(matchmaker), 5000)
+        self.assertGreater(len(pairs), 1000)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RecentPartnersTests(SimpleTestCase):
+    def test_recent_partners_are_passed_over_until_the_cooldown_ends(self):
+        clock = FakeClock()
+        recent = RecentPartners(cooldown=60, clock=clock)
+        matchmaker = Matchmaker(PreferencePolicy(), recent=recent)
+
+        matchmaker.join_nowait(Waiter('a', 'ca'))
+        self.assertEqual(matchmaker.join_nowait(Waiter('b', 'cb')).device_uuid, 'a')
+        self.assertTrue(recent.is_recent('b', 'a'))
+
+        # Both come straight back; c gets the older of the two instead
+        self.assertIsNone(matchmaker.join_nowait(Waiter('a', 'ca')))
+        self.assertIsNone(matchmaker.join_nowait(Waiter('b', 'cb')))
+        self.assertEqual(matchmaker.join_nowait(Waiter('c', 'cc')).device_uuid, 'a')
+        self.assertEqual(recent.skipped, 1)
+
+        clock.now += 61
+        self.assertEqual(matchmaker.join_nowait(Waiter('a', 'ca')).device_uuid, 'b')
+
+    def test_pairs_are_bounded_and_expire_oldest_first(self):
+        clock = FakeClock()
+        recent = RecentPartners(cooldown=60, max_pairs=3, clock=clock)
+        for n in range(5):
+            recent.add(f'x{n}', f'y{n}')
+        self.assertEqual(len(recent), 3)
+        self.assertFalse(recent.is_recent('x0', 'y0'))
+        self.assertTrue(recent.is_recent('y4', 'x4'))
+
+        clock.now += 61
+        recent.add('p', 'q')
+        self.assertEqual(list(recent.pairs), [('p', 'q')])
+
+    def test_start_seeds_once_in_the_background(self):
+        recent = RecentPartners(cooldown=60)
+        disabled = RecentPartners(cooldown=0)
+
+        def seed():
+            recent.seeded = True
+
+        async def run():
+            # Several connects arrive before the seed query returns
+            for _ in range(3):
+                recent.start()
+            await recent._task
+            recent.start()
+            disabled.start()
+
+        with mock.patch.object(recent, 'seed', side_effect=seed) as seeded:
+            async_to_sync(run)()
+        self.assertEqual(seeded.call_count, 1)
+        self.assertIsNone(disabled._task)
+
+    def test_zero_cooldown_turns_it_off(self):
+        recent = RecentPartners(cooldown=0)
+        matchmaker = Matchmaker(FifoPolicy(), recent=recent)
+        matchmaker.join_nowait(Waiter('a', 'ca'))
+        matchmaker.join_nowait(Waiter('b', 'cb'))
+        matchmaker.join_nowait(Waiter('a', 'ca'))
+        self.assertEqual(matchmaker.join_nowait(Waiter('b', 'cb')).device_uuid, 'a')
+        self.assertEqual(len(recent), 0)
+
+
+class TimingWheelTests(SimpleTestCase):
+    def test_keys_expire_once_their_deadline_passes(self):
+        clock = FakeClock()
+        wheel = TimingWheel(tick=1, slots=8, clock=clock)
+        wheel.schedule_in('soon', 2)
+        wheel.schedule_in('later', 20)
+        wheel.schedule_in('cancelled', 2)
+        wheel.cancel('cancelled')
+        wheel.schedule_in('moved', 2)
+        wheel.schedule_in('moved', 30)
+
+        clock.now += 1
+        self.assertEqual(wheel.advance(), [])
+        clock.now += 1.5
+        self.assertEqual(wheel.advance(), ['soon'])
+        # Far beyond one revolution, every bucket is visited once
+        clock.now += 100
+        self.assertEqual(sorted(wheel.advance()), ['later', 'moved'])
+        self.assertEqual(len(wheel), 0)
+
+
+class CallSessionStoreTests(SimpleTestCase):
+    def test_sessions_expire_after_ttl(self):
+        clock = FakeClock()
+        store = InMemoryCallSessionStore(ttl=60, tick=1, clock=clock)
+
+        async def run():
+            await store.create(CallSession('ended', ('a', 'b'), ('channel.a', 'channel.b')))
+            await store.create(CallSession('orphan', ('c', 'd'), ('channel.c', 'channel.d')))
+            self.assertEqual((await store.get('ended')).channel_for('b'), 'channel.b')
+            self.assertTrue(await store.delete('ended'))
+            self.assertFalse(await store.delete('ended'))
+
+            clock.now += 61
+            self.assertIsNone(await store.get('orphan'))
+            return await store.stats()
+
+        stats = async_to_sync(run)()
+        self.assertEqual(stats, {'size': 0, 'created': 2, 'deleted': 1, 'expired': 1, 'ttl': 60})
+        self.assertEqual(len(store.wheel), 0)
+
+
+@skipUnless(fakeredis, 'fakeredis[lua] is not installed')
+class RedisBackendTests(SimpleTestCase):
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+
+    def worker(self, policy=None, ttl=None):
+        """A matchmaker as one ASGI worker would see it"""
+        return RedisMatchmaker(fakeredis.FakeAsyncRedis(server=self.server), policy=policy, ttl=ttl)
+
+    def test_workers_share_the_queue(self):
+        first, second = self.worker(FifoPolicy()), self.worker(FifoPolicy())
+
+        async def run():
+            self.assertIsNone(await first.join(Waiter('a', 'channel.a', year='2')))
+            self.assertEqual(await second.size(), 1)
+            partner = await second.join(Waiter('b', 'channel.b'))
+            self.assertEqual(partner.device_uuid, 'a')
+            self.assertEqual(partner.channel_name, 'channel.a')
+            self.assertEqual(partner.year, '2')
+            self.assertEqual(await first.size(), 0)
+
+            await first.join(Waiter('c', 'channel.c'))
+            self.assertTrue(await second.leave('c'))
+            self.assertFalse(await second.leave('c'))
+            self.assertIsNone(await first.join(Waiter('d', 'channel.d')))
+
+        async_to_sync(run)()
+
+    def test_expired_waiters_are_skipped(self):
+        matchmaker = self.worker(FifoPolicy())
+
+        async def run():
+            await matchmaker.join(Waiter('ghost', 'channel.ghost'))
+            await matchmaker.join(Waiter('ghost', 'channel.ghost'))
+            await matchmaker.leave('ghost')
+            await matchmaker.join(Waiter('stale', 'channel.stale'))
+            # Simulate the TTL running out
+            await matchmaker.get_client().delete('zest:mm:waiter:stale')
+            self.assertIsNone(await matchmaker.join(Waiter('live', 'channel.live')))
+            partner = await matchmaker.join(Waiter('next', 'channel.next'))
+            self.assertEqual(partner.device_uuid, 'live')
+
+        async_to_sync(run)()
+
+    def test_expired_waiters_leave_the_queue_size(self):
+        matchmaker = self.worker(FifoPolicy(), ttl=60)
+
+        async def run():
+            await matchmaker.join(Waiter('ghost', 'channel.ghost'))
+            await matchmaker.join(Waiter('ghost', 'channel.ghost'))
+            self.assertEqual(await matchmaker.size(), 1)
+            # The socket died without a leave; only the TTL removes it
+            later = time.time() + 61
+            await matchmaker.get_client().delete('zest:mm:waiter:ghost')
+            with mock.patch('base.redis_backend.time.time', return_value=later):
+                self.assertEqual(await matchmaker.size(), 0)
+
+        async_to_sync(run)()
+
+    def test_queued_waiters_are_kept_alive_by_their_worker(self):
+        first, second = self.worker(FifoPolicy(), ttl=60), self.worker(FifoPolicy(), ttl=60)
+
+        async def run():
+            await first.join(Waiter('a', 'channel.a'))
+            first._task.cancel()
+            client = first.get_client()
+            # Half the TTL later the entry is pushed back by a full TTL
+            later = time.time() + 30
+            with mock.patch('base.redis_backend.time.time', return_value=later):
+                self.assertEqual(await first.keepalive(), 1)
+            self.assertGreater(await client.ttl('zest:mm:waiter:a'), 60)
+            self.assertEqual(await client.zscore('zest:mm:all', 'a'), later + 60)
+            self.assertEqual(await second.waiting_uuids(), ['a'])
+
+            # Matched through another worker; the next round forgets it
+            self.assertEqual((await second.join(Waiter('b', 'channel.b'))).device_uuid, 'a')
+            self.assertEqual(await first.keepalive(), 0)
+            self.assertEqual(first.local, set())
+            self.assertEqual(await second.waiting_uuids(), [])
+
+        async_to_sync(run)()
+
+    def test_preferences_across_workers(self):
+        first, second = self.worker(PreferencePolicy()), self.worker(PreferencePolicy())
+
+        async def run():
+            await first.join(Waiter('cs', 'c1', year='1', department='CS'))
+            await first.join(Waiter('bcom', 'c2', year='1', department='BCom', preferred_year='3'))
+            partner = await second.join(Waiter('x', 'cx', year='3', preferred_department='BCom'))
+            self.assertEqual(partner.device_uuid, 'bcom')
+
+        async_to_sync(run)()
+
+    def test_concurrent_workers_never_pair_twice(self):
+        workers = [self.worker(FifoPolicy()) for _ in range(4)]
+        pairs = []
+
+        async def client(index):
+            partner = await workers[index % 4].join(Waiter(f'device-{index}', f'channel.{index}'))
+            if partner is not None:
+                pairs.append((f'device-{index}', partner.device_uuid))
+
+        async def run():
+            await asyncio.gather(*[client(index) for index in range(400)])
+
+        async_to_sync(run)()
+
+        paired = [device_uuid for pair in pairs for device_uuid in pair]
+        self.assertEqual(len(pairs), 200)
+        self.assertEqual(len(set(paired)), 400)
+
+    def test_call_sessions_are_shared(self):
+        client = fakeredis.FakeAsyncRedis(server=self.server)
+        first, second = RedisCallSessionStore(client), RedisCallSessionStore(client)
+        call_id = str(uuid.uuid4())
+
+        async def run():
+            await first.create(CallSession(call_id, ('a', 'b'), ('channel.a', 'channel.b')))
+            session = await second.get(call_id)
+            self.assertEqual(session.channel_for('b'), 'channel.b')
+            self.assertEqual(session.partner_of('b'), 'a')
+            self.assertEqual(await second.size(), 1)
+
+            self.assertTrue(await second.delete(call_id))
+            self.assertFalse(await first.delete(call_id))
+            self.assertIsNone(await first.get(call_id))
+            self.assertEqual(await first.size(), 0)
+
+        async_to_sync(run)()
+
+
+class SignalingRelayTests(SimpleTestCase):
+    def test_relay_frames_are_forwarded_verbatim(self):
+        frame = json.dumps({'type': 'webrtc_offer', 'offer': {'type': 'offer', 'sdp': 'v=0'}})
+        message_type, relayed = match_relay(frame)
+        self.assertEqual(message_type, 'webrtc_offer')
+        self.assertTrue(relayed.startswith(frame[:-1]))
+        self.assertEqual(json.loads(relayed), json.loads(frame))
+
+    def test_partner_always_sees_the_relay_type(self):
+        _, relayed = match_relay('{"type": "webrtc_ice", "candidate": {}, "type": "call_ended"}\n')
+        self.assertEqual(json.loads(relayed)['type'], 'webrtc_ice')
+
+    def test_other_frames_take_the_parse_path(self):
+        self.assertIsNone(match_relay('{"type": "join_queue"}'))
+        self.assertIsNone(match_relay('{"type": "webrtc_offers"}'))
+        self.assertIsNone(match_relay('{"offer": {}, "type": "webrtc_offer"}'))
+        self.assertIsNone(match_relay('{"type": "webrtc_offer", "offer": {'))
+
+
+class IceBatchingTests(SimpleTestCase):
+    def consumer(self, layer, window):
+        consumer = VideoCallConsumer()
+        consumer.channel_layer = layer
+        consumer.channel_name = 'channel.caller'
+        consumer.device_uuid = 'caller'
+        consumer.partner_uuid = 'callee'
+        consumer.call_id = str(uuid.uuid4())
+        consumer.ice_batch_window = window
+        consumer.ice_frames = []
+        consumer.ice_flush_task = None
+        consumer.relay_lock = asyncio.Lock()
+        return consumer
+
+    def run_call_setup(self, window):
+        layer = FakeChannelLayer()
+
+        async def run():
+            consumer = self.consumer(layer, window)
+            await ACTIVE_CALLS.create(CallSession(consumer.call_id, ('caller', 'callee'), ('channel.caller', 'channel.callee')))
+            try:
+                for index in range(5):
+                    await consumer.receive(json.dumps({'type': 'webrtc_ice', 'candidate': {'n': index}}))
+                await consumer.receive(json.dumps({'type': 'webrtc_offer', 'offer': {'sdp': 'v=0'}}))
+                for index in range(5, 8):
+                    await consumer.receive(json.dumps({'type': 'webrtc_ice', 'candidate': {'n': index}}))
+                await asyncio.sleep(window + 0.05)
+            finally:
+                await ACTIVE_CALLS.delete(consumer.call_id)
+
+        async_to_sync(run)()
+        return [json.loads(message['frame']) for channel, message in layer.messages]
+
+    def test_batching_disabled_relays_each_candidate(self):
+        frames = self.run_call_setup(0)
+        self.assertEqual(len(frames), 9)
+
+    def test_candidates_are_batched_and_flushed_before_offer(self):
+        frames = self.run_call_setup(0.01)
+        self.assertEqual([frame['type'] for frame in frames], ['webrtc_ice_batch', 'webrtc_offer', 'webrtc_ice_batch'])
+        self.assertEqual([message['candidate']['n'] for message in frames[0]['messages']], [0, 1, 2, 3, 4])
+        self.assertEqual([message['candidate']['n'] for message in frames[2]['messages']], [5, 6, 7])
+
+
+class CallPersistenceTests(TransactionTestCase):
+    def setUp(self):
+        self.devices = [str(Device.objects.create().uuid) for _ in range(4)]
+
+    def test_queued_writes_are_batched_in_order(self):
+        persistence = CallPersistence()
+        a, b, c, d = self.devices
+        call_id = str(uuid.uuid4())
+
+        async def run():
+            persistence.queue_join(a, preferred_year='2')
+            persistence.queue_join(b)
+            persistence.queue_join(c)
+            persistence.queue_leave(a)
+            persistence.queue_leave(b)
+            persistence.call_started(call_id, a, b)
+            persistence.call_ended(call_id, started_at=timezone.now() - timedelta(seconds=42))
+            persistence.queue_join(d)
+            await persistence.flush()
+
+        with CaptureQueriesContext(connection) as queries:
+            async_to_sync(run)()
+
+        # join x3, leave x2, start, end, join: one statement per run of operations
+        writes = [
+            query for query in queries.captured_queries
+            if query['sql'] not in ('BEGIN', 'COMMIT') and 'base_callstatsbucket' not in query['sql']
+        ]
+        self.assertEqual(len(writes), 5)
+        self.assertEqual(sorted(CallQueue.objects.values_list('device_id', flat=True)), sorted([uuid.UUID(c), uuid.UUID(d)]))
+
+        call = VideoCall.objects.get(id=call_id)
+        self.assertEqual(call.status, 'ended')
+        self.assertEqual(call.duration_seconds, 42)
+        self.assertEqual(str(call.participant1_id), a)
+        self.assertEqual(persistence.written, 8)
+
+    def test_bad_rows_do_not_sink_the_batch(self):
+        persistence = CallPersistence()
+        unknown = str(uuid.uuid4())
+
+        async def run():
+            persistence.call_started(str(uuid.uuid4()), self.devices[0], self.devices[1])
+            persistence.call_started(str(uuid.uuid4()), unknown, self.devices[1])
+            await persistence.flush()
+
+        async_to_sync(run)()
+        self.assertEqual(VideoCall.objects.count(), 1)
+        self.assertEqual(persistence.failed, 1)
+
+
+class DeviceAuthCacheTests(TestCase):
+    def setUp(self):
+        device_auth_cache.clear()
+        self.addCleanup(device_auth_cache.clear)
+        # Cached logins count as heartbeats in the shared presence store
+        self.addCleanup(presence_store.flush)
+
+    def authenticate(self, user_agent='phone'):
+        return self.client.post(
+            '/api/auth/token/',
+            {'token': 'MC_1234567890'},
+            content_type='application/json',
+            HTTP_USER_AGENT=user_agent
+        )
+
+    def test_reconnects_skip_the_database(self):
+        first = self.authenticate()
+        self.assertEqual(first.status_code, 200)
+
+        with self.assertNumQueries(0):
+            again = self.authenticate()
+        self.assertEqual(again.json()['device_uuid'], first.json()['device_uuid'])
+
+        # A changed user agent is written once, then cached again
+        with self.assertNumQueries(1):
+            self.authenticate('laptop')
+        self.assertEqual(Device.objects.get().user_agent, 'laptop')
+        with self.assertNumQueries(0):
+            self.authenticate('laptop')
+
+    def test_cached_login_heartbeat_is_written_back(self):
+        self.authenticate()
+        Device.objects.update(last_seen=timezone.now() - timedelta(hours=1))
+        # No flush task under the test client, so the view flushes once due
+        presence_store._last_flush -= presence_store.flush_interval
+        with self.assertNumQueries(1):
+            self.authenticate()
+        self.assertGreater(Device.objects.get().last_seen, timezone.now() - timedelta(minutes=1))
+
+    def test_saves_and_deletes_invalidate(self):
+        device, created = device_auth_cache.authenticate('MC_1234567890', 'phone', '127.0.0.1')
+        self.assertTrue(created)
+        self.assertIsNotNone(device_auth_cache.get('MC_1234567890'))
+
+        Device.objects.get(uuid=device.uuid).delete()
+        self.assertIsNone(device_auth_cache.get('MC_1234567890'))
+
+        again, created = device_auth_cache.authenticate('MC_1234567890', 'phone', '127.0.0.1')
+        self.assertTrue(created)
+        self.assertNotEqual(again.uuid, device.uuid)
+
+    def test_entries_expire_and_are_evicted(self):
+        clock = FakeClock()
+        cache = DeviceAuthCache(max_size=2, ttl=10, clock=clock)
+        devices = [Device.objects.create(token=f'MC_00000000{n}') for n in range(3)]
+        for device in devices:
+            cache.put(device)
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(devices[0].token))
+        clock.now += 10
+        self.assertIsNone(cache.get(devices[2].token))
+
+
+class DeviceListingTests(TestCase):
+    def setUp(self):
+        now = timezone.now()
+        Device.objects.bulk_create([Device() for _ in range(25)])
+        # Several rows share a last_seen so the uuid tie-break is exercised
+        for n, device in enumerate(Device.objects.all()):
+            Device.objects.filter(uuid=device.uuid).update(last_seen=now - timedelta(seconds=n // 3))
+
+    def test_pages_cover_every_device_once(self):
+        seen = []
+        cursor = None
+        while True:
+            params = {'page_size': 7}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get('/api/devices/', params).json()
+            seen.extend(device['uuid'] for device in data['devices'])
+            cursor = data['next_cursor']
+            if not cursor:
+                break
+
+        expected = [str(uuid) for uuid in Device.objects.order_by('-last_seen', '-uuid').values_list('uuid', flat=True)]
+        self.assertEqual(seen, expected)
+
+    def test_counts_and_bad_cursor(self):
+        data = self.client.get('/api/devices/', {'count': 'exact'}).json()
+        self.assertEqual(data['count'], 25)
+        self.assertNotIn('count', self.client.get('/api/devices/').json())
+        self.assertEqual(self.client.get('/api/devices/', {'cursor': 'nope'}).status_code, 400)
+
+    def test_stream_is_ndjson(self):
+        response = self.client.get('/api/devices/', {'stream': '1'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 25)
+        self.assertEqual(set(json.loads(lines[0])), {
+            'uuid', 'created_at', 'last_seen', 'user_agent', 'ip_address', 'is_online', 'time_since_last_seen'
+        })
+
+
+class FastDeviceSerializerTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=123456)
+        Device.objects.bulk_create([
+            Device(user_agent='Mozilla/5.0', ip_address='10.0.0.1'),
+            Device(user_agent=None, ip_address=None),
+            Device(user_agent='', ip_address='2001:db8::1'),
+            Device(ip_address='127.0.0.1'),
+        ])
+        # Online, just offline, long gone, and a timestamp without microseconds
+        for device, age in zip(Device.objects.order_by('uuid'), (5, 30.5, 86400, 0)):
+            last_seen = self.now - timedelta(seconds=age)
+            if not age:
+                last_seen = last_seen.replace(microsecond=0)
+            Device.objects.filter(uuid=device.uuid).update(last_seen=last_seen)
+
+    def assert_parity(self):
+        queryset = Device.objects.order_by('-last_seen')
+        with mock.patch('django.utils.timezone.now', return_value=self.now):
+            expected = [dict(row) for row in DeviceSerializer(queryset, many=True).data]
+            serializer = FastDeviceSerializer()
+            self.assertEqual(serializer.serialize(serializer.rows(queryset)), expected)
+
+    def test_matches_model_serializer(self):
+        self.assert_parity()
+
+    def test_matches_model_serializer_in_other_timezone(self):
+        with timezone.override('Asia/Kolkata'):
+            self.assert_parity()
+
+    def test_live_users_view_loads_index_once(self):
+        Device.objects.update(is_authenticated=True)
+        # bulk_create and update() skip signals, so start from a cold index
+        presence_index.reset()
+        self.addCleanup(presence_index.reset)
+        with self.assertNumQueries(1):
+            data = self.client.get('/api/live-users/').json()
+        self.assertEqual(data['count'], len(data['users']))
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/live-users/').json()['users'], data['users'])
+
+
+class CodecTests(SimpleTestCase):
+    def test_native_types_match_stdlib_fallback(self):
+        from django.utils.translation import gettext_lazy
+
+        payload = {
+            'id': uuid.uuid4(),
+            'at': timezone.now(),
+            'naive': timezone.now().replace(tzinfo=None),
+            'price': decimal.Decimal('1.5'),
+            'label': gettext_lazy('hello'),
+            'emoji': '💖',
+            1: [None, True, 2.5],
+        }
+        fallback = json.dumps(payload, default=codec.default, ensure_ascii=False, separators=(',', ':'))
+        self.assertEqual(codec.dumps(payload), fallback)
+        self.assertEqual(codec.dumpb(payload), fallback.encode())
+        self.assertEqual(codec.loads(fallback)['at'], payload['at'].isoformat())
+
+    def test_decode_errors_are_json_decode_errors(self):
+        with self.assertRaises(codec.JSONDecodeError):
+            codec.loads('{"type": ')
+
+    def test_rest_responses_use_the_codec(self):
+        response = self.client.get('/api/status/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response.content, codec.dumpb(response.json()))
+
+
+class PollCacheTests(TransactionTestCase):
+    def setUp(self):
+        self.devices = [str(Device.objects.create().uuid) for _ in range(2)]
+
+    def test_polls_are_cached_until_a_write_bumps_the_version(self):
+        first = self.client.get('/api/queue-status/')
+        etag = first['ETag']
+
+        with self.assertNumQueries(0):
+            again = self.client.get('/api/queue-status/')
+            not_modified = self.client.get('/api/queue-status/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+
+        persistence = CallPersistence()
+
+        async def run():
+            persistence.queue_join(self.devices[0])
+            await persistence.flush()
+
+        async_to_sync(run)()
+        changed = self.client.get('/api/queue-status/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(changed.json()['queue_count'], 1)
+
+    def test_device_changes_bump_the_device_list(self):
+        self.assertEqual(len(self.client.get('/api/devices/').json()['devices']), 2)
+        Device.objects.create()
+        self.assertEqual(len(self.client.get('/api/devices/').json()['devices']), 3)
+
+        store = PresenceStore()
+        versions = poll_cache.versions([poll_cache.DEVICES])
+        store.touch(self.devices[0])
+        store.flush()
+        self.assertNotEqual(poll_cache.versions([poll_cache.DEVICES]), versions)
+
+
+class CallStatsRollupTests(TransactionTestCase):
+    def setUp(self):
+        self.devices = [str(Device.objects.create().uuid) for _ in range(4)]
+
+    def run_calls(self, durations):
+        persistence = CallPersistence()
+
+        async def run():
+            persistence.queue_join(self.devices[2], queue_depth=3)
+            for duration in durations:
+                call_id = str(uuid.uuid4())
+                persistence.call_started(call_id, self.devices[0], self.devices[1])
+                persistence.call_ended(call_id, started_at=timezone.now() - timedelta(seconds=duration))
+            await persistence.flush()
+
+        async_to_sync(run)()
+        return persistence
+
+    def test_persisted_calls_roll_up(self):
+        self.run_calls([10, 20, 600])
+        data = self.client.get('/api/call-stats/').json()
+        self.assertEqual(data['totals']['calls_started'], 3)
+        self.assertEqual(data['totals']['calls_ended'], 3)
+        self.assertEqual(data['totals']['avg_duration_seconds'], 210.0)
+        self.assertEqual(data['totals']['p50_duration_seconds'], 30)
+        self.assertEqual(data['totals']['peak_queue_depth'], 3)
+
+        # The API and call history never touch VideoCall for the totals
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/call-stats/', {'hours': 48})
+        self.assertFalse([query for query in queries.captured_queries if 'base_videocall' in query['sql']])
+
+    def test_backfill_matches_incremental_rollups(self):
+        self.run_calls([3, 45, 45, 4000])
+        incremental = list(CallStatsBucket.objects.values_list(
+            'calls_started', 'calls_ended', 'total_duration_seconds', 'duration_histogram', 'peak_queue_depth'
+        ))
+        call_command('backfill_call_stats', stdout=io.StringIO())
+        rebuilt = list(CallStatsBucket.objects.values_list(
+            'calls_started', 'calls_ended', 'total_duration_seconds', 'duration_histogram', 'peak_queue_depth'
+        ))
+        self.assertEqual(rebuilt, incremental)
+
+    def test_percentile_reports_bin_upper_bounds(self):
+        self.assertIsNone(percentile([0] * 12, 0.5))
+        self.assertEqual(percentile([1, 0, 0, 1] + [0] * 8, 0.5), 5)
+        self.assertEqual(percentile([1, 0, 0, 1] + [0] * 8, 0.9), 60)
+
+
+class AdminMetricsTests(SimpleTestCase):
+    def test_one_collection_per_tick_for_all_admins(self):
+        queue = Matchmaker(FifoPolicy())
+        calls = InMemoryCallSessionStore(ttl=60)
+        ticker = AdminMetricsTicker(queue, calls, interval=60)
+        collected = []
+
+        async def collect_recent(limit):
+            collected.append(limit)
+            return [], 7
+
+        ticker.collect_recent = collect_recent
+        layer = FakeChannelLayer()
+
+        async def run():
+            queue.join_nowait(Waiter('a', 'chan-a'))
+            await calls.create(CallSession('call', ('b', 'c'), ('chan-b', 'chan-c')))
+            ticker.record_match(timedelta(seconds=3))
+            ticker.record_match(timedelta(seconds=1))
+
+            first = await ticker.subscribe(layer)
+            second = await ticker.subscribe(layer)
+            await ticker.tick(layer)
+            ticker.unsubscribe()
+            ticker.unsubscribe()
+            return first, second
+
+        first, second = async_to_sync(run)()
+
+        # The second admin reuses the first frame; the tick is one collection and one send
+        self.assertIs(first, second)
+        self.assertEqual(len(collected), 2)
+        self.assertEqual(len(layer.group_messages), 1)
+        group, message = layer.group_messages[0]
+        self.assertEqual(group, ticker.group_name)
+        # Group names are unique per instance, not per pid
+        self.assertNotEqual(AdminMetricsTicker(queue, calls).group_name, ticker.group_name)
+
+        metrics = json.loads(message['frame'])
+        self.assertEqual(metrics['queue_depth'], 1)
+        self.assertEqual(metrics['active_calls'], 1)
+        self.assertEqual(metrics['total_calls'], 7)
+        self.assertEqual(metrics['match_latency']['avg_seconds'], 2.0)
+        self.assertEqual(metrics['match_latency']['max_seconds'], 3.0)
+        self.assertIsNone(ticker._task)
+
+
+class MetricsTests(SimpleTestCase):
+    def test_histogram_exposition(self):
+        registry = metrics.MetricsRegistry(enabled=True)
+        histogram = registry.histogram('handler_seconds', 'Handler time', ('type',), buckets=(0.01, 0.1))
+        histogram.observe(0.005, 'ping')
+        histogram.observe(0.05, 'ping')
+        histogram.observe(3, 'ping')
+        histogram.observe(0.05, 'say "hi"')
+        registry.gauge('queue_depth', 'Waiting').set(4)
+
+        text = async_to_sync(registry.render)()
+
+        self.assertIn('# TYPE handler_seconds histogram', text)
+        self.assertIn('handler_seconds_bucket{type="ping",le="0.01"} 1', text)
+        self.assertIn('handler_seconds_bucket{type="ping",le="0.1"} 2', text)
+        self.assertIn('handler_seconds_bucket{type="ping",le="+Inf"} 3', text)
+        self.assertIn('handler_seconds_sum{type="ping"} 3.055', text)
+        self.assertIn('handler_seconds_count{type="ping"} 3', text)
+        self.assertIn('handler_seconds_count{type="say \\"hi\\""} 1', text)
+        self.assertIn('queue_depth 4', text)
+
+        # Disabled registries stop recording latencies
+        registry.enabled = False
+        histogram.observe(0.05, 'ping')
+        self.assertIn('handler_seconds_count{type="ping"} 3', async_to_sync(registry.render)())
+
+    def test_endpoint_reports_call_state_and_db_time(self):
+        def lookup():
+            return 42
+
+        async def run():
+            WAITING_QUEUE.join_nowait(Waiter('metrics-device', 'chan-metrics'))
+            try:
+                await metrics.database_sync_to_async(lookup)()
+                return await self.async_client.get('/metrics')
+            finally:
+                await WAITING_QUEUE.leave('metrics-device')
+
+        response = async_to_sync(run)()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('zest_waiting_queue_depth 1', text)
+        self.assertIn('zest_active_calls ', text)
+        self.assertIn(
+            'zest_db_seconds_count{function="MetricsTests.test_endpoint_reports_call_state_and_db_time.<locals>.lookup"} 1',
+            text
+        )
+
+
+class HandlerProfilerTests(SimpleTestCase):
+    def test_samples_split_db_and_channel_layer_time(self):
+        directory = tempfile.mkdtemp()
+        profiler = HandlerProfiler(sample_rate=2, slowest=2, cprofile=True, directory=directory)
+        layer = metrics.instrument_channel_layer(FakeChannelLayer())
+        lookup = metrics.database_sync_to_async(lambda: 42)
+
+        async def handler(delay):
+            await lookup()
+            await layer.send('chan', {'type': 'ping'})
+            await asyncio.sleep(delay)
+            metrics.observe_handler('video_call', 'join_queue', 0)
+
+        async def run():
+            for delay in (0, 0.001, 0, 0.03, 0, 0.02):
+                if profiler.should_sample():
+                    await profiler.run('video_call', handler, delay)
+
+        async_to_sync(run)()
+        report = profiler.report()
+
+        # Every second message was sampled; only the two slowest are kept
+        self.assertEqual(report['sampled'], 3)
+        self.assertEqual(report['handlers'][0]['type'], 'join_queue')
+        self.assertEqual(report['handlers'][0]['samples'], 3)
+        slowest = report['slowest']
+        self.assertEqual(len(slowest), 2)
+        self.assertGreaterEqual(slowest[0]['wall_ms'], 30)
+        self.assertGreaterEqual(slowest[1]['wall_ms'], 20)
+        self.assertEqual((slowest[0]['db_calls'], slowest[0]['channel_layer_calls']), (1, 1))
+        self.assertLess(slowest[0]['db_ms'] + slowest[0]['channel_layer_ms'], slowest[0]['wall_ms'])
+
+        # Evicted samples take their cProfile dumps with them
+        self.assertEqual(sorted(os.listdir(directory)), sorted(os.path.basename(s['profile']) for s in slowest))
+        profiler.reset()
+        self.assertEqual(os.listdir(directory), [])
+
+
+class HandlerProfilingEndpointTests(TestCase):
+    def test_staff_only_runtime_toggle(self):
+        self.addCleanup(handler_profiler.configure, sample_rate=handler_profiler.sample_rate)
+        user = User.objects.create_user('ops', password='secret')
+        self.client.force_login(user)
+
+        response = self.client.post('/api/profiling/', {'sample_rate': 5}, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = self.client.post('/api/profiling/', {'sample_rate': 5}, content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['sample_rate'], 5)
+        self.assertEqual(handler_profiler.sample_rate, 5)
+
+        response = self.client.post('/api/profiling/', {'sample_rate': -1}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        # Form-encoded flags are strings; "false" and "0" must not switch cProfile on
+        self.addCleanup(handler_profiler.configure, cprofile=handler_profiler.cprofile)
+        for value, expected in (('true', True), ('false', False), ('1', True), ('0', False)):
+            response = self.client.post('/api/profiling/', {'cprofile': value})
+            self.assertEqual(response.status_code, 200)
+            self.assertIs(response.json()['cprofile'], expected)
+        response = self.client.post('/api/profiling/', {'cprofile': 'maybe'})
+        self.assertEqual(response.status_code, 400)
+
+
+class FakeReapable:
+    metrics_name = 'video_call'
+
+    def __init__(self, channel_name):
+        self.channel_name = channel_name
+        self.reaped = False
+
+    async def reap(self):
+        self.reaped = True
+
+
+class IdleReaperTests(SimpleTestCase):
+    def test_quiet_connections_are_reaped_and_skipped_by_matching(self):
+        now = [1000.0]
+        reaper = IdleReaper(timeout=30, interval=60, orphan_interval=3600, clock=lambda: now[0])
+        chatty, quiet = FakeReapable('chan-chatty'), FakeReapable('chan-quiet')
+        queue = Matchmaker(FifoPolicy(), is_stale=reaper.is_stale_waiter)
+
+        async def run():
+            reaper.register(chatty)
+            reaper.register(quiet)
+            queue.join_nowait(Waiter('quiet', 'chan-quiet'))
+
+            now[0] += 20
+            reaper.touch('chan-chatty')
+            now[0] += 15
+            # The quiet waiter is evicted instead of matched
+            self.assertIsNone(queue.join_nowait(Waiter('newcomer', 'chan-new')))
+            self.assertEqual(queue.evicted, 1)
+            self.assertEqual(queue.waiting_uuids(), ['newcomer'])
+
+            reaped = await reaper.sweep()
+            now[0] += 20
+            reaped_later = await reaper.sweep()
+            reaper._task.cancel()
+            return reaped, reaped_later
+
+        reaped, reaped_later = async_to_sync(run)()
+
+        self.assertEqual(reaped, [quiet])
+        self.assertTrue(quiet.reaped)
+        # The touch moved the chatty deadline to 50 s; 55 s have passed
+        self.assertEqual(reaped_later, [chatty])
+        self.assertEqual(reaper.reaped, 2)
+        self.assertEqual(len(reaper.wheel), 0)
+
+    def test_only_connections_that_ping_are_tracked(self):
+        now = [1000.0]
+        reaper = IdleReaper(timeout=30, interval=60, orphan_interval=3600, clock=lambda: now[0])
+        pinging, silent = FakeReapable('chan-pinging'), FakeReapable('chan-silent')
+
+        async def run():
+            reaper.keepalive(pinging)
+            reaper.touch('chan-silent')
+            now[0] += 20
+            reaper.keepalive(pinging)
+            now[0] += 40
+            self.assertFalse(reaper.is_stale_waiter(Waiter('silent', 'chan-silent')))
+            reaped = await reaper.sweep()
+            reaper._task.cancel()
+            return reaped
+
+        self.assertEqual(async_to_sync(run)(), [pinging])
+        self.assertFalse(silent.reaped)
+        # Off unless WEBSOCKET_IDLE_TIMEOUT is set
+        self.assertFalse(IdleReaper().enabled)
+
+
+class OrphanCleanupTests(TestCase):
+    def test_one_statement_per_table(self):
+        devices = [Device.objects.create() for _ in range(4)]
+        old = timezone.now() - timedelta(hours=5)
+        stale_call = VideoCall.objects.create(participant1=devices[0], participant2=devices[1], status='active')
+        live_call = VideoCall.objects.create(participant1=devices[2], participant2=devices[3], status='active')
+        VideoCall.objects.filter(id=stale_call.id).update(started_at=old)
+        for device in devices[:3]:
+            CallQueue.objects.create(device=device)
+        CallQueue.objects.filter(device__in=devices[:2]).update(joined_at=old)
+        CallQueue.objects.filter(device=devices[2]).update(joined_at=old)
+
+        with self.assertNumQueries(2):
+            calls, queue = cleanup_orphans(4 * 60 * 60, 600, waiting=[devices[2].uuid])
+
+        self.assertEqual((calls, queue), (1, 2))
+        stale_call.refresh_from_db()
+        live_call.refresh_from_db()
+        self.assertEqual(stale_call.status, 'failed')
+        self.assertIsNotNone(stale_call.ended_at)
+        self.assertEqual(live_call.status, 'active')
+        # Still waiting in this process, so its row stays
+        self.assertEqual(list(CallQueue.objects.values_list('device_id', flat=True)), [devices[2].uuid])
+
+    def test_orphans_are_swept_with_the_default_idle_timeout(self):
+        devices = [Device.objects.create() for _ in range(2)]
+        stale_call = VideoCall.objects.create(participant1=devices[0], participant2=devices[1], status='active')
+        VideoCall.objects.filter(id=stale_call.id).update(started_at=timezone.now() - timedelta(hours=5))
+        CallQueue.objects.create(device=devices[0])
+        CallQueue.objects.update(joined_at=timezone.now() - timedelta(hours=1))
+        # Nobody has pinged and WEBSOCKET_IDLE_TIMEOUT is 0
+        reaper = IdleReaper(interval=0.01, orphan_interval=0.01, queue=Matchmaker(FifoPolicy()))
+        self.assertFalse(reaper.enabled)
+
+        async def run():
+            reaper.start()
+            await asyncio.sleep(0.1)
+            reaper._task.cancel()
+
+        async_to_sync(run)()
+
+        stale_call.refresh_from_db()
+        self.assertEqual(stale_call.status, 'failed')
+        self.assertFalse(CallQueue.objects.exists())
+        self.assertEqual((reaper.orphan_calls, reaper.orphan_queue_entries), (1, 1))
+
+
+class RecentPartnersSeedTests(TestCase):
+    def test_seed_reads_recent_calls_in_one_query(self):
+        devices = [Device.objects.create() for _ in range(6)]
+        old = timezone.now() - timedelta(hours=2)
+        VideoCall.objects.create(participant1=devices[0], participant2=devices[1], status='active')
+        ended = VideoCall.objects.create(participant1=devices[2], participant2=devices[3], status='ended')
+        forgotten = VideoCall.objects.create(participant1=devices[4], participant2=devices[5], status='ended')
+        VideoCall.objects.filter(id=ended.id).update(started_at=old, ended_at=timezone.now())
+        VideoCall.objects.filter(id=forgotten.id).update(started_at=old, ended_at=old)
+
+        recent = RecentPartners(cooldown=600)
+        with self.assertNumQueries(1):
+            recent.seed()
+        self.assertTrue(recent.seeded)
+        self.assertTrue(recent.is_recent(devices[1].uuid, devices[0].uuid))
+        self.assertTrue(recent.is_recent(devices[2].uuid, devices[3].uuid))
+        self.assertFalse(recent.is_recent(devices[4].uuid, devices[5].uuid))
+
+
+class OutboundQueueTests(SimpleTestCase):
+    def fan_out(self, policy, clients=100, stalled=5, frames=200, key=None):
+        """Broadcast to ``clients`` queues while ``stalled`` of them stop reading"""
+        received = [[] for _ in range(clients)]
+        overflowed = []
+        queues = []
+        peak = [0] * clients
+
+        async def run():
+            never = asyncio.Event()
+
+            def make(index):
+                async def send(text_data):
+                    if index < stalled:
+                        await never.wait()
+                    received[index].append(text_data)
+
+                async def on_overflow():
+                    overflowed.append(index)
+
+                return OutboundQueue(send, on_overflow, max_size=8, policy=policy)
+
+            queues.extend(make(index) for index in range(clients))
+            for number in range(frames):
+                for index, queue in enumerate(queues):
+                    queue.put(f'frame-{number}', key=key)
+                    peak[index] = max(peak[index], len(queue))
+                # One loop turn between broadcasts, as with real group sends
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            for queue in queues:
+                queue.close()
+
+        async_to_sync(run)()
+        return queues, received, overflowed, peak
+
+    def test_healthy_clients_unaffected_by_stalled_ones(self):
+        for policy in (DROP_OLDEST, LATEST, DISCONNECT):
+            with self.subTest(policy=policy):
+                queues, received, overflowed, peak = self.fan_out(policy)
+
+                # Healthy clients got every frame, in order, without queueing up
+                for index in range(5, 100):
+                    self.assertEqual(len(received[index]), 200)
+                    self.assertEqual(received[index][-1], 'frame-199')
+                    self.assertLessEqual(peak[index], 1)
+
+                # Stalled clients never hold more than the bound
+                for index in range(5):
+                    self.assertEqual(received[index], [])
+                    self.assertLessEqual(peak[index], 8)
+
+                if policy == DISCONNECT:
+                    self.assertEqual(sorted(overflowed), [0, 1, 2, 3, 4])
+                else:
+                    self.assertEqual(overflowed, [])
+                    # One frame is stuck in send, eight wait, the rest were dropped
+                    self.assertEqual(queues[0].dropped, 200 - 1 - 8)
+
+    def test_latest_policy_keeps_one_pending_snapshot(self):
+        queues, received, overflowed, peak = self.fan_out(LATEST, clients=20, stalled=1, key='snapshot')
+
+        self.assertEqual(peak[0], 1)
+        self.assertEqual(queues[0].replaced, 198)
+        self.assertEqual(queues[0].dropped, 0)
+        self.assertEqual(len(received[1]), 200)
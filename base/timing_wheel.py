@@ -0,0 +1,65 @@
+import math
+import time
+
+
+class TimingWheel:
+    """
+    Hashed timing wheel for deadlines.
+
+    Deadlines are hashed into ``slots`` buckets of ``tick`` seconds each, so
+    scheduling, rescheduling and cancelling are O(1). ``advance`` only visits
+    the buckets for the ticks that elapsed since the last call; entries more
+    than one revolution away simply stay in their bucket until due.
+    """
+
+    def __init__(self, tick=1.0, slots=512, clock=time.monotonic):
+        self.tick = tick
+        self.clock = clock
+        self._slots = [{} for _ in range(slots)]
+        self._where = {}
+        self._current = self._tick_of(clock())
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def _tick_of(self, when):
+        return math.floor(when / self.tick)
+
+    def schedule(self, key, deadline):
+        """Expire ``key`` at ``deadline`` (in ``clock`` time); replaces any earlier deadline"""
+        self.cancel(key)
+        index = max(math.ceil(deadline / self.tick), self._current + 1) % len(self._slots)
+        self._slots[index][key] = deadline
+        self._where[key] = index
+
+    def schedule_in(self, key, delay):
+        self.schedule(key, self.clock() + delay)
+
+    def cancel(self, key):
+        index = self._where.pop(key, None)
+        if index is not None:
+            self._slots[index].pop(key, None)
+
+    def advance(self, now=None):
+        """Remove and return the keys whose deadline has passed"""
+        if now is None:
+            now = self.clock()
+        target = self._tick_of(now)
+        if target <= self._current:
+            return []
+
+        # A long pause only needs each bucket visited once
+        ticks = min(target - self._current, len(self._slots))
+        expired = []
+        for tick in range(target - ticks + 1, target + 1):
+            bucket = self._slots[tick % len(self._slots)]
+            for key, deadline in list(bucket.items()):
+                if deadline <= now:
+                    del bucket[key]
+                    del self._where[key]
+                    expired.append(key)
+        self._current = target
+        return expired
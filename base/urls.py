@@ -12,4 +12,7 @@ urlpatterns = [
     path('api/devices/', views.get_all_devices, name='get_all_devices'),
     path('api/queue-status/', views.get_queue_status, name='get_queue_status'),
     path('api/call-history/', views.get_call_history, name='get_call_history'),
+    path('api/call-stats/', views.get_call_stats, name='get_call_stats'),
+    path('api/profiling/', views.handler_profiling, name='handler_profiling'),
+    path('metrics', views.prometheus_metrics, name='metrics'),
 ]
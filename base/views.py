@@ -1,13 +1,19 @@
-from datetime import timedelta
-
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.utils import timezone
-from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework import serializers, status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 
+from base import codec, metrics, poll_cache, rollups
+from base.auth_cache import device_auth_cache
 from base.models import Device, VideoCall, CallQueue
-from base.serializers import DeviceSerializer
+from base.pagination import estimated_count, keyset, keyset_page
+from base.presence import active_device_rows, presence_store
+from base.profiling import handler_profiler
+from base.serializers import DeviceSerializer, FastDeviceSerializer
 
 
 @api_view(['POST'])
@@ -33,26 +39,15 @@ def authenticate_with_token(request):
         user_agent = request.META.get('HTTP_USER_AGENT', '')
         ip_address = request.META.get('REMOTE_ADDR')
         
-        # Get or create device with token
-        device, created = Device.objects.get_or_create(
-            token=token,
-            defaults={
-                'is_authenticated': True,
-                'user_agent': user_agent,
-                'ip_address': ip_address
-            }
-        )
-        
-        if not created:
-            device.is_authenticated = True
-            device.user_agent = user_agent
-            device.ip_address = ip_address
-            device.save()
+        # Known tokens are served from the cache and only written when changed
+        device, created = device_auth_cache.authenticate(token, user_agent, ip_address)
+        # A cached login is only a buffered heartbeat
+        presence_store.flush_if_due()
         
         serializer = DeviceSerializer(device)
         
         return Response({
-            'device_uuid': str(device.uuid),
+            'device_uuid': device.uuid,
             'message': 'Authentication successful! Welcome to onlyMC 💖',
             'device_info': serializer.data
         }, status=status.HTTP_200_OK)
@@ -83,7 +78,7 @@ def get_or_create_device(request):
         serializer = DeviceSerializer(device)
         
         return Response({
-            'uuid': str(device.uuid),
+            'uuid': device.uuid,
             'message': 'Device UUID generated successfully'
         }, status=status.HTTP_201_CREATED)
         
@@ -107,17 +102,19 @@ def update_device_activity(request):
         }, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        device = Device.objects.get(uuid=uuid_str)
-        device.save()  # This will update the last_seen field due to auto_now=True
+        if not presence_store.register(uuid_str):
+            return Response({
+                'error': 'Device not found'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        # Buffered in memory and written back in bulk by the presence store
+        presence_store.touch(uuid_str)
+        presence_store.flush_if_due()
         
         return Response({
             'message': 'Device activity updated successfully'
         }, status=status.HTTP_200_OK)
         
-    except Device.DoesNotExist:
-        return Response({
-            'error': 'Device not found'
-        }, status=status.HTTP_404_NOT_FOUND)
     except Exception as e:
         return Response({
             'error': 'Failed to update device activity',
@@ -143,20 +140,14 @@ def get_live_users(request):
     Get list of currently active authenticated users (last seen within 30 seconds)
     """
     try:
-        # Get devices active in the last 30 seconds and authenticated
-        cutoff_time = timezone.now() - timedelta(seconds=30)
-        active_devices = Device.objects.filter(
-            last_seen__gte=cutoff_time,
-            is_authenticated=True
-        ).order_by('-last_seen')
-        
-        # Serialize the data
-        serializer = DeviceSerializer(active_devices, many=True)
+        # Authenticated devices active in the last 30 seconds, from the
+        # in-process activity index; the count comes from the same rows
+        users = FastDeviceSerializer().serialize(active_device_rows(30, authenticated=True))
         
         return Response({
-            'count': active_devices.count(),
-            'users': serializer.data,
-            'timestamp': timezone.now().isoformat()
+            'count': len(users),
+            'users': users,
+            'timestamp': timezone.now()
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -166,21 +157,59 @@ def get_live_users(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@poll_cache.cached_poll(poll_cache.DEVICES)
 @api_view(['GET'])
 def get_all_devices(request):
     """
-    Get list of all devices with pagination
+    Get list of all devices, newest first, one keyset page at a time
+
+    Query parameters:
+    - cursor: ``next_cursor`` from the previous page
+    - page_size: rows per page (capped at DEVICE_PAGE_SIZE_MAX)
+    - count: ``estimated`` or ``exact`` to include the table size
+    - stream: ``1`` to stream every row after ``cursor`` as NDJSON
     """
     try:
-        devices = Device.objects.all().order_by('-last_seen')
-        serializer = DeviceSerializer(devices, many=True)
+        cursor = request.query_params.get('cursor')
         
-        return Response({
-            'count': devices.count(),
-            'devices': serializer.data,
-            'timestamp': timezone.now().isoformat()
-        }, status=status.HTTP_200_OK)
+        if request.query_params.get('stream') == '1':
+            return stream_devices(keyset(Device.objects.all(), cursor))
+        
+        page_size = min(
+            int(request.query_params.get('page_size', settings.DEVICE_PAGE_SIZE)),
+            settings.DEVICE_PAGE_SIZE_MAX
+        )
+        if page_size < 1:
+            raise ValueError('page_size must be positive')
+        
+        serializer = FastDeviceSerializer()
+        rows, next_cursor = keyset_page(
+            serializer.rows(Device.objects.all()),
+            cursor,
+            page_size,
+            key=lambda row: (row[2], row[0])
+        )
         
+        data = {
+            'devices': serializer.serialize(rows),
+            'next_cursor': next_cursor,
+            'page_size': page_size,
+            'timestamp': timezone.now()
+        }
+        
+        count_mode = request.query_params.get('count')
+        if count_mode == 'exact':
+            data['count'] = Device.objects.count()
+        elif count_mode == 'estimated':
+            data['count'] = estimated_count(Device)
+        
+        return Response(data, status=status.HTTP_200_OK)
+        
+    except ValueError as e:
+        return Response({
+            'error': 'Invalid pagination parameters',
+            'details': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
     except Exception as e:
         return Response({
             'error': 'Failed to get devices',
@@ -188,6 +217,18 @@ def get_all_devices(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+def stream_devices(queryset):
+    """Stream ``queryset`` as NDJSON, one device per line, with flat memory use"""
+    serializer = FastDeviceSerializer()
+    
+    def rows():
+        for row in serializer.rows(queryset).iterator(chunk_size=settings.DEVICE_STREAM_CHUNK_SIZE):
+            yield codec.dumpb(serializer.to_representation(row)) + b'\n'
+    
+    return StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+
+
+@poll_cache.cached_poll(poll_cache.QUEUE, poll_cache.CALLS)
 @api_view(['GET'])
 def get_queue_status(request):
     """
@@ -200,7 +241,7 @@ def get_queue_status(request):
         return Response({
             'queue_count': queue_count,
             'active_calls': active_calls,
-            'timestamp': timezone.now().isoformat()
+            'timestamp': timezone.now()
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -210,6 +251,7 @@ def get_queue_status(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@poll_cache.cached_poll(poll_cache.CALLS)
 @api_view(['GET'])
 def get_call_history(request):
     """
@@ -221,19 +263,19 @@ def get_call_history(request):
         call_data = []
         for call in calls:
             call_data.append({
-                'id': str(call.id),
-                'participant1': str(call.participant1.uuid)[:8],
-                'participant2': str(call.participant2.uuid)[:8],
-                'started_at': call.started_at.isoformat(),
-                'ended_at': call.ended_at.isoformat() if call.ended_at else None,
+                'id': call.id,
+                'participant1': str(call.participant1_id)[:8],
+                'participant2': str(call.participant2_id)[:8],
+                'started_at': call.started_at,
+                'ended_at': call.ended_at,
                 'duration_seconds': call.duration_seconds,
                 'status': call.status
             })
         
         return Response({
             'calls': call_data,
-            'total_calls': VideoCall.objects.count(),
-            'timestamp': timezone.now().isoformat()
+            'total_calls': rollups.total_calls(),
+            'timestamp': timezone.now()
         }, status=status.HTTP_200_OK)
         
     except Exception as e:
@@ -243,6 +285,80 @@ def get_call_history(request):
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+@poll_cache.cached_poll(poll_cache.QUEUE, poll_cache.CALLS)
+@api_view(['GET'])
+def get_call_stats(request):
+    """
+    Get hourly call volume, durations and peak queue depth from the rollups
+    """
+    try:
+        hours = min(int(request.query_params.get('hours', 24)), 24 * 90)
+        if hours < 1:
+            raise ValueError('hours must be positive')
+        
+        buckets, totals = rollups.summarize(rollups.recent_buckets(hours))
+        
+        return Response({
+            'hours': hours,
+            'buckets': buckets,
+            'totals': totals,
+            'timestamp': timezone.now()
+        }, status=status.HTTP_200_OK)
+        
+    except ValueError as e:
+        return Response({
+            'error': 'Invalid hours',
+            'details': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({
+            'error': 'Failed to get call stats',
+            'details': str(e)
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def prometheus_metrics(request):
+    """
+    Expose this process's metrics in the Prometheus text format
+    """
+    return HttpResponse(await metrics.registry.render(), content_type=metrics.registry.content_type)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAdminUser])
+def handler_profiling(request):
+    """
+    Inspect or reconfigure WebSocket handler sampling in this process
+
+    POST fields (all optional):
+    - sample_rate: profile one in N messages; 0 turns sampling off
+    - slowest: how many of the slowest samples to keep
+    - cprofile: dump a cProfile file for each kept sample
+    - reset: forget collected samples first
+    """
+    if request.method == 'POST':
+        # Form posts send "false"/"0" as strings, so parse flags like DRF does
+        flag = serializers.BooleanField()
+        try:
+            cprofile = request.data.get('cprofile')
+            if cprofile is not None:
+                cprofile = flag.to_internal_value(cprofile)
+            if 'reset' in request.data and flag.to_internal_value(request.data.get('reset')):
+                handler_profiler.reset()
+            handler_profiler.configure(
+                sample_rate=request.data.get('sample_rate'),
+                slowest=request.data.get('slowest'),
+                cprofile=cprofile
+            )
+        except (TypeError, ValueError, serializers.ValidationError) as e:
+            return Response({
+                'error': 'Invalid profiling settings',
+                'details': ' '.join(e.detail) if isinstance(e, serializers.ValidationError) else str(e)
+            }, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(handler_profiler.report(), status=status.HTTP_200_OK)
+
+
 def live_users_dashboard(request):
     """
     Render the onlyMC admin dashboard
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -76,12 +77,26 @@ WSGI_APPLICATION = "main.wsgi.application"
 # ASGI application for Channels
 ASGI_APPLICATION = "main.asgi.application"
 
+# Redis is optional; set REDIS_URL to share channels, the matchmaking queue
+# and call state between several ASGI workers
+REDIS_URL = os.environ.get("REDIS_URL")
+
 # Channel layer configuration
-CHANNEL_LAYERS = {
-    "default": {
-        "BACKEND": "channels.layers.InMemoryChannelLayer"
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {
+                "hosts": [REDIS_URL],
+            },
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels.layers.InMemoryChannelLayer"
+        }
     }
-}
 
 
 # Database
@@ -149,7 +164,127 @@ REST_FRAMEWORK = {
     "DEFAULT_PERMISSION_CLASSES": [
         "rest_framework.permissions.AllowAny",
     ],
+    # orjson-backed when installed, stdlib json otherwise (see base/codec.py)
     "DEFAULT_RENDERER_CLASSES": [
-        "rest_framework.renderers.JSONRenderer",
+        "base.renderers.CodecJSONRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "base.renderers.CodecJSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
     ],
 }
+
+# Presence settings
+# Seconds between bulk write-backs of buffered device heartbeats
+PRESENCE_FLUSH_INTERVAL = 5
+# Seconds between presence snapshot ticks; changes within a tick are merged
+# into one broadcast (0 publishes every change straight away)
+PRESENCE_BROADCAST_WINDOW = 0.25
+# Snapshot groups per worker; each live-users connection joins one, and a
+# tick sends to them in turn so one group_send never covers every client
+PRESENCE_SHARDS = 8
+# Seconds between re-reads of the shared snapshot while a worker has
+# live-users connections, so changes made on other workers still reach them
+# (0 turns it off; only this worker's changes are published then)
+PRESENCE_SYNC_INTERVAL = 2
+# Answer active-user counts and lists from an in-process index of recent
+# heartbeats instead of a last_seen range query. It only sees this worker's
+# heartbeats, so it is off when workers share state through Redis
+PRESENCE_INDEX = not REDIS_URL
+# Seconds of activity the index keeps (one bucket each); longer windows
+# still go to the database
+PRESENCE_INDEX_HORIZON = 60
+# Frames buffered per live-users connection, and what happens when a client
+# stops reading and its buffer is full: "latest" (a newer snapshot replaces
+# the pending one, other frames drop the oldest), "drop_oldest" or
+# "disconnect" (close with code 4429)
+OUTBOUND_QUEUE_SIZE = 32
+OUTBOUND_QUEUE_POLICY = "latest"
+
+# Matchmaking settings
+# Pairing policy used by the video call queue
+MATCHMAKING_POLICY = "base.matchmaking.PreferencePolicy"
+if REDIS_URL:
+    MATCHMAKING_BACKEND = "base.redis_backend.RedisMatchmaker"
+    CALL_SESSION_BACKEND = "base.redis_backend.RedisCallSessionStore"
+else:
+    MATCHMAKING_BACKEND = "base.matchmaking.Matchmaker"
+    CALL_SESSION_BACKEND = "base.call_sessions.InMemoryCallSessionStore"
+# Seconds after a call during which the same two devices aren't matched
+# again (0 allows it), and how many recent pairs are remembered. In-process
+# queue only
+MATCHMAKING_REPEAT_COOLDOWN = 300
+MATCHMAKING_RECENT_PAIRS = 100000
+# Seconds before an abandoned queue entry / call session expires in Redis;
+# workers refresh the entries of users still waiting every third of this
+MATCHMAKING_WAITER_TTL = 600
+CALL_SESSION_TTL = 4 * 60 * 60
+
+# Signaling settings
+# Relay WebRTC offer/answer/ICE frames verbatim instead of re-encoding them
+SIGNALING_PASSTHROUGH = True
+# Seconds to collect trickled ICE candidates into one webrtc_ice_batch
+# message (e.g. 0.005); 0 relays each candidate on its own
+SIGNALING_ICE_BATCH_WINDOW = 0
+# Queued call/queue writes applied per background batch
+CALL_PERSISTENCE_BATCH_SIZE = 200
+
+# Authentication settings
+# Validated tokens kept in the per-process device cache, and for how long
+AUTH_CACHE_SIZE = 10000
+AUTH_CACHE_TTL = 300
+
+# Device listing settings
+# Default and maximum page size for /api/devices/, and rows fetched per
+# round trip when streaming it as NDJSON (?stream=1)
+DEVICE_PAGE_SIZE = 100
+DEVICE_PAGE_SIZE_MAX = 1000
+DEVICE_STREAM_CHUNK_SIZE = 2000
+
+# Cache settings
+# Shared through Redis when available so version bumps reach every worker
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+# Upper bound in seconds on how long a polled endpoint's cached response
+# lives when nothing bumps its version (time-derived fields drift)
+POLL_CACHE_TIMEOUT = 10
+
+# Admin dashboard settings
+# Seconds between admin_metrics pushes on ws/admin-metrics/
+ADMIN_METRICS_INTERVAL = 2
+
+# Metrics settings
+# Record handler, channel layer and database latencies for /metrics; queue,
+# call and open socket gauges are reported either way
+METRICS_ENABLED = True
+
+# Profiling settings
+# Sample one in N WebSocket messages per process (0 = off); can also be
+# changed at runtime by staff through /api/profiling/
+PROFILING_SAMPLE_RATE = int(os.environ.get("PROFILING_SAMPLE_RATE", 0))
+# Slowest samples kept per process, and whether each gets a cProfile dump
+# (written to PROFILING_DIR, default: <tmp>/zest-profiles)
+PROFILING_SLOWEST = 10
+PROFILING_CPROFILE = os.environ.get("PROFILING_CPROFILE") == "1"
+
+# Idle reaper settings
+# Seconds without any message before a WebSocket that has sent a "ping" is
+# closed and its queue entry and call are cleaned up; sockets that never ping
+# are not tracked. 0 disables; dead sockets are still dropped by the server's
+# own ping/pong (e.g. daphne --ping-interval/--ping-timeout)
+WEBSOCKET_IDLE_TIMEOUT = int(os.environ.get("WEBSOCKET_IDLE_TIMEOUT", 0))
+IDLE_SWEEP_INTERVAL = 5
+# Seconds between sweeps for calls and queue rows left by crashed workers
+ORPHAN_SWEEP_INTERVAL = 60